@@ -0,0 +1,72 @@
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from models import TaskPriority, TaskStatus
+from storage import Storage
+
+
+def make_projects(project_count: int, task_count: int) -> dict:
+    """builds projects shaped like the ones main.py stores."""
+    projects = {}
+    now = datetime.now()
+    statuses = [status.name for status in TaskStatus]
+    priorities = [priority.name for priority in TaskPriority]
+    for p in range(project_count):
+        members = [f"user{p}_{m}" for m in range(5)]
+        tasks = []
+        for t in range(task_count):
+            start = now + timedelta(minutes=t)
+            tasks.append({
+                'task_id': str(uuid.uuid4()),
+                'title': f"task {t}",
+                'description': f"description of task {t} in project {p}",
+                'start_time': start.isoformat(),
+                'end_time': (start + timedelta(hours=24)).isoformat(),
+                'assignees': members[:2],
+                'priority': priorities[t % len(priorities)],
+                'status': statuses[t % len(statuses)],
+                'history': [{'change': 'title', 'user': members[0], 'time': start.isoformat()}],
+                'comments': [{'username': members[1], 'content': 'looks good', 'timestamp': start.isoformat()}]
+            })
+        projects[f"project{p}"] = {'title': f"project {p}", 'owner': members[0], 'members': members,
+                                   'tasks': tasks}
+    return projects
+
+
+def measure(projects: dict, file_format: str, rounds: int) -> tuple:
+    """returns the save time, load time and file size of one format."""
+    Storage.FORMAT = file_format
+    Storage.CACHE = False
+    save_time = load_time = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        Storage.save_projects(projects)
+        save_time += time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = Storage.load_projects()
+        load_time += time.perf_counter() - start
+        assert loaded == projects
+    size = os.path.getsize(Storage.disk_path(Storage.PROJECTS_FILE))
+    return save_time / rounds, load_time / rounds, size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the JSON and binary data file formats.")
+    parser.add_argument('--projects', type=int, default=100, help="Number of projects.")
+    parser.add_argument('--tasks', type=int, default=100, help="Tasks per project.")
+    parser.add_argument('--rounds', type=int, default=3, help="Rounds to average.")
+    args = parser.parse_args()
+
+    data = make_projects(args.projects, args.tasks)
+    with tempfile.TemporaryDirectory() as data_dir:
+        Storage.set_data_dir(data_dir)
+        print(f"{args.projects} projects x {args.tasks} tasks, average of {args.rounds} rounds")
+        print(f"{'format':<8}{'save (s)':>12}{'load (s)':>12}{'size (KB)':>12}")
+        for name in ('json', 'binary'):
+            save, load, size = measure(data, name, args.rounds)
+            print(f"{name:<8}{save:>12.4f}{load:>12.4f}{size / 1024:>12.1f}")
+
+# python benchmark.py --projects 100 --tasks 100
@@ -0,0 +1,83 @@
+import json
+import marshal
+
+MAGIC = b'TRLM\x02'
+# marshal formats are only read by the Python that can write them; version 4 is read by every Python 3.4+
+MARSHAL_VERSION = 4
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(read) -> int:
+    result = 0
+    shift = 0
+    while True:
+        byte = read(1)
+        if not byte:
+            raise ValueError("unexpected end of binary data")
+        result |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return result
+        shift += 7
+
+
+def _dump_value(value) -> bytes:
+    try:
+        return marshal.dumps(value, MARSHAL_VERSION)
+    except ValueError:
+        # values json would write with default=str are stored the way json stores them
+        return marshal.dumps(json.loads(json.dumps(value, default=str)), MARSHAL_VERSION)
+
+
+class BinaryFormat:
+    """A binary encoding of the JSON data files that is faster to read and write than JSON.
+
+    The file holds the number of entries of the top-level object and then
+    each key and the marshal encoding of its value, both length-prefixed, so
+    readers can stream the file one entry at a time. marshal builds the
+    dictionaries and lists directly in C, without parsing text.
+    """
+
+    @staticmethod
+    def dumps(data: dict) -> bytes:
+        """encodes a dictionary"""
+        parts = [MAGIC, _varint(len(data))]
+        for key, value in data.items():
+            key_data = str(key).encode()
+            value_data = _dump_value(value)
+            parts += [_varint(len(key_data)), key_data, _varint(len(value_data)), value_data]
+        return b''.join(parts)
+
+    @staticmethod
+    def loads(data: bytes) -> dict:
+        """decodes what dumps produced"""
+        view = memoryview(data)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError("not a binary data file")
+        pos = len(MAGIC)
+
+        def read(size: int):
+            nonlocal pos
+            pos += size
+            return view[pos - size:pos]
+        result = {}
+        for _ in range(_read_varint(read)):
+            key = bytes(read(_read_varint(read))).decode()
+            result[key] = marshal.loads(read(_read_varint(read)))
+        return result
+
+    @staticmethod
+    def iter_object(file):
+        """yields the top-level (key, value) pairs of a binary file one by one"""
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("not a binary data file")
+        for _ in range(_read_varint(file.read)):
+            key = file.read(_read_varint(file.read)).decode()
+            yield key, marshal.loads(file.read(_read_varint(file.read)))
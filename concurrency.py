@@ -0,0 +1,116 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+MISSING = object()
+
+
+class ConflictError(Exception):
+    """Raised when two sessions changed the same value of a project in different ways."""
+
+    def __init__(self, project_id: str, path: list):
+        self.project_id = project_id
+        self.path = path
+        where = '/'.join(str(part) for part in path) or 'project'
+        super().__init__(f"project {project_id} was changed by another session ({where})")
+
+
+class ProjectsDict(dict):
+    """The projects dictionary returned by Storage, remembering what it looked like when it was loaded."""
+    base = None
+
+
+@contextmanager
+def file_lock(path: str):
+    """Holds an exclusive lock on path + '.lock' for the duration of the block."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with open(path + '.lock', 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def merge_project(project_id: str, base, ours, theirs):
+    """Returns the project with the changes of both sessions, bumping its version.
+
+    base is the project as this session loaded it, ours is what this session
+    wants to save and theirs is what is on disk now. If nobody else saved the
+    project since it was loaded (same version) ours is taken as it is.
+    """
+    base_version = base.get('version', 0) if base else 0
+    if theirs is None or theirs.get('version', 0) == base_version:
+        merged = dict(ours)
+    else:
+        merged = _merge(project_id, base or {}, ours, theirs, [])
+    merged['version'] = max(base_version, theirs.get('version', 0) if theirs else 0) + 1
+    return merged
+
+
+def merge_projects(base: dict, ours: dict, theirs: dict) -> dict:
+    """Applies the projects this session added, changed or removed on top of the projects on disk."""
+    merged = dict(theirs)
+    for project_id, project in ours.items():
+        old = base.get(project_id)
+        if project == old:
+            continue
+        if old is None and project_id in theirs and theirs[project_id] != project:
+            raise ConflictError(project_id, [])
+        merged[project_id] = merge_project(project_id, old, project, theirs.get(project_id))
+        project['version'] = merged[project_id]['version']
+    for project_id in base:
+        if project_id not in ours:
+            merged.pop(project_id, None)
+    return merged
+
+
+def _merge(project_id: str, base, ours, theirs, path: list):
+    if ours == theirs or theirs == base:
+        return ours
+    if ours == base:
+        return theirs
+    if isinstance(ours, dict) and isinstance(theirs, dict) and isinstance(base, dict):
+        merged = {}
+        for key in list(theirs) + [key for key in ours if key not in theirs]:
+            if key == 'version':
+                continue
+            value = _merge(project_id, base.get(key, MISSING), ours.get(key, MISSING), theirs.get(key, MISSING),
+                           path + [key])
+            if value is not MISSING:
+                merged[key] = value
+        return merged
+    if isinstance(ours, list) and isinstance(theirs, list) and isinstance(base, list):
+        if _keyed_by_task_id(base, ours, theirs):
+            merged = _merge(project_id, _by_task_id(base), _by_task_id(ours), _by_task_id(theirs), path)
+            return list(merged.values())
+        size = len(base)
+        if ours[:size] == base and theirs[:size] == base:
+            # history and comments only grow, so both sessions' new entries are kept
+            return theirs + ours[size:]
+        if all(isinstance(item, str) for item in base + ours + theirs):
+            removed = set(base) - set(ours)
+            return [item for item in theirs if item not in removed] + \
+                [item for item in ours if item not in base and item not in theirs]
+    raise ConflictError(project_id, path)
+
+
+def _keyed_by_task_id(*lists) -> bool:
+    return all(isinstance(item, dict) and 'task_id' in item for items in lists for item in items)
+
+
+def _by_task_id(tasks: list) -> dict:
+    return {task['task_id']: task for task in tasks}
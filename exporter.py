@@ -0,0 +1,87 @@
+import csv
+import json
+from datetime import datetime
+from storage import Storage
+
+TASK_FIELDS = ['project_id', 'task_id', 'title', 'description', 'start_time', 'end_time', 'assignees', 'priority',
+               'status']
+CSV_FIELDS = ['type', 'username', 'email', 'is_active', 'project_id', 'owner', 'members'] + TASK_FIELDS[1:] + \
+             ['history', 'comments']
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_users():
+    """Yields one record per user, without the password."""
+    for username, user in Storage.iter_users():
+        yield {'type': 'user', 'username': username, 'email': user.get('email'),
+               'is_active': user.get('is_active', True)}
+
+
+def iter_projects(project_ids=None):
+    """Yields one record per project, without its tasks."""
+    for project_id, project in Storage.iter_projects(fields=('title', 'owner', 'members')):
+        if project_ids is None or project_id in project_ids:
+            yield {'type': 'project', 'project_id': project_id, 'title': project.get('title'),
+                   'owner': project.get('owner'), 'members': project.get('members', [])}
+
+
+def iter_tasks(project_ids=None, statuses=None, since=None, until=None, details: bool = False):
+    """Yields one flat record per task, reading one project at a time.
+
+    since and until are datetimes compared with the start time of the task;
+    details adds the history and comments.
+    """
+    for project_id, project in Storage.iter_projects():
+        if project_ids is not None and project_id not in project_ids:
+            continue
+        if details:
+            Storage.load_project_details(project_id, project)
+        for task in project.get('tasks', {}).values():
+            if statuses is not None and task.get('status') not in statuses:
+                continue
+            if since is not None or until is not None:
+                start = _parse_time(task.get('start_time'))
+                if start is None or (since is not None and start < since) or (until is not None and start > until):
+                    continue
+            record = {'type': 'task', 'project_id': project_id}
+            record.update((field, task.get(field)) for field in TASK_FIELDS[1:])
+            if details:
+                record['history'] = task.get('history', [])
+                record['comments'] = task.get('comments', [])
+            yield record
+
+
+def write_jsonl(records, file) -> int:
+    """writes one JSON object per line and returns how many were written."""
+    count = 0
+    for record in records:
+        file.write(json.dumps(record, default=str) + '\n')
+        count += 1
+    return count
+
+
+def write_csv(records, file) -> int:
+    """Writes the records as CSV rows and returns how many were written.
+
+    Lists of usernames are joined with ';', history and comments are written as JSON.
+    """
+    writer = csv.DictWriter(file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for record in records:
+        row = dict(record)
+        for field in ('members', 'assignees'):
+            if field in row:
+                row[field] = ';'.join(row[field] or [])
+        for field in ('history', 'comments'):
+            if field in row:
+                row[field] = json.dumps(row[field], default=str)
+        writer.writerow(row)
+        count += 1
+    return count
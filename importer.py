@@ -0,0 +1,148 @@
+import csv
+import itertools
+import json
+import time
+from models import Project, Task, TaskPriority, TaskStatus, User
+from search import SearchIndex
+from storage import Storage
+from utils import Utils
+
+RECORD_TYPES = ('user', 'project', 'member', 'task')
+
+
+class RecordError(Exception):
+    """Raised for a record that cannot be imported."""
+
+
+def iter_records(file_path: str):
+    """Yields (line number, record) from a JSONL or CSV file without reading it all.
+
+    In CSV files the assignees column holds usernames separated by ';'.
+    """
+    with open(file_path, newline='') as file:
+        if file_path.endswith('.csv'):
+            reader = csv.DictReader(file)
+            for row in reader:
+                record = {key: value for key, value in row.items() if value not in (None, '')}
+                if 'assignees' in record:
+                    record['assignees'] = [name.strip() for name in record['assignees'].split(';')]
+                yield reader.line_num, record
+        else:
+            for number, line in enumerate(file, 1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except json.JSONDecodeError as e:
+                        yield number, {'type': None, 'error': str(e)}
+
+
+def _field(record: dict, name: str) -> str:
+    value = record.get(name)
+    if not value:
+        raise RecordError(f"missing {name}")
+    return value
+
+
+def apply_record(record: dict, users: dict, projects: dict, boards: dict, emails: dict, task_ids: set,
+                 index: SearchIndex) -> None:
+    """Adds one record to the loaded users and projects, raising RecordError if it is invalid.
+
+    Tasks are added to the Project objects in boards, which the caller writes
+    back into projects at the end. A task without assignees is open to every
+    member, like one added without assignees in the menu. task_ids holds the
+    ids of the tasks of every project; an explicit task_id must not be in it,
+    since the search index and the sqlite tasks table key tasks by id alone.
+    """
+    kind = record.get('type')
+    if kind not in RECORD_TYPES:
+        raise RecordError(record.get('error') or f"unknown record type {kind!r}")
+    if kind == 'user':
+        username, email = _field(record, 'username'), _field(record, 'email')
+        if not Utils.validate_username(username):
+            raise RecordError(f"invalid username {username}")
+        if not Utils.validate_email(email):
+            raise RecordError(f"invalid email {email}")
+        if username in users or email in emails:
+            raise RecordError(f"username or email of {username} already exists")
+        user = User(username, Utils.hash_password(_field(record, 'password')), email)
+        users[username] = user.to_dict()
+        emails[email] = username
+        return
+    project_id = _field(record, 'project_id')
+    if kind == 'project':
+        owner = _field(record, 'owner')
+        if project_id in projects:
+            raise RecordError(f"project {project_id} already exists")
+        if owner not in users:
+            raise RecordError(f"user {owner} not found")
+        projects[project_id] = Project(project_id, _field(record, 'title'), owner).to_dict()
+        return
+    if project_id not in projects:
+        raise RecordError(f"project {project_id} not found")
+    project = projects[project_id]
+    if kind == 'member':
+        username = _field(record, 'username')
+        if username not in users:
+            raise RecordError(f"user {username} not found")
+        if username not in project['members']:
+            project['members'].append(username)
+        return
+    assignees = record.get('assignees') or [""]
+    if not set(assignees).issubset(project['members'] + [""]):
+        raise RecordError("all assignees must be project members")
+    priority = record.get('priority', TaskPriority.LOW.name)
+    status = record.get('status', TaskStatus.BACKLOG.name)
+    if priority not in TaskPriority.__members__ or status not in TaskStatus.__members__:
+        raise RecordError(f"invalid priority {priority} or status {status}")
+    task = Task(_field(record, 'title'), record.get('description', ''), assignees, priority, status)
+    if record.get('task_id'):
+        if record['task_id'] in task_ids:
+            raise RecordError(f"task {record['task_id']} already exists")
+        task.set_id(record['task_id'])
+    if project_id not in boards:
+        boards[project_id] = Project.from_dict(project_id, Storage.normalize_project(project))
+    task_data = task.to_dict()
+    task_ids.add(task_data['task_id'])
+    boards[project_id].add_task(task_data)
+    index.index_task(project_id, task_data)
+
+
+def import_records(records, chunk_size: int = 1000, progress=None) -> dict:
+    """Imports (line number, record) pairs chunk by chunk and writes each data file once at the end.
+
+    progress is called with the running totals after every chunk. Returns the
+    totals: imported and skipped records, the errors as (line, message) and the
+    time taken.
+    """
+    totals = {'imported': 0, 'skipped': 0, 'errors': [], 'seconds': 0.0}
+    start = time.perf_counter()
+    records = iter(records)
+    with Storage.batch():
+        users = Storage.load_users()
+        projects = Storage.load_projects()
+        emails = {user['email']: username for username, user in users.items()}
+        task_ids = {task_id for project in projects.values() for task_id in Storage.normalize_project(project)['tasks']}
+        boards = {}
+        index = SearchIndex()
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            for number, record in chunk:
+                try:
+                    apply_record(record, users, projects, boards, emails, task_ids, index)
+                    totals['imported'] += 1
+                except RecordError as e:
+                    totals['skipped'] += 1
+                    totals['errors'].append((number, str(e)))
+            totals['seconds'] = time.perf_counter() - start
+            if progress is not None:
+                progress(totals)
+        for project_id, board in boards.items():
+            projects[project_id].update(board.to_dict())
+        Storage.save_users(users)
+        Storage.save_projects(projects)
+        SearchIndex.merge(index)
+    Storage.rebuild_membership()
+    totals['seconds'] = time.perf_counter() - start
+    return totals
@@ -0,0 +1,104 @@
+import json
+import os
+
+
+class Journal:
+    """An append-only change log that is kept next to a JSON snapshot file."""
+
+    @staticmethod
+    def log_path(file_path: str) -> str:
+        """returns the path of the log file that belongs to a snapshot."""
+        return file_path + '.log'
+
+    @staticmethod
+    def diff(old: dict, new: dict, path=None) -> list:
+        """Compares two dictionaries and returns the records that turn old into new."""
+        if path is None:
+            path = []
+        records = []
+        for key in old:
+            if key not in new:
+                records.append({'op': 'del', 'path': path + [key]})
+        for key, value in new.items():
+            if key not in old:
+                records.append({'op': 'set', 'path': path + [key], 'value': value})
+            elif old[key] != value:
+                if isinstance(value, dict) and isinstance(old[key], dict):
+                    records.extend(Journal.diff(old[key], value, path + [key]))
+                elif Journal._grown(old[key], value):
+                    records.append(Journal.append_record(path + [key], len(old[key]), value[len(old[key]):]))
+                else:
+                    records.append({'op': 'set', 'path': path + [key], 'value': value})
+        return records
+
+    @staticmethod
+    def _grown(old, new) -> bool:
+        return isinstance(old, list) and isinstance(new, list) and len(new) > len(old) and new[:len(old)] == old
+
+    @staticmethod
+    def append_record(path: list, at: int, values: list) -> dict:
+        """returns the record that adds values to the list at path, which held at items before."""
+        return {'op': 'append', 'path': path, 'at': at, 'values': values}
+
+    @staticmethod
+    def apply(data: dict, record: dict) -> None:
+        """Applies one record to the data.
+
+        set and del are idempotent and append writes its values from the
+        position the list had, so replaying twice is safe.
+        """
+        *parents, key = record['path']
+        target = data
+        for part in parents:
+            target = target.setdefault(part, {})
+        if record['op'] == 'set':
+            target[key] = record['value']
+        elif record['op'] == 'del':
+            target.pop(key, None)
+        elif record['op'] == 'append':
+            items = target.setdefault(key, [])
+            items[record['at']:record['at'] + len(record['values'])] = record['values']
+
+    @staticmethod
+    def append(file_path: str, records: list) -> None:
+        """Appends the records to the end of the log file."""
+        lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        with open(Journal.log_path(file_path), 'a') as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def replay(file_path: str, data: dict) -> int:
+        """Applies the log to the snapshot data and returns the number of records."""
+        log_path = Journal.log_path(file_path)
+        if not os.path.exists(log_path):
+            return 0
+        count = 0
+        with open(log_path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a crash in the middle of an append leaves a torn last line
+                    break
+                Journal.apply(data, record)
+                count += 1
+        return count
+
+    @staticmethod
+    def count(file_path: str) -> int:
+        """returns the number of records in the log."""
+        log_path = Journal.log_path(file_path)
+        if not os.path.exists(log_path):
+            return 0
+        with open(log_path, 'rb') as file:
+            return sum(1 for _ in file)
+
+    @staticmethod
+    def truncate(file_path: str) -> None:
+        """Removes the log after its records were written into the snapshot."""
+        log_path = Journal.log_path(file_path)
+        if os.path.exists(log_path):
+            os.remove(log_path)
@@ -0,0 +1,77 @@
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+def iter_object(file, chunk_size: int = 1 << 16):
+    """Yields the (key, value) pairs of the top-level JSON object in the file one by one.
+
+    Only the value that is being decoded is held in memory, not the whole document.
+    """
+    decoder = json.JSONDecoder()
+    reader = _Reader(file, chunk_size)
+    if reader.next_char() != '{':
+        raise ValueError("expected a JSON object")
+    reader.pos += 1
+    if reader.next_char() == '}':
+        return
+    while True:
+        key = reader.decode(decoder)
+        if reader.next_char() != ':':
+            raise ValueError("expected ':' after an object key")
+        reader.pos += 1
+        reader.next_char()
+        value = reader.decode(decoder)
+        yield key, value
+        separator = reader.next_char()
+        reader.pos += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError("expected ',' or '}' after an object value")
+        reader.next_char()
+
+
+class _Reader:
+    """keeps a small window of the file and reads more only when the decoder needs it"""
+
+    def __init__(self, file, chunk_size: int):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read_more(self, size: int) -> None:
+        chunk = self.file.read(size)
+        if not chunk:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def next_char(self) -> str:
+        """skips whitespace and returns the next character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                raise ValueError("unexpected end of JSON data")
+            self._read_more(self.chunk_size)
+
+    def decode(self, decoder: json.JSONDecoder):
+        """decodes the value at the current position, reading more of the file until it is complete"""
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read_more(size)
+            size *= 2
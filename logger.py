@@ -1,3 +1,223 @@
-from loguru import logger as log1
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from loguru import logger
 
-log1.add('data/file.log', rotation="500 MB", level="INFO")
+# where the JSON records are written; the sink is added on the first log call
+LOG_FILE = os.environ.get('TRELLOMIZE_LOG_FILE', os.path.join('data', 'file.log'))
+ROTATION = 500 * 1024 * 1024
+LEVEL = "INFO"
+# loguru's default handler prints every record to stderr while the caller waits
+CONSOLE = os.environ.get('TRELLOMIZE_LOG_CONSOLE') == '1'
+
+# records are written by a background thread, up to BATCH_SIZE per write and at
+# least every FLUSH_INTERVAL seconds; a full queue drops records instead of waiting
+# and the next batch records how many were dropped
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 0.5
+QUEUE_SIZE = 100000
+
+# loguru adds this handler, printing to stderr, when it is imported
+DEFAULT_HANDLER = 0
+
+
+def parse_sampling(value: str) -> dict:
+    """parses action=rate pairs separated by commas, ignoring the ones that are not valid."""
+    rates = {}
+    for item in value.split(','):
+        action, _, rate = item.partition('=')
+        try:
+            rate = float(rate)
+        except ValueError:
+            continue
+        if action.strip():
+            rates[action.strip()] = rate
+    return rates
+
+
+# the share of events of an action that is logged, e.g. TRELLOMIZE_LOG_SAMPLING=search=0.1,task_updated=0.5;
+# actions that are not listed are always logged
+SAMPLING = parse_sampling(os.environ.get('TRELLOMIZE_LOG_SAMPLING', ''))
+
+
+class BatchSink:
+    """A loguru sink that queues records and writes them as JSON lines from a background thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def __call__(self, message) -> None:
+        record = message.record
+        self.put(record['time'].timestamp(), record['level'].name, record['message'], record['extra'])
+
+    def put(self, timestamp: float, level: str, text: str, extra: dict) -> None:
+        """queues one record; formatting it is left to the writer thread."""
+        try:
+            self.queue.put_nowait((timestamp, level, text, extra))
+        except queue.Full:
+            self.dropped += 1
+
+    @staticmethod
+    def _json(entry) -> str:
+        timestamp, level, text, extra = entry
+        data = {'time': datetime.fromtimestamp(timestamp).astimezone().isoformat(), 'level': level, 'message': text}
+        data.update(extra)
+        return json.dumps(data, default=str)
+
+    def _write(self, entries: list) -> None:
+        if not entries:
+            return
+        with self.lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= ROTATION:
+                os.replace(self.path, f"{self.path}.{time.strftime('%Y-%m-%d_%H-%M-%S')}")
+            lines = [self._json(entry) + '\n' for entry in entries]
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(self._json((time.time(), 'WARNING', 'records_dropped', {'count': dropped})) + '\n')
+            with open(self.path, 'a') as file:
+                file.write(''.join(lines))
+
+    def _drain(self, entries: list) -> list:
+        while len(entries) < BATCH_SIZE:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return entries
+
+    def _run(self) -> None:
+        while not self.closed:
+            try:
+                entries = [self.queue.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            self._write_batch(self._drain(entries))
+
+    def _write_batch(self, entries: list) -> None:
+        try:
+            self._write(entries)
+        except OSError:
+            pass
+        finally:
+            for _ in entries:
+                self.queue.task_done()
+
+    def flush(self) -> None:
+        """writes every queued record, waiting for the batch the thread is writing."""
+        while not self.queue.empty():
+            self._write_batch(self._drain([]))
+        self.queue.join()
+
+    def close(self) -> None:
+        """stops the writer thread after writing every queued record."""
+        self.closed = True
+        self.thread.join()
+        self.flush()
+
+
+_sink = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+def setup() -> BatchSink:
+    """adds the batching file sink once and returns it."""
+    global _sink, _handler
+    if _sink is None:
+        with _setup_lock:
+            if _sink is None:
+                sink = BatchSink(LOG_FILE)
+                if not CONSOLE:
+                    # only loguru's own stderr handler; handlers others added stay
+                    try:
+                        logger.remove(DEFAULT_HANDLER)
+                    except ValueError:
+                        pass
+                _handler = logger.add(sink, level=LEVEL, format="{message}")
+                atexit.register(sink.flush)
+                _sink = sink
+    return _sink
+
+
+def shutdown() -> None:
+    """Writes the queued records and removes the file sink.
+
+    The next log call adds a new sink for LOG_FILE, so it can be pointed elsewhere in between.
+    """
+    global _sink, _handler
+    with _setup_lock:
+        sink, handler, _sink, _handler = _sink, _handler, None, None
+    if sink is not None:
+        logger.remove(handler)
+        sink.close()
+
+
+def flush() -> None:
+    """writes the records that are still queued, if anything was logged."""
+    if _sink is not None:
+        _sink.flush()
+
+
+class _LazyLogger:
+    """The loguru logger, adding the file sink the first time it is used."""
+
+    def __getattr__(self, name):
+        setup()
+        return getattr(logger, name)
+
+
+log1 = _LazyLogger()
+
+
+def sampled(action: str) -> bool:
+    """returns whether an event of the action should be logged, see SAMPLING."""
+    rate = SAMPLING.get(action, 1.0)
+    return rate >= 1.0 or random.random() < rate
+
+
+def log_event(action: str, actor: str = None, project_id: str = None, task_id: str = None, duration: float = None,
+              level: str = "INFO", **fields) -> None:
+    """Logs a structured record of an action; the message is the action and the other arguments are fields.
+
+    The record goes straight to the queue of the file sink, without loguru
+    building a record, unless CONSOLE is set. Events of sampled actions that
+    are skipped cost one random number.
+    """
+    if not sampled(action):
+        return
+    sink = setup()
+    values = {'actor': actor, 'action': action, 'project_id': project_id, 'task_id': task_id, 'duration': duration}
+    extra = {field: value for field, value in values.items() if value is not None}
+    extra.update(fields)
+    if CONSOLE:
+        logger.bind(**extra).log(level, action)
+    elif logger.level(level).no >= logger.level(LEVEL).no:
+        sink.put(time.time(), level, action, extra)
+
+
+@contextmanager
+def timed(action: str, actor: str = None, project_id: str = None, task_id: str = None, **fields):
+    """Logs the action with how long the block took in seconds, also if it raised.
+
+    The block gets the fields dict and can add results to it.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        log_event(action, actor, project_id, task_id, round(time.perf_counter() - start, 6), **fields)
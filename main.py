@@ -1,212 +1,133 @@
-import hashlib
-from models import User, Project, Task, TaskPriority, TaskStatus
+import itertools
+from models import BOARD_SORTS, TaskPriority, TaskStatus
+from concurrency import ConflictError
+from service import PermissionDeniedError, ServiceError, TrelloService
+from session import AuthenticationError, InactiveUserError, Sessions
 from storage import Storage
 from logger import log1
-from utils import Utils
 from rich.console import Console
 from rich.table import Table
+from rich.markup import escape
 from rich.prompt import Prompt
-from datetime import datetime, timedelta
+from datetime import datetime
 
 console = Console()
 
 current_user = None
+current_token = None
+service = None
 loop_task_def = None
 
+# tasks shown per board column at a time
+BOARD_PAGE_SIZE = 10
 
-def create_user(username: str, password: str, email: str) -> None:
-    """A user builds and stores the information in the users.json ."""
-    users = Storage.load_users()
-    if username in users or any(user['email'] == email for user in users.values()):
-        console.print("Error: Username or email already exists.", style="bold red")
-        return
-
-    if not Utils.validate_email(email):
-        console.print("Error: Invalid email format.", style="bold red")
-        return
 
-    if not Utils.validate_username(username):
-        console.print("Error: Invalid username format.", style="bold red")
-        return
-
-    users[username] = {
-        'password': Utils.hash_password(password),
-        'email': email,
-        'is_active': True
-    }
-    Storage.save_users(users)
-    if email == "admin@gmail.com":
+def show_error(error: Exception) -> None:
+    console.print(f"Error: {error}", style="bold red")
 
-        log1.info(f"Admin created: {username}")
-    else:
 
-        log1.info(f"User created: {username}")
+def create_user(username: str, password: str, email: str) -> None:
+    """A user builds and stores the information in the users.json ."""
+    try:
+        TrelloService.register(username, password, email)
+    except ServiceError as e:
+        show_error(e)
+        return
+    if email != "admin@gmail.com":
         console.print("User created successfully.", style="bold green")
 
 
 def authenticate(username: str, password: str) -> bool:
-    """Check the validity of a username and password."""
-    users = Storage.load_users()
-    if username not in users or users[username]['password'] != Utils.hash_password(password):
+    """Check the validity of a username and password and start a session."""
+    global current_user, current_token, service
+    try:
+        service, current_token = TrelloService.login(username, password)
+    except InactiveUserError as e:
+        show_error(e)
         return False
-    if not users[username]['is_active']:
-        console.print("Error: Account is inactive.", style="bold red")
+    except AuthenticationError:
         return False
-    global current_user
-    current_user = username
+    current_user = service.actor
     return True
 
 
+def logout() -> None:
+    """Ends the session of the current user."""
+    global current_user, current_token, service
+    if current_token is not None:
+        Sessions.logout(current_token)
+    Storage.flush()
+    current_user = None
+    current_token = None
+    service = None
+
+
 def deactivate_user(username: str) -> None:
     """"Disables the user selected by the leader"""
-    users = Storage.load_users()
-    admin = Storage.load_admin()
-
-    if current_user != admin["username"]:
-        console.print("Error: Only the leader can deactivate members.", style="bold red")
+    try:
+        service.deactivate_user(username)
+    except ServiceError as e:
+        show_error(e)
         return
-    if username not in users:
-        console.print("Error: User not found.", style="bold red")
-        return
-
-    users[username]['is_active'] = False
-    Storage.save_users(users)
-
-    log1.info(f"User deactivated: {username}")
     console.print(f"User {username} deactivated.", style="bold green")
 
 
 def create_project(project_id: str, title: str) -> None:
     """It stores the information in the projects.json ."""
-    projects = Storage.load_projects()
-    users = Storage.load_users()
-
-    if project_id in projects:
-        console.print("Error: Project ID already exists.", style="bold red")
+    try:
+        service.create_project(project_id, title)
+    except ServiceError as e:
+        show_error(e)
         return
-
-    owner = users[current_user]
-    project = Project(project_id, title, current_user)
-    projects[project_id] = {
-        'title': title,
-        'owner': current_user,
-        'members': [current_user],
-        'tasks': []
-    }
-    Storage.save_projects(projects)
-    log1.info(f"Project created: {project_id} by {current_user}")
     console.print("Project created successfully.", style="bold green")
 
 
 def remove_project(project_id: str) -> None:
     """removes a project from the projects.json file by leader."""
-    projects = Storage.load_projects()
-    if project_id not in projects:
-        console.print("Error: Project not found.", style="bold red")
-        return
-    project = projects[project_id]
-    if current_user != project['owner']:
-        console.print("Error: Only the project owner can remove project.", style="bold red")
+    try:
+        service.remove_project(project_id)
+    except ServiceError as e:
+        show_error(e)
         return
-    projects.pop(project_id)
-    Storage.save_projects(projects)
-    log1.info(f"User {current_user} removed from project {project_id}")
     console.print("Project removed successfully.", style="bold green")
 
 
 def add_member_to_project(project_id: str, username: str) -> None:
     """adds a member to a project by leader."""
-    projects = Storage.load_projects()
-    users = Storage.load_users()
-
-    if project_id not in projects:
-        console.print("Error: Project not found.", style="bold red")
+    try:
+        added = service.add_member(project_id, username)
+    except ServiceError as e:
+        show_error(e)
         return
-
-    if username not in users:
-        console.print("Error: User not found.", style="bold red")
-        return
-
-    project = projects[project_id]
-    if current_user != project['owner']:
-        console.print("Error: Only the project owner can add members.", style="bold red")
-        return
-
-    if username not in project['members']:
-        project['members'].append(username)
-        Storage.save_projects(projects)
-        log1.info(f"User {username} added to project {project_id}")
+    if added:
         console.print("Member added successfully.", style="bold green")
 
 
 def remove_member_from_project(project_id: str, username: str) -> None:
     """removes a member from a project by leader."""
-    projects = Storage.load_projects()
-
-    if project_id not in projects:
-        console.print("Error: Project not found.", style="bold red")
-        return
-
-    project = projects[project_id]
-    if current_user != project['owner']:
-        console.print("Error: Only the project owner can remove members.", style="bold red")
+    try:
+        service.remove_member(project_id, username)
+    except ServiceError as e:
+        show_error(e)
         return
-
-    if username in project['members']:
-        project['members'].remove(username)
-        Storage.save_projects(projects)
-        log1.info(f"User {username} removed from project {project_id}")
-        console.print("Member removed successfully.", style="bold green")
-    elif username not in project['members']:
-        console.print(f"{username} not member in project {project_id}")
+    console.print("Member removed successfully.", style="bold green")
 
 
 def add_task_to_project(project_id: str, title: str, description: str, assignees: list) -> None:
     """adds a task to a project by leader."""
-    projects = Storage.load_projects()
-    users = Storage.load_users()
-
-    if project_id not in projects:
-        console.print("Error: Project not found.", style="bold red")
+    try:
+        service.add_task(project_id, title, description, assignees)
+    except ServiceError as e:
+        show_error(e)
         return
-
-    project = projects[project_id]
-    if current_user != project['owner']:
-        console.print("Error: Only the project owner can remove project.", style="bold red")
-        return
-    if not set(assignees).issubset(set(project['members'] + [""])):
-        console.print("Error: All assignees must be project members.", style="bold red")
-        return
-
-    task = Task(title, description, assignees)
-    project['tasks'].append({
-        'task_id': task.task_id,
-        'title': task.title,
-        'description': task.description,
-        'start_time': task.start_time.isoformat(),
-        'end_time': task.end_time.isoformat(),
-        'assignees': task.assignees,
-        'priority': task.priority,
-        'status': task.status,
-        'history': task.history,
-        'comments': task.comments
-    })
-    Storage.save_projects(projects)
-    log1.info(f"Task '{title}' added to project '{project_id}'")
     console.print("Task added successfully.", style="bold green")
 
 
 def list_project() -> None:
     """Shows the projects list."""
-    leader = []
-    member = []
-    projects = Storage.load_projects()
-    for key, value in projects.items():
-        if value['owner'] == current_user:
-            leader.append(key)
-        else:
-            if current_user in value['members']:
-                member.append(key)
+    user_projects = service.list_projects()
+    leader = user_projects['owned']
+    member = user_projects['member']
     table = Table(title='[red]list project', style="bold blue")
     table.add_column("owner", style="yellow")
     table.add_column("member", style="green")
@@ -214,30 +135,34 @@ def list_project() -> None:
     console.print(table)
 
 
-def edit_task(project_id: str, projects: dict, loop_task: int, location: str, location_task_id: str) -> None:
+def ask_priority(current: str) -> str:
+    console.print(f"[blue]Changing priority from [green]{current}[blue] to ...")
+    priorities = [TaskPriority.LOW, TaskPriority.MEDIUM, TaskPriority.HIGH, TaskPriority.CRITICAL]
+    for number, priority in enumerate(priorities, 1):
+        console.print(f"{number}. {priority.name}")
+    choice = Prompt.ask("Select an option", choices=[str(number) for number in range(1, len(priorities) + 1)])
+    return priorities[int(choice) - 1].name
+
+
+def ask_status(current: str) -> str:
+    console.print(f"[blue]Changing status from [green]{current}[blue] to ...")
+    statuses = list(TaskStatus)
+    for number, status in enumerate(statuses, 1):
+        console.print(f"{number}. {status.name}")
+    choice = Prompt.ask("Select an option", choices=[str(number) for number in range(1, len(statuses) + 1)])
+    return statuses[int(choice) - 1].name
+
+
+def edit_task(project_id: str, task_id: str) -> None:
     """Apply the desired changes to the selected task."""
-    project = projects[project_id]
-    tasks = project['tasks']
-    task_id = location_task_id
-
-    if location == "edit Task":
-        task_id = Prompt.ask("Enter task id")
-    selected_task = {}
-    temp = 0
-    for i in tasks:
-        if i["task_id"] == task_id:
-            selected_task = tasks.pop(temp)
-        temp += 1
-    while loop_task == 0:
-        if selected_task == {}:
-            console.print("Error: Task not found.", style="bold red")
-            log1.error(f"task {task_id} not found")
-            break
-        if current_user not in selected_task["assignees"]:
-            console.print("Error: only assignees can edited")
-            break
-        my_task = Task(selected_task["title"], selected_task["description"], selected_task["assignees"],
-                       selected_task["priority"], selected_task["status"])
+    global loop_task_def
+    loop_task_def = 0
+    try:
+        task = service.get_editable_task(project_id, task_id)
+    except ServiceError as e:
+        show_error(e)
+        return
+    while loop_task_def == 0:
         # show menu
         console.print("1. modify title")
         console.print("2. modify description")
@@ -252,275 +177,129 @@ def edit_task(project_id: str, projects: dict, loop_task: int, location: str, lo
         console.print("11. logout")
         choice = Prompt.ask("Select an option",
                             choices=["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11"])
-        if choice == "1":
-            title = Prompt.ask("Enter task title")
-            my_task.update_title(title)
-            my_task.set_id(task_id)
-            log1.info(f"{current_user} changed title the task {task_id} in the project {project_id}")
-            my_task.already_history(selected_task["history"])
-            my_task.add_history("title", current_user, datetime.now().isoformat())
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': selected_task['end_time'],
-                'assignees': my_task.assignees,
-                'priority': selected_task["priority"],
-                'status': selected_task["status"],
-                'history': my_task.history,
-                'comments': selected_task["comments"]
-            })
-            Storage.save_projects(projects)
-        elif choice == "2":
-            description = Prompt.ask("Enter task description")
-            my_task.update_description(description)
-            my_task.set_id(task_id)
-            log1.info(f"{current_user} changed description the task {task_id} in the project {project_id}")
-            my_task.already_history(selected_task["history"])
-            my_task.add_history("description", current_user, datetime.now().isoformat())
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': selected_task['end_time'],
-                'assignees': my_task.assignees,
-                'priority': selected_task["priority"],
-                'status': selected_task["status"],
-                'history': my_task.history,
-                'comments': selected_task["comments"]
-            })
-            Storage.save_projects(projects)
-        elif choice == "3":
-            my_task.set_id(task_id)
-            log1.info(f"{current_user} changed end_time the task {task_id} in the project {project_id}")
-            my_task.already_history(selected_task["history"])
-            my_task.add_history("end time", current_user, datetime.now().isoformat())
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': datetime.now().isoformat(),
-                'assignees': my_task.assignees,
-                'priority': selected_task["priority"],
-                'status': selected_task["status"],
-                'history': my_task.history,
-                'comments': selected_task["comments"]
-            })
-            Storage.save_projects(projects)
-        elif choice == "4":
-            console.print(f"[blue]Changing priority from [green]{selected_task['priority']}[blue] to ...")
-            console.print("1. LOW")
-            console.print("2. MEDIUM")
-            console.print("3. HIGH")
-            console.print("4. CRITICAL")
-            choice_priority = Prompt.ask("Select an option", choices=["1", "2", "3", "4"])
-            my_task.set_id(task_id)
-            my_task.already_history(selected_task["history"])
-            log1.info(f"{current_user} changed priority the task {task_id} in the project {project_id}")
-            if choice_priority == "1":
-                my_task.update_priority(TaskPriority.LOW.name)
-            elif choice_priority == "2":
-                my_task.update_priority(TaskPriority.MEDIUM.name)
-            elif choice_priority == "3":
-                my_task.update_priority(TaskPriority.HIGH.name)
-            elif choice_priority == "4":
-                my_task.update_priority(TaskPriority.CRITICAL.name)
-            my_task.add_history(f"priority update to {my_task.priority}", current_user, datetime.now().isoformat())
-
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': selected_task['end_time'],
-                'assignees': my_task.assignees,
-                'priority': my_task.priority,
-                'status': selected_task["status"],
-                'history': my_task.history,
-                'comments': selected_task["comments"]
-            })
-            Storage.save_projects(projects)
-        elif choice == "5":
-            console.print(f"[blue]Changing status from [green]{selected_task["status"]}[blue] to ...")
-            console.print("1. BACKLOG")
-            console.print("2. TODO")
-            console.print("3. DOING")
-            console.print("4. DONE")
-            console.print("5. ARCHIVED")
-            choice_status = Prompt.ask("Select an option", choices=["1", "2", "3", "4", "5"])
-            my_task.set_id(task_id)
-            my_task.already_history(selected_task["history"])
-            log1.info(f"{current_user} changed status the task {task_id} in the project {project_id}")
-            if choice_status == "1":
-                my_task.update_status(TaskStatus.BACKLOG.name)
-            elif choice_status == "2":
-                my_task.update_status(TaskStatus.TODO.name)
-            elif choice_status == "3":
-                my_task.update_status(TaskStatus.DOING.name)
-            elif choice_status == "4":
-                my_task.update_status(TaskStatus.DONE.name)
-            elif choice_status == "5":
-                my_task.update_status(TaskStatus.ARCHIVED.name)
-            my_task.add_history(f"status update to {my_task.status}", current_user, datetime.now().isoformat())
-
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': selected_task['end_time'],
-                'assignees': my_task.assignees,
-                'priority': selected_task["priority"],
-                'status': my_task.status,
-                'history': my_task.history,
-                'comments': selected_task["comments"]
-            })
-            Storage.save_projects(projects)
-        elif choice == "6":
-            my_task.set_id(task_id)
-            my_task.already_comment(selected_task["comments"])
-            content = Prompt.ask("Enter comment")
-            my_task.add_comment(current_user, content)
-            log1.info(f"{current_user} add comment the task {task_id} in the project {project_id}")
-            my_task.already_history(selected_task["history"])
-            my_task.add_history("comment", current_user, datetime.now().isoformat())
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': selected_task['end_time'],
-                'assignees': my_task.assignees,
-                'priority': selected_task["priority"],
-                'status': selected_task["status"],
-                'history': my_task.history,
-                'comments': my_task.comments
-            })
-            Storage.save_projects(projects)
-        elif choice == "7":
-            if current_user != project['owner']:
-                console.print("Error: Only the project owner can remove member from task.", style="bold red")
-                log1.error(f"{current_user} cant remove member from task {task_id}")
+        try:
+            if choice == "1":
+                task = service.update_title(project_id, task_id, Prompt.ask("Enter task title"))
+            elif choice == "2":
+                task = service.update_description(project_id, task_id, Prompt.ask("Enter task description"))
+            elif choice == "3":
+                task = service.update_end_time(project_id, task_id)
+            elif choice == "4":
+                task = service.update_priority(project_id, task_id, ask_priority(task['priority']))
+            elif choice == "5":
+                task = service.update_status(project_id, task_id, ask_status(task['status']))
+            elif choice == "6":
+                task = service.add_comment(project_id, task_id, Prompt.ask("Enter comment"))
+            elif choice in ("7", "8"):
+                username = Prompt.ask("Enter username")
+                if username == current_user:
+                    return
+                if choice == "7":
+                    task = service.unassign(project_id, task_id, username)
+                else:
+                    task = service.assign(project_id, task_id, username)
+            elif choice == "9":
+                service.delete_task(project_id, task_id)
                 return
-            my_task.set_id(task_id)
+            elif choice == "10":
+                loop_task_def = 1
+            elif choice == "11":
+                loop_task_def = 2
+        except PermissionDeniedError as e:
+            show_error(e)
+            return
+        except ServiceError as e:
+            show_error(e)
+
+
+def bulk_edit_tasks(project_id: str, filters: dict, changes: dict) -> int:
+    """Applies the same changes to every task of the project matching the filters, saving once."""
+    try:
+        count = service.bulk_edit(project_id, filters, changes)
+    except ServiceError as e:
+        show_error(e)
+        return 0
+    console.print(f"{count} tasks updated.", style="bold green")
+    return count
+
+
+def ask_bulk_edit(project_id: str) -> None:
+    """Asks for the filters and changes of a bulk edit."""
+    statuses = [""] + [status.name for status in TaskStatus]
+    priorities = [""] + [priority.name for priority in TaskPriority]
+    filters = {
+        'status': Prompt.ask("Only tasks with status (empty for any)", choices=statuses, default=""),
+        'priority': Prompt.ask("Only tasks with priority (empty for any)", choices=priorities, default=""),
+        'assignee': Prompt.ask("Only tasks assigned to (empty for anyone)", default="")
+    }
+    changes = {
+        'status': Prompt.ask("New status (empty to keep)", choices=statuses, default=""),
+        'priority': Prompt.ask("New priority (empty to keep)", choices=priorities, default=""),
+        'assign': Prompt.ask("Assign user (empty for none)", default=""),
+        'unassign': Prompt.ask("Unassign user (empty for none)", default="")
+    }
+    if Prompt.ask("Set end time to now?", choices=["y", "n"], default="n") == "y":
+        changes['end_time'] = datetime.now()
+    bulk_edit_tasks(project_id, {key: value for key, value in filters.items() if value},
+                    {key: value for key, value in changes.items() if value})
 
-            member_removed = Prompt.ask("Enter username")
-            if member_removed not in project['members'] + [""]:
-                console.print("Error: All assignees must be project members.", style="bold red")
-                log1.info(f"{current_user} can not remove member in the task {task_id} in the project {project_id}")
 
-            if member_removed == current_user:
-                return
-            my_task.unassign_user(member_removed)
-            log1.info(f"{current_user} remove member from task {task_id} in the project {project_id}")
-            my_task.already_history(selected_task["history"])
-            my_task.add_history("remove member", current_user, datetime.now().isoformat())
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': selected_task['end_time'],
-                'assignees': my_task.assignees,
-                'priority': selected_task["priority"],
-                'status': selected_task["status"],
-                'history': my_task.history,
-                'comments': selected_task["comments"]
-            })
-            Storage.save_projects(projects)
-        elif choice == "8":
-            if current_user != project['owner']:
-                console.print("Error: Only the project owner can add member in the task.", style="bold red")
-                log1.error(f"{current_user} cant add member in the task {task_id}")
-                return
-            my_task.set_id(task_id)
+def search_project_tasks(query: str) -> None:
+    """Shows the tasks of the user's projects that match the query, best first."""
+    results = service.search(query)
+    if not results:
+        console.print("No tasks found.", style="bold red")
+        return
+    table = Table(title=f"[red]search: {query}", style="bold blue")
+    table.add_column("project", style="yellow")
+    table.add_column("task id", style="green")
+    table.add_column("title", style="cyan")
+    for result in results:
+        table.add_row(result['project_id'], result['task_id'], result['title'])
+    console.print(table)
 
-            member_add = Prompt.ask("Enter username")
-            if member_add not in project['members'] + [""]:
-                console.print("Error: All assignees must be project members.", style="bold red")
-                log1.info(f"{current_user} can not add member in the task {task_id} in the project {project_id}")
 
-            if member_add == current_user:
-                return
-            my_task.assign_user(member_add)
-            log1.info(f"{current_user} add member in the task {task_id} in the project {project_id}")
-            my_task.already_history(selected_task["history"])
-            my_task.add_history("add member", current_user, datetime.now().isoformat())
-            project['tasks'].append({
-                'task_id': my_task.get_id(),
-                'title': my_task.title,
-                'description': my_task.description,
-                'start_time': selected_task["start_time"],
-                'end_time': selected_task['end_time'],
-                'assignees': my_task.assignees,
-                'priority': selected_task["priority"],
-                'status': selected_task["status"],
-                'history': my_task.history,
-                'comments': selected_task["comments"]
-            })
-            Storage.save_projects(projects)
-        elif choice == "9":
-            Storage.save_projects(projects)
-            log1.info(f"task {task_id} removed")
-        elif choice == "10":
-            global loop_task_def
-            loop_task = 1
-            loop_task_def = loop_task
-        elif choice == "11":
-            # global loop_task_def
-            loop_task = 2
-            loop_task_def = loop_task
+def show_board(project_id: str, columns: list, sort_by: str) -> None:
+    """Prints one page of every column of the board, one task per row."""
+    table = Table(title=f"Tasks for Project {project_id} (sorted by {sort_by})", style="bold blue")
+    for page in columns:
+        table.add_column(f"{page['status']} ({page['total']}) {page['page'] + 1}/{page['pages']}")
+    for row in itertools.zip_longest(*[page['tasks'] for page in columns]):
+        table.add_row(*['' if task is None else
+                        f"{task['task_id']}\n[green]{escape(task['title'])}[/] {task['priority']}" for task in row])
+    console.print(table)
 
 
 def view_project_tasks(project_id: str) -> None:
     """"Shows a list of tasks for a project"""
-    projects = Storage.load_projects()
-
-    if project_id not in projects:
-        console.print("Error: Project not found.", style="bold red")
+    pages = {status.name: 0 for status in TaskStatus}
+    sort_by = BOARD_SORTS[0]
+    while True:
+        try:
+            columns = service.board_pages(project_id, pages, BOARD_PAGE_SIZE, sort_by)
+        except ServiceError as e:
+            show_error(e)
+            return
+        show_board(project_id, columns, sort_by)
+        command = Prompt.ask("Enter task id, n/p [STATUS] for the next/previous page or s to change the sorting")
+        action, _, column = command.strip().partition(' ')
+        if action not in ('n', 'p', 's'):
+            input_task_id = command
+            break
+        if action == 's':
+            sort_by = BOARD_SORTS[(BOARD_SORTS.index(sort_by) + 1) % len(BOARD_SORTS)]
+            pages = dict.fromkeys(pages, 0)
+            continue
+        for page in columns:
+            if column.upper() in ('', page['status']):
+                step = 1 if action == 'n' else -1
+                pages[page['status']] = min(max(page['page'] + step, 0), page['pages'] - 1)
+
+    try:
+        select_task = service.get_task(project_id, input_task_id)
+    except ServiceError as e:
+        show_error(e)
         return
-
-    project = projects[project_id]
-    tasks = project['tasks']
-
-    table = Table(title=f"Tasks for Project {project_id}", style="bold blue")
-    table.add_column('BACKLOG')
-    table.add_column('TODO')
-    table.add_column('DOING')
-    table.add_column('DONE')
-    table.add_column('ARCHIVED')
-    BACKLOG = []
-    TODO = []
-    DOING = []
-    DONE = []
-    ARCHIVED = []
-
-    for task in tasks:
-        if task['status'] == 'BACKLOG':
-            BACKLOG.append(task['task_id'])
-        elif task['status'] == 'TODO':
-            TODO.append(task['task_id'])
-        elif task['status'] == 'DOING':
-            DOING.append(task['task_id'])
-        elif task['status'] == 'DONE':
-            DONE.append(task['task_id'])
-        elif task['status'] == 'ARCHIVED':
-            ARCHIVED.append(task.status)
-
-    table.add_row('\n'.join(BACKLOG), '\n'.join(TODO), '\n'.join(DOING), '\n'.join(DONE), '\n'.join(ARCHIVED))
-    console.print(table)
-
-    input_task_id = Prompt.ask("Enter task id")
-    tasks = project['tasks']
-    temp = 0
-    select_task = {}
-    for i in tasks:
-        if i["task_id"] == input_task_id:
-            select_task = tasks.pop(temp)
-        temp += 1
     table_task = Table(title=f"Task {input_task_id}")
     table_task.add_column("Task ID", style="cyan")
     table_task.add_column("Title", style="green")
@@ -541,123 +320,105 @@ def view_project_tasks(project_id: str) -> None:
         select_task['priority'],
         select_task['status']
     )
-    if current_user not in select_task['assignees']:
-        if not ("" in select_task['assignees'] and len(select_task["assignees"]) == 1):
-            console.print("if the tasks are empty or you are not member ,you can not see the task details",
-                          style="bold red")
-            log1.error(f"{current_user} can not see task details")
-            return
     console.print(table_task)
-    project['tasks'].append({
-        'task_id': select_task['task_id'],
-        'title': select_task['title'],
-        'description': select_task['description'],
-        'start_time': select_task['start_time'],
-        'end_time': select_task['end_time'],
-        'assignees': select_task['assignees'],
-        'priority': select_task["priority"],
-        'status': select_task["status"],
-        'history': select_task["history"],
-        'comments': select_task["comments"]
-    })
-    # if "" in select_task["assignees"] and len(select_task["assignees"]) == 1:
-    #     return
-    loop_task = 0
-    edit_task(project_id, projects, loop_task, "View Project Tasks", input_task_id)
+    edit_task(project_id, input_task_id)
 
 
 def main_menu() -> None:
     while True:
-        # show menu
-        console.print(f"\nWelcome {current_user}!", style="bold blue")
-        console.print("1. Create Project")
-        console.print("2. Project items")
-        console.print("3. deactivate members")
-        console.print("4. projects list ")
-        console.print("5. Logout")
-        choice1 = Prompt.ask("Select an option", choices=["1", "2", "3", "4", "5"])
-
-        if choice1 == "1":
-            project_id = Prompt.ask("Enter project ID")
-            title = Prompt.ask("Enter project title")
-            create_project(project_id, title)
-        elif choice1 == "2":
-            loop_project = 0
-            project_id = Prompt.ask("Enter project ID")
-
-            while loop_project == 0:
-                projects = Storage.load_projects()
-
-                if project_id not in projects:
-                    console.print("Error: Project not found.", style="bold red")
-                    break
-                check_member_project = projects[project_id]
-                if current_user not in check_member_project['members']:
-                    console.print("Error: Project items are only available to its members.", style="bold red")
-                    log1.error(f"{current_user} could not access the project {project_id}")
-                    break
-                # show manage project
-                console.print(f"\nManage project {project_id}", style="bold blue")
-                console.print("1. Add Member to Project")
-                console.print("2. Remove Member from Project")
-                console.print("3. Add Task to Project")
-                console.print("4. View Project Tasks")
-                console.print("5. remove project")
-                console.print("6. edit task")
-                console.print("7. edit basic project info")
-                console.print("8. back")
-                console.print("9. logout")
-                choice = Prompt.ask("Select an option", choices=["1", "2", "3", "4", "5", "6", "7", "8", "9"])
-                if choice == "1":
-                    username = Prompt.ask("Enter username to add")
-                    add_member_to_project(project_id, username)
-                elif choice == "2":
-                    username = Prompt.ask("Enter username to remove")
-                    remove_member_from_project(project_id, username)
-                elif choice == "3":
-                    title = Prompt.ask("Enter task title")
-                    description = Prompt.ask("Enter task description")
-                    assignees = Prompt.ask("Enter assignees (comma separated)").split(", ")
-                    add_task_to_project(project_id, title, description, assignees)
-                elif choice == "4":
-                    view_project_tasks(project_id)
-
-                elif choice == "5":
-                    remove_project(project_id)
-
-                elif choice == "6":
-                    loop_task = 0
-
-                    edit_task(project_id, projects, loop_task, "edit Task", "")
-                    if loop_task_def == 2:
-                        loop_project = 2
-                elif choice == "7":
-                    console.print("1. edit title")
-                    projects = Storage.load_projects()
-                    users = Storage.load_users()
-                    project = projects[project_id]
-                    if current_user != project['owner']:
-                        console.print("Error: Only the project owner can edited basic info", style="bold red")
+        if Sessions.get(current_token) is None:
+            show_error("Your session has ended.")
+            break
+        try:
+            # show menu
+            console.print(f"\nWelcome {current_user}!", style="bold blue")
+            console.print("1. Create Project")
+            console.print("2. Project items")
+            console.print("3. deactivate members")
+            console.print("4. projects list ")
+            console.print("5. Logout")
+            console.print("6. search tasks")
+            choice1 = Prompt.ask("Select an option", choices=["1", "2", "3", "4", "5", "6"])
+
+            if choice1 == "1":
+                project_id = Prompt.ask("Enter project ID")
+                title = Prompt.ask("Enter project title")
+                create_project(project_id, title)
+            elif choice1 == "2":
+                loop_project = 0
+                project_id = Prompt.ask("Enter project ID")
+
+                while loop_project == 0:
+                    try:
+                        service.open_project(project_id)
+                    except ServiceError as e:
+                        show_error(e)
                         break
-                    edit_title = Prompt.ask("Enter project title")
-                    project["title"] = edit_title
-                    Storage.save_projects(projects)
-                    log1.info(f"User {current_user} changed the title of project {project_id}")
-
-
-                elif choice == "8":
-                    loop_project = 1
-                elif choice == "9":
-                    loop_project = 2
-            if loop_project == 2:
+                    # show manage project
+                    console.print(f"\nManage project {project_id}", style="bold blue")
+                    console.print("1. Add Member to Project")
+                    console.print("2. Remove Member from Project")
+                    console.print("3. Add Task to Project")
+                    console.print("4. View Project Tasks")
+                    console.print("5. remove project")
+                    console.print("6. edit task")
+                    console.print("7. edit basic project info")
+                    console.print("8. back")
+                    console.print("9. logout")
+                    console.print("10. bulk edit tasks")
+                    choice = Prompt.ask("Select an option",
+                                        choices=["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"])
+                    if choice == "1":
+                        username = Prompt.ask("Enter username to add")
+                        add_member_to_project(project_id, username)
+                    elif choice == "2":
+                        username = Prompt.ask("Enter username to remove")
+                        remove_member_from_project(project_id, username)
+                    elif choice == "3":
+                        title = Prompt.ask("Enter task title")
+                        description = Prompt.ask("Enter task description")
+                        assignees = Prompt.ask("Enter assignees (comma separated)").split(", ")
+                        add_task_to_project(project_id, title, description, assignees)
+                    elif choice == "4":
+                        view_project_tasks(project_id)
+
+                    elif choice == "5":
+                        remove_project(project_id)
+
+                    elif choice == "6":
+                        task_id = Prompt.ask("Enter task id")
+                        edit_task(project_id, task_id)
+                        if loop_task_def == 2:
+                            loop_project = 2
+                    elif choice == "7":
+                        console.print("1. edit title")
+                        edit_title = Prompt.ask("Enter project title")
+                        try:
+                            service.rename_project(project_id, edit_title)
+                        except ServiceError as e:
+                            show_error(e)
+                            break
+                    elif choice == "8":
+                        loop_project = 1
+                    elif choice == "9":
+                        loop_project = 2
+                    elif choice == "10":
+                        ask_bulk_edit(project_id)
+                if loop_project == 2:
+                    break
+            elif choice1 == "3":
+                username = Prompt.ask("Enter the username to disable")
+                deactivate_user(username)
+            elif choice1 == "4":
+                list_project()
+            elif choice1 == "5":
                 break
-        elif choice1 == "3":
-            username = Prompt.ask("Enter the username to disable")
-            deactivate_user(username)
-        elif choice1 == "4":
-            list_project()
-        elif choice1 == "5":
-            break
+            elif choice1 == "6":
+                query = Prompt.ask("Enter search words")
+                search_project_tasks(query)
+        except ConflictError as e:
+            console.print(f"Error: {e}. Please try again.", style="bold red")
+            log1.error(f"{current_user}: {e}")
 
 
 def login() -> None:
@@ -677,11 +438,12 @@ def login() -> None:
             password = Prompt.ask("Enter password")
             if authenticate(username, password):
                 main_menu()
-                current_user = None
+                logout()
                 break
             else:
                 console.print("Error: Invalid username or password.", style="bold red")
 
 
 if __name__ == "__main__":
+    Storage.flush_on_signals()
     login()
@@ -1,58 +1,153 @@
 import argparse
-import json
+import itertools
 import os
+import shutil
+import sys
+from datetime import datetime
 from utils import Utils
 from main import create_user
 from logger import log1
+from storage import Storage
+from importer import import_records, iter_records
+from models import TaskStatus
+import exporter
 
 DATA_DIR = 'data'
-ADMIN_FILE = os.path.join(DATA_DIR, 'admin.json')
 
 
 def create_admin(username: str, password: str) -> None:
     """admin builds and stores the information in the admin.json """
-    if os.path.exists(ADMIN_FILE):
+    if Storage.load_admin():
         print("Admin already exists.")
         return
     admin = {
         'username': username,
         'password': Utils.hash_password(password)
     }
-    with open(ADMIN_FILE, 'w') as f:
-        json.dump(admin, f)
+    Storage.save_admin(admin)
     create_user(username, password, "admin@gmail.com")
     print("Admin created successfully.")
 
 
-def purge_data() -> None:
-    try:
-        os.remove("data/admin.json")
-        print(f"Amin data deleted.")
-        log1.info("purge admin data")
+def _remove_data_file(file_path: str) -> bool:
+    """removes a data file in both formats with its journal and lock; returns whether there was one."""
+    found = False
+    for file_format in ('json', 'binary'):
+        disk_path = Storage.disk_path(file_path, file_format)
+        if os.path.exists(disk_path):
+            os.remove(disk_path)
+            found = True
+    Storage.delete_data(file_path)
+    return found
 
-    except FileNotFoundError:
-        print("Admin data not exist.")
-    except Exception as e:
-        print(e)
 
-    try:
-        os.remove("data/projects.json")
-        print(f"projects data deleted.")
-        log1.info("purge project data")
+def purge_data(data_dir: str) -> None:
+    """removes the data of a data directory, whatever backend and format wrote it."""
+    Storage.set_data_dir(data_dir)
+    for name, file_path in (("Admin", Storage.ADMIN_FILE), ("Projects", Storage.PROJECTS_FILE),
+                            ("Users", Storage.USERS_FILE)):
+        if _remove_data_file(file_path):
+            print(f"{name} data deleted.")
+            log1.info(f"purge {name.lower()} data")
+        else:
+            print(f"{name} data not exist.")
+    for file_path in (Storage.MEMBERSHIP_FILE, Storage.SEARCH_INDEX_FILE, Storage.SEARCH_LOG_FILE,
+                      Storage.SYMBOLS_FILE):
+        _remove_data_file(file_path)
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(Storage.DB_FILE + suffix):
+            os.remove(Storage.DB_FILE + suffix)
+            log1.info(f"purge {Storage.DB_FILE + suffix}")
+    shutil.rmtree(Storage.EMAIL_INDEX_DIR, ignore_errors=True)
+    shutil.rmtree(Storage.PROJECTS_DIR, ignore_errors=True)
+    shutil.rmtree(Storage.SEGMENTS_DIR, ignore_errors=True)
 
-    except FileNotFoundError:
-        print("project data not exist.")
-    except Exception as e:
-        print(e)
-    try:
-        os.remove("data/users.json")
-        print(f"Users data deleted.")
-        log1.info("purge users data")
 
-    except FileNotFoundError:
-        print("User data not exist.")
-    except Exception as e:
-        print(e)
+def migrate_sqlite(data_dir: str) -> None:
+    """converts the JSON files of a data directory into the SQLite database."""
+    Storage.set_data_dir(data_dir)
+    Storage.migrate_to_sqlite()
+    log1.info(f"migrate {data_dir} to sqlite")
+    print(f"Data migrated to {Storage.DB_FILE}.")
+
+
+def migrate_sharded(data_dir: str) -> None:
+    """splits the projects.json of a data directory into one file per project."""
+    Storage.set_data_dir(data_dir)
+    Storage.migrate_to_shards()
+    log1.info(f"migrate {data_dir} to sharded projects")
+    print(f"Projects split into {Storage.PROJECTS_DIR}.")
+
+
+def convert_format(data_dir: str, file_format: str) -> None:
+    """rewrites the data files of a data directory as JSON or binary."""
+    Storage.set_data_dir(data_dir)
+    for file_path in Storage.convert_format(file_format):
+        print(f"{file_path} written.")
+    log1.info(f"convert {data_dir} to {file_format}")
+    print(f"Set TRELLOMIZE_FORMAT={file_format} to use the converted files.")
+
+
+def rebuild_indexes(data_dir: str) -> None:
+    """rebuilds the email and membership indexes of a data directory."""
+    Storage.set_data_dir(data_dir)
+    Storage.save_users(Storage.load_users())
+    Storage.rebuild_membership()
+    log1.info(f"rebuild indexes of {data_dir}")
+    print("Indexes rebuilt.")
+
+
+def import_data(file_path: str, data_dir: str, chunk_size: int) -> None:
+    """imports users, projects, members and tasks from a JSONL or CSV file."""
+    Storage.set_data_dir(data_dir)
+
+    def progress(totals: dict) -> None:
+        done = totals['imported'] + totals['skipped']
+        print(f"{done} records, {totals['skipped']} skipped, {done / max(totals['seconds'], 1e-9):.0f} records/s")
+
+    totals = import_records(iter_records(file_path), chunk_size, progress)
+    for number, error in totals['errors']:
+        print(f"line {number}: {error}")
+    log1.info(f"import {file_path}: {totals['imported']} imported, {totals['skipped']} skipped")
+    print(f"Imported {totals['imported']} records in {totals['seconds']:.2f}s.")
+
+
+def export_data(file_path: str, data_dir: str, include: list, project_ids=None, statuses=None, since=None,
+                until=None, details: bool = False) -> None:
+    """streams users, projects and tasks to a JSONL or CSV file ('-' for stdout)."""
+    Storage.set_data_dir(data_dir)
+    since = datetime.fromisoformat(since) if since else None
+    until = datetime.fromisoformat(until) if until else None
+    project_ids = set(project_ids) if project_ids else None
+    statuses = set(statuses) if statuses else None
+    # generators, so nothing is read before the writer asks for it
+    parts = {
+        'users': exporter.iter_users(),
+        'projects': exporter.iter_projects(project_ids),
+        'tasks': exporter.iter_tasks(project_ids, statuses, since, until, details)
+    }
+    unknown = [name for name in include if name not in parts]
+    if unknown:
+        print(f"Unknown export part: {', '.join(unknown)}.")
+        return
+    records = itertools.chain.from_iterable(parts[name] for name in include)
+    write = exporter.write_csv if file_path.endswith('.csv') else exporter.write_jsonl
+    if file_path == '-':
+        count = write(records, sys.stdout)
+    else:
+        with open(file_path, 'w', newline='') as file:
+            count = write(records, file)
+        print(f"Exported {count} records to {file_path}.")
+    log1.info(f"export {count} records to {file_path}")
+
+
+def compact_data(data_dir: str) -> None:
+    """writes the journaled changes of a data directory into the snapshot files."""
+    Storage.set_data_dir(data_dir)
+    for file_path in (Storage.USERS_FILE, Storage.PROJECTS_FILE):
+        Storage.compact(file_path)
+        log1.info(f"compact {file_path}")
+    print("Data compacted.")
 
 
 if __name__ == "__main__":
@@ -60,6 +155,25 @@ if __name__ == "__main__":
     # parser.add_argument('command', choices=['create-admin', 'purge-data'], help="Command to run.")
     parser.add_argument("--create-admin", action='store_true', help="Create an admin.")
     parser.add_argument("--purge-data", action='store_true', help="Purge all data.")
+    parser.add_argument("--compact", action='store_true', help="Compact the journaled data files.")
+    parser.add_argument("--migrate-sqlite", action='store_true', help="Convert the JSON data into SQLite.")
+    parser.add_argument("--migrate-sharded", action='store_true', help="Split projects into one file each.")
+    parser.add_argument("--convert-format", choices=['json', 'binary'], help="Convert the data files format.")
+    parser.add_argument("--reindex", action='store_true', help="Rebuild the email and membership indexes.")
+    parser.add_argument("--import", dest='import_file', metavar='FILE',
+                        help="Import users, projects, members and tasks from a JSONL or CSV file.")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Records between progress lines of --import.")
+    parser.add_argument("--export", metavar='FILE',
+                        help="Export users, projects and tasks to a .jsonl or .csv file, '-' for stdout.")
+    parser.add_argument('--include', type=str, default='users,projects,tasks',
+                        help="What --export writes, comma separated.")
+    parser.add_argument('--project', action='append', help="Only export this project (repeatable).")
+    parser.add_argument('--status', action='append', choices=[status.name for status in TaskStatus],
+                        help="Only export tasks with this status (repeatable).")
+    parser.add_argument('--since', type=str, help="Only export tasks started at or after this ISO date.")
+    parser.add_argument('--until', type=str, help="Only export tasks started at or before this ISO date.")
+    parser.add_argument('--with-details', action='store_true', help="Export task history and comments too.")
+    parser.add_argument('--data-dir', type=str, default=DATA_DIR, help="Data directory.")
     parser.add_argument('--username', type=str, help="Admin username.")
     parser.add_argument('--password', type=str, help="Admin password.")
 
@@ -70,9 +184,31 @@ if __name__ == "__main__":
         choice = input("Are sure your decided?\n1. Yes\n2. No\n")
         if choice == '1':
             print("Removing all data...")
-            purge_data()  # Not completed
+            purge_data(args.data_dir)
         elif choice == "2":
             pass
+    elif args.compact:
+        compact_data(args.data_dir)
+    elif args.migrate_sqlite:
+        migrate_sqlite(args.data_dir)
+    elif args.migrate_sharded:
+        migrate_sharded(args.data_dir)
+    elif args.convert_format:
+        convert_format(args.data_dir, args.convert_format)
+    elif args.reindex:
+        rebuild_indexes(args.data_dir)
+    elif args.import_file:
+        import_data(args.import_file, args.data_dir, args.chunk_size)
+    elif args.export:
+        export_data(args.export, args.data_dir, args.include.split(','), args.project, args.status, args.since,
+                    args.until, args.with_details)
 
 # python manager.py --create-admin --username admin --password admin123456789
 # python ./manager.py --purge-data
+# python ./manager.py --compact
+# python ./manager.py --migrate-sqlite --data-dir data
+# python ./manager.py --migrate-sharded --data-dir data
+# python ./manager.py --convert-format binary --data-dir data
+# python ./manager.py --reindex --data-dir data
+# python ./manager.py --import team.jsonl --chunk-size 1000
+# python ./manager.py --export tasks.csv --include tasks --status DONE --since 2024-05-01
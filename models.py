@@ -1,16 +1,29 @@
 from datetime import datetime, timedelta
+import heapq
+import itertools
 import uuid
 from enum import Enum
 
 
 class User:
     """create the user object"""
+    __slots__ = ('username', 'password', 'email', 'is_active')
+
     def __init__(self, username: str, password: str, email: str, is_active=True):
         self.username = username
         self.password = password
         self.email = email
         self.is_active = is_active
 
+    @classmethod
+    def from_dict(cls, username: str, data: dict):
+        """build a user from its entry in users.json"""
+        return cls(username, data['password'], data['email'], data.get('is_active', True))
+
+    def to_dict(self) -> dict:
+        """return the entry of the user in users.json"""
+        return {'password': self.password, 'email': self.email, 'is_active': self.is_active}
+
 
 class TaskStatus(Enum):
     """a class that represents the status of the task"""
@@ -31,6 +44,9 @@ class TaskPriority(Enum):
 
 class Task:
     """a class that represents the task"""
+    __slots__ = ('task_id', 'title', 'description', 'start_time', 'end_time', 'assignees', 'priority', 'status',
+                 'history', 'comments')
+
     def __init__(self, title='', description='', assignees=None, priority=TaskPriority.LOW.name,
                  status=TaskStatus.BACKLOG.name):
         if assignees is None:
@@ -46,6 +62,43 @@ class Task:
         self.history = []
         self.comments = []
 
+    @classmethod
+    def from_dict(cls, data: dict):
+        """rebuild a stored task without generating a new id or times, sharing its lists
+
+        history and comments are None when they are kept in a segment and were not loaded.
+        """
+        task = cls.__new__(cls)
+        task.task_id = data['task_id']
+        task.title = data.get('title', '')
+        task.description = data.get('description', '')
+        task.start_time = data.get('start_time')
+        task.end_time = data.get('end_time')
+        task.assignees = data.get('assignees', [])
+        task.priority = data.get('priority', TaskPriority.LOW.name)
+        task.status = data.get('status', TaskStatus.BACKLOG.name)
+        task.history = data.get('history')
+        task.comments = data.get('comments')
+        return task
+
+    def to_dict(self) -> dict:
+        """return the stored form of the task"""
+        data = {
+            'task_id': self.task_id,
+            'title': self.title,
+            'description': self.description,
+            'start_time': self.start_time.isoformat() if isinstance(self.start_time, datetime) else self.start_time,
+            'end_time': self.end_time.isoformat() if isinstance(self.end_time, datetime) else self.end_time,
+            'assignees': self.assignees,
+            'priority': self.priority,
+            'status': self.status
+        }
+        if self.history is not None:
+            data['history'] = self.history
+        if self.comments is not None:
+            data['comments'] = self.comments
+        return data
+
     def set_id(self, task_id: str) -> None:
         """"set the task id"""
         self.task_id = task_id
@@ -99,6 +152,9 @@ class Task:
         if username in self.assignees:
             self.assignees.remove(username)
 
+    def update_end_time(self, end_time) -> None:
+        self.end_time = end_time
+
     def update_title(self, title: str) -> None:
         self.title = title
 
@@ -107,14 +163,86 @@ class Task:
         self.description = description
 
 
+# the orders a board column can be shown in, see Project.page
+BOARD_SORTS = ('board', 'priority', 'end_time')
+
+
 class Project:
     """"a class that represents the project"""
+    __slots__ = ('project_id', 'title', 'owner', 'members', 'tasks', 'board', 'priorities')
+
     def __init__(self, project_id: str, title: str, owner: str):
         self.project_id = project_id
         self.title = title
         self.owner = owner
         self.members = [owner]
-        self.tasks = []
+        self.tasks = {}
+        # task ids per status and per priority, in board order; a bucket is kept as
+        # the stored list until it has to change and then as an ordered dict
+        self.board = {status.name: {} for status in TaskStatus}
+        self.priorities = {priority.name: {} for priority in TaskPriority}
+
+    @classmethod
+    def from_dict(cls, project_id: str, data: dict):
+        """build a project from its stored form, sharing the tasks mapping"""
+        project = cls(project_id, data['title'], data['owner'])
+        project.members = data['members']
+        project.tasks = data['tasks']
+        if 'board' in data and 'priorities' in data:
+            project.board = dict(data['board'])
+            project.priorities = dict(data['priorities'])
+        else:
+            for task_id, task in project.tasks.items():
+                project._index(task_id, task)
+        return project
+
+    def to_dict(self) -> dict:
+        """return the stored form of the project"""
+        return {
+            'title': self.title,
+            'owner': self.owner,
+            'members': self.members,
+            'tasks': self.tasks,
+            'board': {name: list(ids) for name, ids in self.board.items()},
+            'priorities': {name: list(ids) for name, ids in self.priorities.items()}
+        }
+
+    @staticmethod
+    def _field(task, name: str):
+        return task[name] if isinstance(task, dict) else getattr(task, name)
+
+    @staticmethod
+    def _bucket(buckets: dict, name: str) -> dict:
+        bucket = buckets.get(name)
+        if not isinstance(bucket, dict):
+            bucket = buckets[name] = dict.fromkeys(bucket or ())
+        return bucket
+
+    def _state(self, task) -> tuple:
+        return self._field(task, 'status'), self._field(task, 'priority')
+
+    def _indexed_as(self, task_id: str) -> tuple:
+        """return the status and priority whose buckets hold the task, looking through the buckets"""
+        return tuple(next((name for name, ids in buckets.items() if task_id in ids), None)
+                     for buckets in (self.board, self.priorities))
+
+    def _index(self, task_id: str, task, previous=None) -> None:
+        """put the task in the buckets of its status and priority, taking it out of the ones it was in
+
+        previous is the (status, priority) the task was indexed with, or None if it was not indexed;
+        only the buckets it leaves and enters are touched
+        """
+        for buckets, name, current in zip((self.board, self.priorities), previous or (None, None),
+                                          self._state(task)):
+            if name == current:
+                continue
+            if name is not None:
+                self._bucket(buckets, name).pop(task_id, None)
+            self._bucket(buckets, current).setdefault(task_id)
+
+    def _unindex(self, task_id: str, task) -> None:
+        for buckets, field in ((self.board, 'status'), (self.priorities, 'priority')):
+            self._bucket(buckets, self._field(task, field)).pop(task_id, None)
 
     def add_member(self, user: str) -> None:
         """"add a member to the project"""
@@ -126,10 +254,132 @@ class Project:
         if user in self.members:
             self.members.remove(user)
 
-    def add_task(self, task: dict) -> None:
+    def add_task(self, task) -> None:
         """"add a task to the project"""
-        self.tasks.append(task)
+        self.update_task(task)
+
+    def get_task(self, task_id: str):
+        """return the task with the given id or None"""
+        return self.tasks.get(task_id)
+
+    def update_task(self, task) -> None:
+        """replace a task, keeping its place on the board"""
+        task_id = self._field(task, 'task_id')
+        old = self.tasks.get(task_id)
+        if old is None:
+            previous = None
+        elif old is task:
+            # changed in place, so its old status and priority are gone
+            previous = self._indexed_as(task_id)
+        else:
+            previous = self._state(old)
+        self.tasks[task_id] = task
+        self._index(task_id, task, previous)
+
+    def delete_task(self, task_id: str) -> None:
+        """delete a task from the project"""
+        task = self.tasks.pop(task_id, None)
+        if task is not None:
+            self._unindex(task_id, task)
 
     def remove_task(self, task_id: str) -> None:
         """"remove a task from the project"""
-        self.tasks = [task for task in self.tasks if task.task_id != task_id]
+        self.delete_task(task_id)
+
+    def update_status(self, task_id: str, status: str) -> None:
+        """change the status of a task and move it to that column"""
+        task = self.tasks[task_id]
+        previous = self._state(task)
+        if isinstance(task, dict):
+            task['status'] = status
+        else:
+            task.update_status(status)
+        self._index(task_id, task, previous)
+
+    def update_priority(self, task_id: str, priority: str) -> None:
+        """change the priority of a task"""
+        task = self.tasks[task_id]
+        previous = self._state(task)
+        if isinstance(task, dict):
+            task['priority'] = priority
+        else:
+            task.update_priority(priority)
+        self._index(task_id, task, previous)
+
+    def task_ids(self, status: str = None, priority: str = None) -> list:
+        """return the ids of the tasks with the given status or priority in board order"""
+        if status is not None:
+            return list(self.board.get(status, ()))
+        if priority is not None:
+            return list(self.priorities.get(priority, ()))
+        return list(self.tasks)
+
+    def find_tasks(self, status: str = None, priority: str = None, assignee: str = None) -> list:
+        """return the ids of the tasks that match every given filter in board order"""
+        ids = self.task_ids(status=status) if status is not None else self.task_ids()
+        if priority is not None:
+            wanted = self.priorities.get(priority, ())
+            ids = [task_id for task_id in ids if task_id in wanted]
+        if assignee is not None:
+            ids = [task_id for task_id in ids if assignee in self._field(self.tasks[task_id], 'assignees')]
+        return ids
+
+    def bulk_update(self, task_ids: list, username: str, status: str = None, priority: str = None, end_time=None,
+                    assign: str = None, unassign: str = None) -> list:
+        """apply the same changes to many tasks, adding a history entry for each change, and return the changed tasks
+
+        the tasks must have their history loaded
+        """
+        now = datetime.now().isoformat()
+        changed = []
+        for task_id in task_ids:
+            task = Task.from_dict(self.tasks[task_id])
+            entries = len(task.history)
+            if status is not None and task.status != status:
+                task.update_status(status)
+                task.add_history(f"status update to {status}", username, now)
+            if priority is not None and task.priority != priority:
+                task.update_priority(priority)
+                task.add_history(f"priority update to {priority}", username, now)
+            if end_time is not None:
+                task.update_end_time(end_time)
+                task.add_history("end time", username, now)
+            if assign is not None and assign not in task.assignees:
+                task.assign_user(assign)
+                task.add_history("add member", username, now)
+            if unassign is not None and unassign in task.assignees:
+                task.unassign_user(unassign)
+                task.add_history("remove member", username, now)
+            if len(task.history) > entries:
+                data = task.to_dict()
+                self.update_task(data)
+                changed.append(data)
+        return changed
+
+    def page(self, status: str, offset: int, limit: int, sort_by: str = 'board') -> list:
+        """return the ids of one page of a board column, only going through as much of the column as the page needs
+
+        sort_by is 'board' for board order, 'priority' for the most urgent first or
+        'end_time' for the earliest end time first, tasks without one last
+        """
+        column = self.board.get(status, ())
+        if sort_by == 'priority':
+            column = self._bucket(self.board, status)
+            ids = (task_id for priority in TaskPriority for task_id in self.priorities.get(priority.name, ())
+                   if task_id in column)
+        elif sort_by == 'end_time':
+            def key(task_id):
+                end_time = self._field(self.tasks[task_id], 'end_time')
+                return end_time in (None, 'None'), str(end_time)
+            ids = heapq.nsmallest(offset + limit, column, key=key)
+        else:
+            ids = column
+        return list(itertools.islice(ids, offset, offset + limit))
+
+    def count(self, status: str = None, priority: str = None) -> int:
+        """return the number of tasks with the given status or priority"""
+        if status is not None:
+            return len(self.board.get(status, ()))
+        if priority is not None:
+            return len(self.priorities.get(priority, ()))
+        return len(self.tasks)
@@ -0,0 +1,243 @@
+import bisect
+import json
+import os
+import re
+from storage import Storage
+
+TOKEN = re.compile(r'\w+')
+TITLE_WEIGHT = 3
+TEXT_WEIGHT = 1
+
+
+def tokenize(text: str) -> list:
+    """splits a text into lower case words."""
+    return TOKEN.findall(text.lower())
+
+
+class SearchIndex:
+    """An inverted index from words of task titles, descriptions and comments to task ids.
+
+    It is stored as a snapshot (SEARCH_INDEX_FILE) and a log of the tasks
+    indexed or removed since (SEARCH_LOG_FILE), so a task edit appends one
+    record. The loaded index is kept in memory and only new log records are
+    read by the next load.
+    """
+    # the log is written into a new snapshot once it holds this many records
+    COMPACT_EVERY = 1000
+    # (snapshot path and stat, index, log offset) of the last load
+    _cached = None
+
+    def __init__(self, postings=None, docs=None, words=None):
+        # word -> {task_id: weight}
+        self.postings = postings or {}
+        # task_id -> {'project_id', 'title', 'terms': {word: weight}, 'comment_terms': {word: weight}}
+        self.docs = docs or {}
+        # the sorted words of postings, kept up to date once built
+        self._words = words if words is not None and len(words) == len(self.postings) else None
+        self._logged = 0
+
+    @staticmethod
+    def _snapshot_key():
+        return Storage.SEARCH_INDEX_FILE, Storage._stat_key(Storage.disk_path(Storage.SEARCH_INDEX_FILE))
+
+    @classmethod
+    def load(cls):
+        """returns the index of the data directory, building it the first time."""
+        key = cls._snapshot_key()
+        cached = cls._cached
+        if cached is not None and cached[0] == key:
+            index, offset = cached[1], cached[2]
+        elif not Storage.exists(Storage.SEARCH_INDEX_FILE):
+            index = cls.build()
+            index.save()
+            return index
+        else:
+            data = Storage.load_data(Storage.SEARCH_INDEX_FILE)
+            index, offset = cls(data.get('postings'), data.get('docs'), data.get('words')), 0
+        cls._cached = (key, index, index._replay(offset))
+        return index
+
+    def save(self) -> None:
+        """Writes the index as a new snapshot and empties the log.
+
+        Callers that are not the only writer hold Storage.merge_lock(SEARCH_INDEX_FILE).
+        """
+        Storage.write_through(Storage.SEARCH_INDEX_FILE, {'postings': self.postings, 'docs': self.docs,
+                                                          'words': self._vocabulary()})
+        if os.path.exists(Storage.SEARCH_LOG_FILE):
+            os.remove(Storage.SEARCH_LOG_FILE)
+        self._logged = 0
+        SearchIndex._cached = (self._snapshot_key(), self, 0)
+
+    @classmethod
+    def build(cls):
+        """indexes every task of every project."""
+        index = cls()
+        for project_id, project in Storage.iter_projects():
+            for task in project['tasks'].values():
+                index.index_task(project_id, Storage.load_task_details(project_id, task))
+        return index
+
+    def _replay(self, offset: int) -> int:
+        """applies the log records from offset on and returns the offset after the last whole record."""
+        if not os.path.exists(Storage.SEARCH_LOG_FILE):
+            return 0
+        with open(Storage.SEARCH_LOG_FILE, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # a record that is still being appended
+                    break
+                self._apply(json.loads(line))
+                offset += len(line)
+                self._logged += 1
+        return offset
+
+    def _apply(self, record: dict) -> None:
+        if record['op'] == 'index':
+            self._put(record['task_id'], record['doc'])
+        elif record['op'] == 'remove':
+            self.remove_task(record['task_id'])
+        elif record['op'] == 'remove_project':
+            self.remove_project(record['project_id'])
+
+    @classmethod
+    def _log(cls, index, record: dict) -> None:
+        """Appends a change that was applied to the loaded index, under the index lock.
+
+        Compacts the log into a new snapshot every COMPACT_EVERY records.
+        """
+        index._logged += 1
+        if index._logged >= cls.COMPACT_EVERY:
+            index.save()
+            return
+        with open(Storage.SEARCH_LOG_FILE, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+            offset = file.tell()
+        cls._cached = (cls._cached[0], index, offset)
+
+    @classmethod
+    def task_changed(cls, project_id: str, task: dict) -> None:
+        """re-indexes one task in the stored index."""
+        with Storage.merge_lock(Storage.SEARCH_INDEX_FILE):
+            index = cls.load()
+            index.index_task(project_id, task)
+            cls._log(index, {'op': 'index', 'task_id': task['task_id'], 'doc': index.docs[task['task_id']]})
+
+    @classmethod
+    def merge(cls, changes) -> None:
+        """adds the tasks of another index, e.g. one built by an import, to the stored index as a new snapshot."""
+        with Storage.merge_lock(Storage.SEARCH_INDEX_FILE):
+            index = cls.load()
+            for task_id, doc in changes.docs.items():
+                index._put(task_id, doc)
+            index.save()
+
+    @classmethod
+    def task_removed(cls, task_id: str) -> None:
+        with Storage.merge_lock(Storage.SEARCH_INDEX_FILE):
+            index = cls.load()
+            index.remove_task(task_id)
+            cls._log(index, {'op': 'remove', 'task_id': task_id})
+
+    @classmethod
+    def project_removed(cls, project_id: str) -> None:
+        with Storage.merge_lock(Storage.SEARCH_INDEX_FILE):
+            index = cls.load()
+            index.remove_project(project_id)
+            cls._log(index, {'op': 'remove_project', 'project_id': project_id})
+
+    def index_task(self, project_id: str, task: dict) -> None:
+        """adds or re-indexes a task."""
+        if 'comments' in task:
+            comment_terms = {}
+            for comment in task['comments']:
+                for word in tokenize(comment['content']):
+                    comment_terms[word] = comment_terms.get(word, 0) + TEXT_WEIGHT
+        else:
+            # the comments are in a segment and were not loaded, keep what was indexed for them
+            comment_terms = dict(self.docs.get(task['task_id'], {}).get('comment_terms', {}))
+        terms = dict(comment_terms)
+        for word in tokenize(task.get('title', '')):
+            terms[word] = terms.get(word, 0) + TITLE_WEIGHT
+        for word in tokenize(task.get('description', '')):
+            terms[word] = terms.get(word, 0) + TEXT_WEIGHT
+        self._put(task['task_id'], {'project_id': project_id, 'title': task.get('title', ''), 'terms': terms,
+                                    'comment_terms': comment_terms})
+
+    def _put(self, task_id: str, doc: dict) -> None:
+        self.remove_task(task_id)
+        for word, weight in doc['terms'].items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                if self._words is not None:
+                    bisect.insort(self._words, word)
+            self.postings[word][task_id] = weight
+        self.docs[task_id] = doc
+
+    def remove_task(self, task_id: str) -> None:
+        doc = self.docs.pop(task_id, None)
+        if doc is None:
+            return
+        for word in doc['terms']:
+            tasks = self.postings.get(word, {})
+            tasks.pop(task_id, None)
+            if not tasks:
+                self.postings.pop(word, None)
+                if self._words is not None:
+                    del self._words[bisect.bisect_left(self._words, word)]
+
+    def remove_project(self, project_id: str) -> None:
+        for task_id in [task_id for task_id, doc in self.docs.items() if doc['project_id'] == project_id]:
+            self.remove_task(task_id)
+
+    def _vocabulary(self) -> list:
+        if self._words is None:
+            self._words = sorted(self.postings)
+        return self._words
+
+    def _matches(self, prefix: str) -> dict:
+        """returns {task_id: weight} for every word that starts with the prefix."""
+        words = self._vocabulary()
+        matches = {}
+        for position in range(bisect.bisect_left(words, prefix), len(words)):
+            word = words[position]
+            if not word.startswith(prefix):
+                break
+            # whole-word matches rank above prefix matches
+            boost = 2 if word == prefix else 1
+            for task_id, weight in self.postings[word].items():
+                matches[task_id] = matches.get(task_id, 0) + weight * boost
+        return matches
+
+    def search(self, query: str, project_ids=None, limit: int = 20) -> list:
+        """Returns the tasks matching every word of the query as dicts, best first.
+
+        Every query word also matches the words it is a prefix of. project_ids
+        limits the results to the projects the user can see.
+        """
+        scores = None
+        for word in tokenize(query):
+            matches = self._matches(word)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {task_id: score + matches[task_id] for task_id, score in scores.items()
+                          if task_id in matches}
+        if not scores:
+            return []
+        if project_ids is not None:
+            project_ids = set(project_ids)
+            scores = {task_id: score for task_id, score in scores.items()
+                      if self.docs[task_id]['project_id'] in project_ids}
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+        return [{'task_id': task_id, 'project_id': self.docs[task_id]['project_id'],
+                 'title': self.docs[task_id]['title'], 'score': score} for task_id, score in ranked]
+
+
+def search_tasks(username: str, query: str, limit: int = 20) -> list:
+    """searches the tasks of the projects the user owns or is a member of."""
+    user_projects = Storage.user_projects(username)
+    return SearchIndex.load().search(query, user_projects['owned'] + user_projects['member'], limit)
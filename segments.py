@@ -0,0 +1,85 @@
+import json
+import os
+from urllib.parse import quote
+
+DETAIL_KEYS = ('history', 'comments')
+
+
+class Segments:
+    """Append-only files holding the history and comments of the tasks of one project."""
+
+    @staticmethod
+    def path(directory: str, project_id: str) -> str:
+        """returns the segment file of a project."""
+        return os.path.join(directory, quote(project_id, safe='') + '.jsonl')
+
+    @staticmethod
+    def append(path: str, records: list) -> None:
+        """adds records of the form {'task_id', 'kind', 'entry'} to the end of the segment."""
+        if not records:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        lines = ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        with open(path, 'a') as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def read(path: str, task_id: str) -> dict:
+        """returns the history and comments of one task."""
+        details = {kind: [] for kind in DETAIL_KEYS}
+        if not os.path.exists(path):
+            return details
+        # the task id is checked on the raw line first so other tasks' entries are not parsed
+        needle = json.dumps(task_id)
+        with open(path, 'r') as file:
+            for line in file:
+                if needle not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record['task_id'] == task_id:
+                    details[record['kind']].append(record['entry'])
+        return details
+
+    @staticmethod
+    def read_all(path: str) -> dict:
+        """returns the history and comments of every task in the segment, by task id."""
+        details = {}
+        if not os.path.exists(path):
+            return details
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                task = details.setdefault(record['task_id'], {kind: [] for kind in DETAIL_KEYS})
+                task[record['kind']].append(record['entry'])
+        return details
+
+    @staticmethod
+    def split(project: dict, known: dict) -> tuple:
+        """Takes the history and comments out of the tasks of a project.
+
+        Returns the project without them and the records that are not in the
+        segment yet. known maps a task id to how many history entries and
+        comments of it the segment already holds, and is updated.
+        """
+        tasks = {}
+        records = []
+        for task in project.get('tasks', {}).values():
+            if not any(kind in task for kind in DETAIL_KEYS):
+                tasks[task['task_id']] = task
+                continue
+            counts = known.setdefault(task['task_id'], {kind: 0 for kind in DETAIL_KEYS})
+            for kind in DETAIL_KEYS:
+                entries = task.get(kind, [])
+                for entry in entries[counts[kind]:]:
+                    records.append({'task_id': task['task_id'], 'kind': kind, 'entry': entry})
+                counts[kind] = max(counts[kind], len(entries))
+            tasks[task['task_id']] = {key: value for key, value in task.items() if key not in DETAIL_KEYS}
+        return dict(project, tasks=tasks), records
@@ -0,0 +1,181 @@
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from models import Project
+from storage import Storage
+from concurrency import ConflictError
+from service import ServiceError, TrelloService
+from session import AuthenticationError
+from logger import log1
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVICE_ERROR = -32000
+AUTH_ERROR = -32001
+CONFLICT = -32002
+
+# the TrelloService methods clients may call; all of them take the session token
+METHODS = (
+    'deactivate_user', 'list_projects', 'open_project', 'board', 'board_page', 'board_pages', 'create_project',
+    'rename_project', 'remove_project', 'add_member', 'remove_member', 'add_task', 'get_task', 'update_title',
+    'update_description', 'update_end_time', 'update_priority', 'update_status', 'add_comment', 'assign', 'unassign',
+    'delete_task', 'bulk_edit', 'search'
+)
+READ_ONLY = ('list_projects', 'open_project', 'board', 'board_page', 'board_pages', 'get_task', 'search')
+
+
+class RpcError(Exception):
+    def __init__(self, code: int, message: str, kind: str = None):
+        self.code = code
+        self.kind = kind
+        super().__init__(message)
+
+
+def _jsonable(value):
+    if isinstance(value, Project):
+        return dict(value.to_dict(), project_id=value.project_id)
+    return value
+
+
+class RpcServer:
+    """Serves TrelloService over newline-delimited JSON-RPC 2.0.
+
+    Every call runs in a worker thread so slow disk writes do not stall other
+    clients. Calls that change a project wait for that project's lock, so
+    writes to one project are applied one at a time while other projects go
+    on; user changes share one lock. Saves are left to Storage's group commit,
+    which writes them in the background.
+    """
+
+    def __init__(self, workers: int = 8):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # a lock lives as long as a call holds or waits for it
+        self.locks = weakref.WeakValueDictionary()
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def _check_params(function, params: dict) -> None:
+        try:
+            inspect.signature(function).bind(**params)
+        except TypeError as e:
+            raise RpcError(INVALID_PARAMS, str(e))
+
+    async def call(self, method: str, params: dict):
+        """runs one method and returns its result, raising RpcError."""
+        loop = asyncio.get_running_loop()
+        if method == 'register':
+            self._check_params(TrelloService.register, params)
+            async with self._lock('users'):
+                await loop.run_in_executor(self.executor, lambda: TrelloService.register(**params))
+            return None
+        if method == 'login':
+            self._check_params(TrelloService.login, params)
+            service, token = await loop.run_in_executor(self.executor, lambda: TrelloService.login(**params))
+            return {'token': token, 'username': service.actor}
+        if method not in METHODS:
+            raise RpcError(METHOD_NOT_FOUND, f"unknown method {method}")
+        params = dict(params)
+        service = TrelloService.from_token(params.pop('token', None))
+        function = getattr(service, method)
+        self._check_params(function, params)
+        if method in READ_ONLY:
+            result = await loop.run_in_executor(self.executor, lambda: function(**params))
+        else:
+            key = 'users' if method == 'deactivate_user' else f"project:{params.get('project_id')}"
+            async with self._lock(key):
+                result = await loop.run_in_executor(self.executor, lambda: function(**params))
+        return _jsonable(result)
+
+    async def handle(self, request) -> dict:
+        """answers one decoded request; returns None for notifications."""
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+                raise RpcError(INVALID_REQUEST, "invalid request")
+            params = request.get('params', {})
+            if not isinstance(params, dict):
+                raise RpcError(INVALID_PARAMS, "params must be an object")
+            try:
+                result = await self.call(request['method'], params)
+            except AuthenticationError as e:
+                raise RpcError(AUTH_ERROR, str(e), type(e).__name__)
+            except ServiceError as e:
+                raise RpcError(SERVICE_ERROR, str(e), type(e).__name__)
+            except ConflictError as e:
+                raise RpcError(CONFLICT, str(e), type(e).__name__)
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        except RpcError as e:
+            error = {'code': e.code, 'message': str(e)}
+            if e.kind:
+                error['data'] = {'type': e.kind}
+            response = {'jsonrpc': '2.0', 'id': request_id, 'error': error}
+        return response if isinstance(request, dict) and 'id' in request else None
+
+    async def client_connected(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """reads one request per line and writes one response per line."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    response = {'jsonrpc': '2.0', 'id': None,
+                                'error': {'code': PARSE_ERROR, 'message': "parse error"}}
+                else:
+                    response = await self.handle(request)
+                if response is not None:
+                    writer.write(json.dumps(response, default=str).encode() + b'\n')
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str = None, host: str = '127.0.0.1', port: int = 8765) -> None:
+        """listens on a Unix socket if a path is given, otherwise on localhost TCP, until cancelled."""
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.client_connected, path=socket_path)
+        else:
+            server = await asyncio.start_server(self.client_connected, host, port)
+        log1.info(f"server listening on {socket_path or f'{host}:{port}'}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=True)
+            Storage.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the project management system over JSON-RPC.")
+    parser.add_argument('--socket', type=str, help="Unix socket path; localhost TCP is used if not given.")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help="TCP host.")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port.")
+    parser.add_argument('--commit-window', type=float, default=0.05,
+                        help="Seconds saves are collected before they are written.")
+    parser.add_argument('--data-dir', type=str, default=Storage.DATA_DIR, help="Data directory.")
+    args = parser.parse_args()
+
+    Storage.set_data_dir(args.data_dir)
+    Storage.GROUP_COMMIT_WINDOW = Storage.GROUP_COMMIT_WINDOW or args.commit_window
+    Storage.flush_on_signals()
+    try:
+        asyncio.run(RpcServer().serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        Storage.flush()
+
+# python server.py --socket /tmp/trellomize.sock
+# echo '{"jsonrpc": "2.0", "id": 1, "method": "login", "params": {"username": "admin", "password": "..."}}' | nc -U /tmp/trellomize.sock
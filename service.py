@@ -0,0 +1,352 @@
+from datetime import datetime
+from models import BOARD_SORTS, User, Project, Task, TaskStatus
+from storage import Storage
+from search import SearchIndex, search_tasks
+from session import SessionEndedError, Sessions
+from logger import log_event, timed
+from utils import Utils
+
+
+class ServiceError(Exception):
+    """Base class of the errors TrelloService raises, with the message to show the user."""
+
+
+class NotFoundError(ServiceError):
+    """Raised when a user, project or task does not exist."""
+
+
+class AlreadyExistsError(ServiceError):
+    """Raised when a username, email or project id is taken."""
+
+
+class PermissionDeniedError(ServiceError):
+    """Raised when the actor is not allowed to do something."""
+
+
+class ValidationError(ServiceError):
+    """Raised for invalid input."""
+
+
+class TrelloService:
+    """The operations of the app for one user (the actor), without any prompts or output.
+
+    Every method loads what it needs from Storage, checks the actor's rights,
+    saves and returns the result, raising a ServiceError subclass otherwise.
+    """
+
+    def __init__(self, actor: str):
+        self.actor = actor
+
+    @classmethod
+    def login(cls, username: str, password: str):
+        """checks the password and returns the service of the user and the session token."""
+        session = Sessions.login(username, password)
+        return cls(session.username), session.token
+
+    @classmethod
+    def from_token(cls, token: str):
+        session = Sessions.get(token)
+        if session is None:
+            raise SessionEndedError("Your session has ended.")
+        return cls(session.username)
+
+    # users
+
+    @staticmethod
+    def register(username: str, password: str, email: str) -> None:
+        """creates an active user."""
+        if Storage.get_user(username) is not None or Storage.find_user_by_email(email) is not None:
+            raise AlreadyExistsError("Username or email already exists.")
+        if not Utils.validate_email(email):
+            raise ValidationError("Invalid email format.")
+        if not Utils.validate_username(username):
+            raise ValidationError("Invalid username format.")
+        Storage.add_user(username, User(username, Utils.hash_password(password), email).to_dict())
+        if email == "admin@gmail.com":
+            log_event("admin_created", username)
+        else:
+            log_event("user_created", username)
+
+    def deactivate_user(self, username: str) -> None:
+        """disables a user and ends the user's sessions, only the admin can do it."""
+        users = Storage.load_users()
+        if self.actor != Storage.load_admin().get("username"):
+            raise PermissionDeniedError("Only the leader can deactivate members.")
+        if username not in users:
+            raise NotFoundError("User not found.")
+        user = User.from_dict(username, users[username])
+        user.is_active = False
+        users[username] = user.to_dict()
+        Storage.save_users(users)
+        Sessions.invalidate_user(username)
+        log_event("user_deactivated", self.actor, username=username)
+
+    # projects
+
+    @staticmethod
+    def _project(project_id: str) -> dict:
+        project = Storage.get_project(project_id)
+        if project is None:
+            raise NotFoundError("Project not found.")
+        return project
+
+    def _owned(self, project: dict, action: str) -> None:
+        if self.actor != project['owner']:
+            raise PermissionDeniedError(f"Only the project owner can {action}.")
+
+    def list_projects(self) -> dict:
+        """returns the ids of the projects the actor owns and the ones the actor is a member of."""
+        return Storage.user_projects(self.actor)
+
+    def open_project(self, project_id: str) -> dict:
+        """returns a project the actor is a member of."""
+        project = Storage.get_project(project_id)
+        if project is None:
+            raise NotFoundError("Project not found.")
+        if self.actor not in project['members']:
+            log_event("project_access_denied", self.actor, project_id, level="ERROR")
+            raise PermissionDeniedError("Project items are only available to its members.")
+        return project
+
+    def board(self, project_id: str) -> Project:
+        """returns the project with its tasks by status and priority."""
+        return Project.from_dict(project_id, self.open_project(project_id))
+
+    def board_page(self, project_id: str, status: str, page: int = 0, page_size: int = 20,
+                   sort_by: str = 'board') -> dict:
+        """Returns one page of a board column without loading the history and comments of its tasks.
+
+        The result holds the status, page, number of pages, number of tasks in
+        the column and the tasks of the page.
+        """
+        if status not in TaskStatus.__members__:
+            raise ValidationError(f"Invalid status {status}.")
+        return self._board_columns(project_id, {status: page}, page_size, sort_by)[0]
+
+    def board_pages(self, project_id: str, pages: dict = None, page_size: int = 20, sort_by: str = 'board') -> list:
+        """Returns a page of every board column, in status order, reading the project once.
+
+        pages maps a status to the page of its column to show, the first one
+        by default; each column is what board_page returns.
+        """
+        pages = pages or {}
+        for status in pages:
+            if status not in TaskStatus.__members__:
+                raise ValidationError(f"Invalid status {status}.")
+        return self._board_columns(project_id, {status.name: pages.get(status.name, 0) for status in TaskStatus},
+                                   page_size, sort_by)
+
+    def _board_columns(self, project_id: str, pages: dict, page_size: int, sort_by: str) -> list:
+        if sort_by not in BOARD_SORTS:
+            raise ValidationError(f"Tasks can be sorted by {', '.join(BOARD_SORTS)}.")
+        if page_size < 1 or any(page < 0 for page in pages.values()):
+            raise ValidationError("Invalid page.")
+        projects = self.list_projects()
+        if project_id not in projects['owned'] + projects['member']:
+            self.open_project(project_id)
+        columns = Storage.task_pages(project_id, {status: page * page_size for status, page in pages.items()},
+                                     page_size, sort_by)
+        return [{'status': status, 'page': page, 'pages': max(1, -(-columns[status][1] // page_size)),
+                 'total': columns[status][1], 'tasks': columns[status][0]} for status, page in pages.items()]
+
+    def create_project(self, project_id: str, title: str) -> dict:
+        if Storage.get_project(project_id) is not None:
+            raise AlreadyExistsError("Project ID already exists.")
+        project = Project(project_id, title, self.actor).to_dict()
+        # one batch, so the project and the membership index are written together
+        with Storage.batch():
+            Storage.add_project(project_id, project)
+            Storage.index_membership(project_id, self.actor, 'owned')
+        log_event("project_created", self.actor, project_id)
+        return project
+
+    def rename_project(self, project_id: str, title: str) -> None:
+        project = self._project(project_id)
+        self._owned(project, "edited basic info")
+        Storage.rename_project(project_id, title)
+        log_event("project_renamed", self.actor, project_id)
+
+    def remove_project(self, project_id: str) -> None:
+        project = self._project(project_id)
+        self._owned(project, "remove project")
+        with Storage.batch():
+            Storage.delete_project(project_id)
+            Storage.unindex_project(project_id, project)
+        SearchIndex.project_removed(project_id)
+        log_event("project_removed", self.actor, project_id)
+
+    def add_member(self, project_id: str, username: str) -> bool:
+        """adds a member and returns False if the user already was one."""
+        project = self._project(project_id)
+        if Storage.get_user(username) is None:
+            raise NotFoundError("User not found.")
+        self._owned(project, "add members")
+        if username in project['members']:
+            return False
+        with Storage.batch():
+            Storage.add_member(project_id, username)
+            Storage.index_membership(project_id, username, 'member')
+        log_event("member_added", self.actor, project_id, username=username)
+        return True
+
+    def remove_member(self, project_id: str, username: str) -> None:
+        project = self._project(project_id)
+        self._owned(project, "remove members")
+        if username not in project['members']:
+            raise NotFoundError(f"{username} not member in project {project_id}")
+        with Storage.batch():
+            Storage.remove_member(project_id, username)
+            Storage.unindex_membership(project_id, username)
+        log_event("member_removed", self.actor, project_id, username=username)
+
+    # tasks
+
+    def add_task(self, project_id: str, title: str, description: str, assignees: list) -> dict:
+        project = Storage.get_project(project_id)
+        if project is None:
+            raise NotFoundError("Project not found.")
+        self._owned(project, "add tasks")
+        if not set(assignees).issubset(set(project['members'] + [""])):
+            raise ValidationError("All assignees must be project members.")
+        task = Task(title, description, assignees).to_dict()
+        Storage.upsert_task(project_id, task)
+        SearchIndex.task_changed(project_id, task)
+        log_event("task_added", self.actor, project_id, task['task_id'])
+        return task
+
+    def get_task(self, project_id: str, task_id: str) -> dict:
+        """returns a task with its history and comments if the actor may see it."""
+        task = Storage.get_project(project_id) or {}
+        task = task.get('tasks', {}).get(task_id)
+        if task is None:
+            log_event("task_not_found", self.actor, project_id, task_id, level="ERROR")
+            raise NotFoundError("Task not found.")
+        if self.actor not in task['assignees'] and task['assignees'] != [""]:
+            log_event("task_access_denied", self.actor, project_id, task_id, level="ERROR")
+            raise PermissionDeniedError("if the tasks are empty or you are not member ,you can not see the task details")
+        return Storage.load_task_details(project_id, task)
+
+    def _editable(self, project: dict, task_id: str) -> dict:
+        task = project['tasks'].get(task_id)
+        if task is None:
+            log_event("task_not_found", self.actor, task_id=task_id, level="ERROR")
+            raise NotFoundError("Task not found.")
+        if self.actor not in task['assignees']:
+            raise PermissionDeniedError("only assignees can edited")
+        return task
+
+    def get_editable_task(self, project_id: str, task_id: str) -> dict:
+        """returns a task the actor is assigned to, which is what editing a task requires."""
+        project = Storage.get_project(project_id)
+        if project is None:
+            raise NotFoundError("Project not found.")
+        return Storage.load_task_details(project_id, self._editable(project, task_id))
+
+    def _edit_task(self, project_id: str, task_id: str, change: str, apply, owner_only: bool = False) -> dict:
+        """loads the task, lets apply change it, records the change in its history and saves it."""
+        project = Storage.get_project(project_id)
+        if project is None:
+            raise NotFoundError("Project not found.")
+        task = self._editable(project, task_id)
+        if owner_only and self.actor != project['owner']:
+            log_event("task_edit_denied", self.actor, project_id, task_id, level="ERROR", change=change)
+            raise PermissionDeniedError(f"Only the project owner can {change} in the task.")
+        my_task = Task.from_dict(Storage.load_task_details(project_id, task))
+        apply(my_task, project)
+        my_task.add_history(change, self.actor, datetime.now().isoformat())
+        data = my_task.to_dict()
+        Storage.upsert_task(project_id, data)
+        log_event("task_updated", self.actor, project_id, task_id, change=change)
+        return data
+
+    def update_title(self, project_id: str, task_id: str, title: str) -> dict:
+        task = self._edit_task(project_id, task_id, "title", lambda task, _: task.update_title(title))
+        SearchIndex.task_changed(project_id, task)
+        return task
+
+    def update_description(self, project_id: str, task_id: str, description: str) -> dict:
+        task = self._edit_task(project_id, task_id, "description",
+                               lambda task, _: task.update_description(description))
+        SearchIndex.task_changed(project_id, task)
+        return task
+
+    def update_end_time(self, project_id: str, task_id: str, end_time=None) -> dict:
+        """sets the end time of a task, to now if none is given."""
+        return self._edit_task(project_id, task_id, "end time",
+                               lambda task, _: task.update_end_time(end_time or datetime.now()))
+
+    def update_priority(self, project_id: str, task_id: str, priority: str) -> dict:
+        return self._edit_task(project_id, task_id, f"priority update to {priority}",
+                               lambda task, _: task.update_priority(priority))
+
+    def update_status(self, project_id: str, task_id: str, status: str) -> dict:
+        return self._edit_task(project_id, task_id, f"status update to {status}",
+                               lambda task, _: task.update_status(status))
+
+    def add_comment(self, project_id: str, task_id: str, content: str) -> dict:
+        """appends the comment and its history entry without rewriting the task."""
+        task = self.get_editable_task(project_id, task_id)
+        now = datetime.now().isoformat()
+        comment = {'username': self.actor, 'content': content, 'timestamp': now}
+        history = {'change': "comment", 'user': self.actor, 'time': now}
+        Storage.append_comment(project_id, task_id, comment, history)
+        task['comments'].append(comment)
+        task['history'].append(history)
+        log_event("task_updated", self.actor, project_id, task_id, change="comment")
+        SearchIndex.task_changed(project_id, task)
+        return task
+
+    def _check_member(self, project: dict, username: str) -> None:
+        if username not in project['members'] + [""]:
+            raise ValidationError("All assignees must be project members.")
+
+    def assign(self, project_id: str, task_id: str, username: str) -> dict:
+        def apply(task, project):
+            self._check_member(project, username)
+            task.assign_user(username)
+        return self._edit_task(project_id, task_id, "add member", apply, owner_only=True)
+
+    def unassign(self, project_id: str, task_id: str, username: str) -> dict:
+        def apply(task, project):
+            self._check_member(project, username)
+            task.unassign_user(username)
+        return self._edit_task(project_id, task_id, "remove member", apply, owner_only=True)
+
+    def delete_task(self, project_id: str, task_id: str) -> None:
+        project = self._project(project_id)
+        self._editable(project, task_id)
+        Storage.delete_task(project_id, task_id)
+        SearchIndex.task_removed(task_id)
+        log_event("task_deleted", self.actor, project_id, task_id)
+
+    def bulk_edit(self, project_id: str, filters: dict, changes: dict) -> int:
+        """Applies the same changes to every task of the project matching the filters, saving once.
+
+        filters may hold status, priority and assignee; changes may hold status,
+        priority, end_time, assign and unassign. Returns how many tasks changed.
+        """
+        project = Storage.get_project(project_id)
+        if project is None:
+            raise NotFoundError("Project not found.")
+        self._owned(project, "edit tasks in bulk")
+        for username in (changes.get('assign'), changes.get('unassign')):
+            if username is not None and username not in project['members']:
+                raise ValidationError("All assignees must be project members.")
+        with timed("bulk_edit", self.actor, project_id) as fields:
+            board = Project.from_dict(project_id, project)
+            task_ids = board.find_tasks(**filters)
+            # one read of the project's segment for all of the selected tasks
+            selected = {task_id: board.get_task(task_id) for task_id in task_ids}
+            Storage.load_project_details(project_id, {'tasks': selected})
+            changed = board.bulk_update(task_ids, self.actor, **changes)
+            if changed:
+                Storage.upsert_tasks(project_id, changed)
+            fields['tasks'] = len(changed)
+        return len(changed)
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """searches the tasks of the projects the actor owns or is a member of."""
+        with timed("search", self.actor) as fields:
+            results = search_tasks(self.actor, query, limit)
+            fields['results'] = len(results)
+        return results
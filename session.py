@@ -0,0 +1,83 @@
+import secrets
+import threading
+import time
+from models import User
+from storage import Storage
+from utils import Utils
+
+
+class AuthenticationError(Exception):
+    """Raised when a login fails, with the message to show the user."""
+
+
+class InactiveUserError(AuthenticationError):
+    """Raised when the password is right but the user was deactivated."""
+
+
+class SessionEndedError(AuthenticationError):
+    """Raised when a token is unknown, logged out or belongs to a deactivated user."""
+
+
+class Session:
+    """A logged in user, identified by an opaque token."""
+    __slots__ = ('token', 'user', 'created')
+
+    def __init__(self, token: str, user: User):
+        self.token = token
+        self.user = user
+        self.created = time.time()
+
+    @property
+    def username(self) -> str:
+        return self.user.username
+
+
+class Sessions:
+    """In-memory session store: the password is checked once per login and the user record is kept with the token."""
+    _sessions = {}
+    _tokens = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def login(username: str, password: str) -> Session:
+        """checks the password of an active user and returns a new session."""
+        data = Storage.get_user(username)
+        if data is None or data['password'] != Utils.hash_password(password):
+            raise AuthenticationError("Invalid username or password.")
+        if not data.get('is_active', True):
+            raise InactiveUserError("Account is inactive.")
+        session = Session(secrets.token_urlsafe(32), User.from_dict(username, data))
+        with Sessions._lock:
+            Sessions._sessions[session.token] = session
+            Sessions._tokens.setdefault(username, set()).add(session.token)
+        return session
+
+    @staticmethod
+    def get(token: str):
+        """returns the session of a token, or None if it was logged out or its user deactivated."""
+        session = Sessions._sessions.get(token)
+        if session is None or not session.user.is_active:
+            return None
+        return session
+
+    @staticmethod
+    def logout(token: str) -> None:
+        with Sessions._lock:
+            session = Sessions._sessions.pop(token, None)
+            if session is not None:
+                Sessions._tokens.get(session.username, set()).discard(token)
+
+    @staticmethod
+    def invalidate_user(username: str) -> None:
+        """ends every session of a user, e.g. after the user was deactivated."""
+        with Sessions._lock:
+            for token in Sessions._tokens.pop(username, set()):
+                session = Sessions._sessions.pop(token, None)
+                if session is not None:
+                    session.user.is_active = False
+
+    @staticmethod
+    def clear() -> None:
+        with Sessions._lock:
+            Sessions._sessions = {}
+            Sessions._tokens = {}
@@ -0,0 +1,103 @@
+import json
+import os
+from collections.abc import MutableMapping
+from urllib.parse import quote
+from concurrency import merge_project
+
+
+class ShardedProjects(MutableMapping):
+    """A projects dictionary that keeps one file per project and loads them on first access."""
+    # when set, save replaces the shards instead of merging with changes from other sessions
+    overwrite = False
+
+    def __init__(self, directory: str, storage):
+        self.directory = directory
+        self.storage = storage
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.manifest = storage.load_data(self.manifest_path)
+        self._loaded = {}
+        self._originals = {}
+        self._added = set()
+        # project_id -> shard path of the projects removed since the last save
+        self._removed = {}
+
+    @staticmethod
+    def shard_name(project_id: str) -> str:
+        """returns the file name of a project shard; the prefix keeps it apart from manifest.json."""
+        return 'p_' + quote(project_id, safe='') + '.json'
+
+    def shard_path(self, project_id: str) -> str:
+        return os.path.join(self.directory, self.manifest.get(project_id, self.shard_name(project_id)))
+
+    def __getitem__(self, project_id: str) -> dict:
+        if project_id in self._loaded:
+            return self._loaded[project_id]
+        if project_id not in self.manifest:
+            raise KeyError(project_id)
+        project = self.storage.normalize_project(self.storage.load_data(self.shard_path(project_id)))
+        self._loaded[project_id] = project
+        self._originals[project_id] = json.dumps(project, default=str, sort_keys=True)
+        return project
+
+    def __setitem__(self, project_id: str, project: dict) -> None:
+        if project_id not in self.manifest:
+            self.manifest[project_id] = self.shard_name(project_id)
+            self._added.add(project_id)
+            self._removed.pop(project_id, None)
+        self._loaded[project_id] = project
+
+    def __delitem__(self, project_id: str) -> None:
+        if project_id not in self.manifest:
+            raise KeyError(project_id)
+        self._removed[project_id] = self.shard_path(project_id)
+        self._added.discard(project_id)
+        self._loaded.pop(project_id, None)
+        self._originals.pop(project_id, None)
+        del self.manifest[project_id]
+
+    def __iter__(self):
+        return iter(list(self.manifest))
+
+    def _merge_shard(self, theirs: dict, project_id: str, original, project: dict, overwrite: bool) -> dict:
+        theirs = self.storage.normalize_project(theirs) or None
+        if overwrite:
+            merged = dict(project)
+            merged['version'] = (theirs.get('version', 0) if theirs else 0) + 1
+            return merged
+        base = json.loads(original) if original else None
+        return merge_project(project_id, base, project, theirs)
+
+    @staticmethod
+    def _merge_manifest(manifest: dict, added: dict, removed: list) -> dict:
+        manifest.update(added)
+        for project_id in removed:
+            manifest.pop(project_id, None)
+        return manifest
+
+    def __len__(self) -> int:
+        return len(self.manifest)
+
+    def __contains__(self, project_id) -> bool:
+        return project_id in self.manifest
+
+    def save(self) -> None:
+        """writes only the shards that changed and merges the manifest with other sessions."""
+        for project_id, loaded in self._loaded.items():
+            project = self.storage.split_details(project_id, self.storage.normalize_project(loaded))
+            original = self._originals.get(project_id)
+            if original == json.dumps(project, default=str, sort_keys=True):
+                continue
+            # each shard has its own lock, so sessions working on other projects never wait
+            merged = self.storage.update_merged(self.shard_path(project_id), self._merge_shard, project_id,
+                                                original, project, self.overwrite)
+            loaded['version'] = project['version'] = merged['version']
+            self._originals[project_id] = json.dumps(project, default=str, sort_keys=True)
+        for project_id, path in self._removed.items():
+            self.storage.delete_data(path)
+            self.storage.drop_details(project_id)
+        if self._added or self._removed:
+            added = {project_id: self.shard_name(project_id) for project_id in self._added}
+            self.manifest = dict(self.storage.update_merged(self.manifest_path, self._merge_manifest, added,
+                                                            list(self._removed)))
+            self._added = set()
+            self._removed = {}
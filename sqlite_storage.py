@@ -0,0 +1,399 @@
+import marshal
+import sqlite3
+import threading
+from concurrency import ConflictError, ProjectsDict
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    email TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS users_email ON users(email);
+CREATE TABLE IF NOT EXISTS admin (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS projects (
+    project_id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS projects_owner ON projects(owner);
+CREATE TABLE IF NOT EXISTS members (
+    project_id TEXT NOT NULL REFERENCES projects(project_id) ON DELETE CASCADE,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (project_id, username)
+);
+CREATE INDEX IF NOT EXISTS members_user ON members(username);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL REFERENCES projects(project_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT,
+    description TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    priority TEXT,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_project ON tasks(project_id, position);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks(project_id, status, position);
+CREATE TABLE IF NOT EXISTS assignees (
+    task_id TEXT NOT NULL REFERENCES tasks(task_id) ON DELETE CASCADE,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (task_id, position)
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL REFERENCES tasks(task_id) ON DELETE CASCADE,
+    change TEXT,
+    user TEXT,
+    time TEXT
+);
+CREATE INDEX IF NOT EXISTS history_task ON history(task_id, id);
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL REFERENCES tasks(task_id) ON DELETE CASCADE,
+    username TEXT,
+    content TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS comments_task ON comments(task_id, id);
+'''
+
+
+class SqliteStorage:
+    """Stores users, projects and tasks in normalized SQLite tables."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # sqlite3 connections may not be shared between threads, so every thread gets its own
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.conn.executescript(SCHEMA)
+        columns = [row['name'] for row in self.conn.execute('PRAGMA table_info(projects)')]
+        if 'version' not in columns:
+            # databases made before projects had versions
+            self.conn.execute('ALTER TABLE projects ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """the connection of the calling thread, opened on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # check_same_thread is off only so close() can close the connections of every thread
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA busy_timeout = 5000')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    # users
+
+    def load_users(self) -> dict:
+        """returns the users in the same shape as users.json"""
+        users = {}
+        for row in self.conn.execute('SELECT * FROM users ORDER BY rowid'):
+            users[row['username']] = {
+                'password': row['password'],
+                'email': row['email'],
+                'is_active': bool(row['is_active'])
+            }
+        return users
+
+    def save_users(self, users: dict) -> None:
+        """replaces the users table with the given dictionary"""
+        with self.conn:
+            self.conn.execute('DELETE FROM users')
+            self.conn.executemany(
+                'INSERT INTO users (username, password, email, is_active) VALUES (?, ?, ?, ?)',
+                [(username, user['password'], user['email'], int(user['is_active']))
+                 for username, user in users.items()])
+
+    def get_user(self, username: str):
+        row = self.conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            return None
+        return {'password': row['password'], 'email': row['email'], 'is_active': bool(row['is_active'])}
+
+    def add_user(self, username: str, user: dict) -> None:
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO users (username, password, email, is_active) '
+                              'VALUES (?, ?, ?, ?)', (username, user['password'], user['email'],
+                                                      int(user['is_active'])))
+
+    def find_user_by_email(self, email: str):
+        row = self.conn.execute('SELECT username FROM users WHERE email = ?', (email,)).fetchone()
+        return row['username'] if row else None
+
+    def load_admin(self) -> dict:
+        row = self.conn.execute('SELECT * FROM admin').fetchone()
+        if row is None:
+            return {}
+        return {'username': row['username'], 'password': row['password']}
+
+    def save_admin(self, admin: dict) -> None:
+        with self.conn:
+            self.conn.execute('DELETE FROM admin')
+            if admin:
+                self.conn.execute('INSERT INTO admin (username, password) VALUES (?, ?)',
+                                  (admin['username'], admin['password']))
+
+    # projects
+
+    def load_projects(self) -> dict:
+        """returns the projects in the same shape as projects.json, remembering them for save_projects"""
+        projects = ProjectsDict()
+        for row in self.conn.execute('SELECT * FROM projects ORDER BY rowid'):
+            projects[row['project_id']] = {'title': row['title'], 'owner': row['owner'], 'members': [], 'tasks': {},
+                                           'version': row['version']}
+        for row in self.conn.execute('SELECT project_id, username FROM members ORDER BY project_id, position'):
+            projects[row['project_id']]['members'].append(row['username'])
+        tasks = {}
+        for row in self.conn.execute('SELECT * FROM tasks ORDER BY project_id, position'):
+            task = self._task_from_row(row)
+            tasks[row['task_id']] = task
+            projects[row['project_id']]['tasks'][row['task_id']] = task
+        self._fill_task_lists(tasks, '')
+        projects.base = marshal.dumps(dict(projects))
+        return projects
+
+    def save_projects(self, projects: dict) -> None:
+        """Saves the projects in one transaction.
+
+        Projects from load_projects are compared with what was loaded and only
+        the added, changed and removed ones are written; if another session
+        changed one of them since (its version moved) ConflictError is raised
+        and nothing is saved. Any other dictionary replaces all projects.
+        """
+        if not isinstance(projects, ProjectsDict) or projects.base is None:
+            with self.conn:
+                self.conn.execute('DELETE FROM projects')
+                for project_id, project in projects.items():
+                    self._insert_project(project_id, project)
+            return
+        base = marshal.loads(projects.base)
+        versions = {}
+        with self.conn:
+            for project_id, project in projects.items():
+                old = base.get(project_id)
+                if project == old:
+                    continue
+                if old is None:
+                    try:
+                        self._insert_project(project_id, dict(project, version=1))
+                    except sqlite3.IntegrityError:
+                        raise ConflictError(project_id, []) from None
+                    versions[project_id] = 1
+                    continue
+                self._check_version(project_id, old.get('version', 0))
+                self.conn.execute('DELETE FROM projects WHERE project_id = ?', (project_id,))
+                self._insert_project(project_id, dict(project, version=old.get('version', 0) + 1))
+                versions[project_id] = old.get('version', 0) + 1
+            for project_id, old in base.items():
+                if project_id not in projects:
+                    self._check_version(project_id, old.get('version', 0), missing_ok=True)
+                    self.conn.execute('DELETE FROM projects WHERE project_id = ?', (project_id,))
+        for project_id, version in versions.items():
+            projects[project_id]['version'] = version
+        projects.base = marshal.dumps(dict(projects))
+
+    def _check_version(self, project_id: str, version: int, missing_ok: bool = False) -> None:
+        row = self.conn.execute('SELECT version FROM projects WHERE project_id = ?', (project_id,)).fetchone()
+        if row is None and missing_ok:
+            return
+        if row is None or row['version'] != version:
+            raise ConflictError(project_id, [])
+
+    def _bump_version(self, project_id: str) -> None:
+        self.conn.execute('UPDATE projects SET version = version + 1 WHERE project_id = ?', (project_id,))
+
+    def add_project(self, project_id: str, project: dict) -> None:
+        """inserts one project with its members and tasks"""
+        with self.conn:
+            self._insert_project(project_id, project)
+
+    def rename_project(self, project_id: str, title: str) -> None:
+        with self.conn:
+            self.conn.execute('UPDATE projects SET title = ?, version = version + 1 WHERE project_id = ?',
+                              (title, project_id))
+
+    def delete_project(self, project_id: str) -> None:
+        """deletes one project; its members and tasks go with it"""
+        with self.conn:
+            self.conn.execute('DELETE FROM projects WHERE project_id = ?', (project_id,))
+
+    def add_member(self, project_id: str, username: str) -> None:
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO members (project_id, username, position) '
+                              'SELECT ?, ?, COALESCE(MAX(position) + 1, 0) FROM members WHERE project_id = ?',
+                              (project_id, username, project_id))
+            self._bump_version(project_id)
+
+    def remove_member(self, project_id: str, username: str) -> None:
+        with self.conn:
+            self.conn.execute('DELETE FROM members WHERE project_id = ? AND username = ?', (project_id, username))
+            self._bump_version(project_id)
+
+    def iter_projects(self, fields=None):
+        """yields projects one at a time, reading only the tables the fields need"""
+        if fields is not None and set(fields) <= {'title', 'owner', 'members'}:
+            members = 'members' in fields
+            for row in self.conn.execute('SELECT * FROM projects ORDER BY rowid'):
+                project = {field: row[field] for field in fields if field != 'members'}
+                if members:
+                    project['members'] = [r['username'] for r in self.conn.execute(
+                        'SELECT username FROM members WHERE project_id = ? ORDER BY position', (row['project_id'],))]
+                yield row['project_id'], project
+            return
+        for row in self.conn.execute('SELECT project_id FROM projects ORDER BY rowid'):
+            project = self.get_project(row['project_id'])
+            if fields is not None:
+                project = {field: project[field] for field in fields if field in project}
+            yield row['project_id'], project
+
+    def user_projects(self, username: str) -> dict:
+        """returns the ids of the projects the user owns and is a member of"""
+        result = {'owned': [], 'member': []}
+        # an owner who left the members still owns the project
+        for row in self.conn.execute('SELECT project_id, owner FROM projects WHERE owner = ? OR project_id IN '
+                                     '(SELECT project_id FROM members WHERE username = ?) ORDER BY rowid',
+                                     (username, username)):
+            result['owned' if row['owner'] == username else 'member'].append(row['project_id'])
+        return result
+
+    def get_project(self, project_id: str):
+        """returns a single project or None"""
+        row = self.conn.execute('SELECT * FROM projects WHERE project_id = ?', (project_id,)).fetchone()
+        if row is None:
+            return None
+        project = {'title': row['title'], 'owner': row['owner'], 'tasks': {}, 'version': row['version']}
+        project['members'] = [r['username'] for r in self.conn.execute(
+            'SELECT username FROM members WHERE project_id = ? ORDER BY position', (project_id,))]
+        tasks = project['tasks']
+        for row in self.conn.execute('SELECT * FROM tasks WHERE project_id = ? ORDER BY position', (project_id,)):
+            tasks[row['task_id']] = self._task_from_row(row)
+        self._fill_task_lists(tasks, 'WHERE task_id IN (SELECT task_id FROM tasks WHERE project_id = ?)',
+                              (project_id,))
+        return project
+
+    def task_page(self, project_id: str, status: str, offset: int, limit: int, sort_by: str = 'board'):
+        """returns one page of the tasks with a status, without history and comments, and how many there are"""
+        order = {
+            'board': 'position',
+            'priority': "CASE priority WHEN 'CRITICAL' THEN 0 WHEN 'HIGH' THEN 1 WHEN 'MEDIUM' THEN 2 ELSE 3 END, "
+                        "position",
+            'end_time': "end_time IS NULL OR end_time = 'None', end_time, position"
+        }[sort_by]
+        total = self.conn.execute('SELECT COUNT(*) FROM tasks WHERE project_id = ? AND status = ?',
+                                  (project_id, status)).fetchone()[0]
+        tasks = {}
+        for row in self.conn.execute(f'SELECT * FROM tasks WHERE project_id = ? AND status = ? ORDER BY {order} '
+                                     'LIMIT ? OFFSET ?', (project_id, status, limit, offset)):
+            tasks[row['task_id']] = self._task_from_row(row)
+        if tasks:
+            placeholders = ', '.join('?' * len(tasks))
+            for row in self.conn.execute(f'SELECT task_id, username FROM assignees WHERE task_id IN ({placeholders}) '
+                                         'ORDER BY task_id, position', list(tasks)):
+                tasks[row['task_id']]['assignees'].append(row['username'])
+        for task in tasks.values():
+            del task['history'], task['comments']
+        return list(tasks.values()), total
+
+    def upsert_task(self, project_id: str, task: dict) -> None:
+        """inserts or replaces a single task and its assignees, history and comments"""
+        self.upsert_tasks(project_id, [task])
+
+    def upsert_tasks(self, project_id: str, tasks: list) -> None:
+        """inserts or replaces several tasks of a project in one transaction"""
+        with self.conn:
+            for task in tasks:
+                row = self.conn.execute('SELECT position FROM tasks WHERE task_id = ?', (task['task_id'],)).fetchone()
+                if row is None:
+                    row = self.conn.execute('SELECT COALESCE(MAX(position) + 1, 0) AS position FROM tasks '
+                                            'WHERE project_id = ?', (project_id,)).fetchone()
+                self.conn.execute('DELETE FROM tasks WHERE task_id = ?', (task['task_id'],))
+                self._insert_task(project_id, row['position'], task)
+            self._bump_version(project_id)
+
+    def delete_task(self, project_id: str, task_id: str) -> None:
+        """deletes one task; its assignees, history and comments go with it"""
+        with self.conn:
+            self.conn.execute('DELETE FROM tasks WHERE task_id = ? AND project_id = ?', (task_id, project_id))
+            self._bump_version(project_id)
+
+    def append_comment(self, project_id: str, task_id: str, comment: dict, history: dict = None) -> None:
+        """adds one comment row to a task, and one history row if given"""
+        with self.conn:
+            self.conn.execute('INSERT INTO comments (task_id, username, content, timestamp) VALUES (?, ?, ?, ?)',
+                              (task_id, comment['username'], comment['content'], comment['timestamp']))
+            if history is not None:
+                self.conn.execute('INSERT INTO history (task_id, change, user, time) VALUES (?, ?, ?, ?)',
+                                  (task_id, history['change'], history['user'], history['time']))
+            self._bump_version(project_id)
+
+    # helpers
+
+    def _insert_project(self, project_id: str, project: dict) -> None:
+        self.conn.execute('INSERT INTO projects (project_id, title, owner, version) VALUES (?, ?, ?, ?)',
+                          (project_id, project['title'], project['owner'], project.get('version', 0)))
+        self.conn.executemany('INSERT OR IGNORE INTO members (project_id, username, position) VALUES (?, ?, ?)',
+                              [(project_id, username, i) for i, username in enumerate(project['members'])])
+        tasks = project['tasks']
+        for i, task in enumerate(tasks.values() if isinstance(tasks, dict) else tasks):
+            self._insert_task(project_id, i, task)
+
+    def _insert_task(self, project_id: str, position: int, task: dict) -> None:
+        self.conn.execute('INSERT INTO tasks (task_id, project_id, position, title, description, start_time, '
+                          'end_time, priority, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                          (task['task_id'], project_id, position, task['title'], task['description'],
+                           str(task['start_time']), str(task['end_time']), task['priority'], task['status']))
+        self.conn.executemany('INSERT INTO assignees (task_id, username, position) VALUES (?, ?, ?)',
+                              [(task['task_id'], username, i) for i, username in enumerate(task['assignees'])])
+        self.conn.executemany('INSERT INTO history (task_id, change, user, time) VALUES (?, ?, ?, ?)',
+                              [(task['task_id'], h['change'], h['user'], h['time']) for h in task['history']])
+        self.conn.executemany('INSERT INTO comments (task_id, username, content, timestamp) VALUES (?, ?, ?, ?)',
+                              [(task['task_id'], c['username'], c['content'], c['timestamp'])
+                               for c in task['comments']])
+
+    @staticmethod
+    def _task_from_row(row) -> dict:
+        return {
+            'task_id': row['task_id'],
+            'title': row['title'],
+            'description': row['description'],
+            'start_time': row['start_time'],
+            'end_time': row['end_time'],
+            'assignees': [],
+            'priority': row['priority'],
+            'status': row['status'],
+            'history': [],
+            'comments': []
+        }
+
+    def _fill_task_lists(self, tasks: dict, where: str, params=()) -> None:
+        for row in self.conn.execute(f'SELECT task_id, username FROM assignees {where} ORDER BY task_id, position',
+                                     params):
+            tasks[row['task_id']]['assignees'].append(row['username'])
+        for row in self.conn.execute(f'SELECT * FROM history {where} ORDER BY id', params):
+            tasks[row['task_id']]['history'].append({'change': row['change'], 'user': row['user'], 'time': row['time']})
+        for row in self.conn.execute(f'SELECT * FROM comments {where} ORDER BY id', params):
+            tasks[row['task_id']]['comments'].append(
+                {'username': row['username'], 'content': row['content'], 'timestamp': row['timestamp']})
@@ -1,5 +1,34 @@
+import atexit
+import copy
 import json
+import marshal
 import os
+import queue
+import signal
+import sqlite3
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+from journal import Journal
+from concurrency import ConflictError, ProjectsDict, file_lock, merge_projects
+from segments import DETAIL_KEYS, Segments
+from models import Project
+from symbols import MARKER, SymbolTable, decode_project, encode_project, is_encoded
+
+
+class PendingWrite:
+    """A save that is not on disk yet.
+
+    A merged save also keeps the changes that made it, as (change, frozen
+    arguments), and the stat key of the file they were made on.
+    """
+    __slots__ = ('data', 'changes', 'disk_key')
+
+    def __init__(self, data: dict, changes=None, disk_key=None):
+        self.data = data
+        self.changes = changes
+        self.disk_key = disk_key
 
 
 class Storage:
@@ -7,42 +36,1174 @@ class Storage:
     USERS_FILE = os.path.join(DATA_DIR, 'users.json')
     PROJECTS_FILE = os.path.join(DATA_DIR, 'projects.json')
     ADMIN_FILE = os.path.join(DATA_DIR, 'admin.json')
+    DB_FILE = os.path.join(DATA_DIR, 'trellomize.db')
+    PROJECTS_DIR = os.path.join(DATA_DIR, 'projects')
+    # the email index is split by a hash of the email into EMAIL_BUCKETS files
+    EMAIL_INDEX_DIR = os.path.join(DATA_DIR, 'email_index')
+    EMAIL_BUCKETS = 256
+    MEMBERSHIP_FILE = os.path.join(DATA_DIR, 'membership.json')
+    SEARCH_INDEX_FILE = os.path.join(DATA_DIR, 'search_index.json')
+    SEARCH_LOG_FILE = os.path.join(DATA_DIR, 'search_index.log')
+    SYMBOLS_FILE = os.path.join(DATA_DIR, 'symbols.json')
+
+    # 'json' keeps the data in the JSON files, 'sharded' keeps one file per project
+    # in PROJECTS_DIR and 'sqlite' keeps it in DB_FILE
+    BACKEND = os.environ.get('TRELLOMIZE_BACKEND', 'json')
+    _sqlite = None
+
+    # journaled mode appends small change records instead of rewriting the whole file;
+    # add_user, upsert_tasks and append_comment write the records of their change and
+    # other saves write the difference to what is on disk
+    JOURNAL = os.environ.get('TRELLOMIZE_JOURNAL') == '1'
+    COMPACT_EVERY = 1000
+    # file path -> number of records in its log
+    _journal_state = {}
+
+    # parsed files are kept in memory until their mtime, size or inode changes
+    CACHE = True
+    _cache = {}
+    _cache_hits = 0
+    _cache_misses = 0
+
+    # task history and comments are kept in append-only files in SEGMENTS_DIR
+    SEGMENTS = os.environ.get('TRELLOMIZE_SEGMENTS') == '1'
+    SEGMENTS_DIR = os.path.join(DATA_DIR, 'segments')
+    _detail_counts = {}
+
+    # project files keep usernames as ids into SYMBOLS_FILE and status/priority as
+    # enum values; they are turned back into names when the file is read
+    SYMBOLS = os.environ.get('TRELLOMIZE_SYMBOLS') == '1'
+    _symbols = None
+
+    # 'json' or 'binary', see binfmt.BinaryFormat
+    FORMAT = os.environ.get('TRELLOMIZE_FORMAT', 'json')
+
+    # saves issued inside Storage.batch() or within GROUP_COMMIT_WINDOW seconds
+    # of each other are written together with one fsync per file
+    GROUP_COMMIT_WINDOW = float(os.environ.get('TRELLOMIZE_GROUP_COMMIT', '0'))
+    # file path -> PendingWrite that is not on disk yet
+    _pending = {}
+    # per thread: the saves of its Storage.batch() and the merge locks it holds
+    _local = threading.local()
+    _timer = None
+    _lock = threading.RLock()
+
+    # 'sync' writes every save before returning, 'async' hands it to a background
+    # writer thread; saves of a file still waiting in the queue are coalesced and
+    # a full queue makes save_data wait
+    DURABILITY = os.environ.get('TRELLOMIZE_DURABILITY', 'sync')
+    WRITE_QUEUE_SIZE = 64
+    _queue = None
+    _writer = None
+    _writing = {}
+    _write_error = None
+    # held while files are written so older snapshots never overwrite newer ones
+    _write_lock = threading.RLock()
+
+    @staticmethod
+    def set_data_dir(data_dir: str) -> None:
+        """Points the storage to another data directory."""
+        Storage.DATA_DIR = data_dir
+        Storage.USERS_FILE = os.path.join(data_dir, 'users.json')
+        Storage.PROJECTS_FILE = os.path.join(data_dir, 'projects.json')
+        Storage.ADMIN_FILE = os.path.join(data_dir, 'admin.json')
+        Storage.DB_FILE = os.path.join(data_dir, 'trellomize.db')
+        Storage.PROJECTS_DIR = os.path.join(data_dir, 'projects')
+        Storage.EMAIL_INDEX_DIR = os.path.join(data_dir, 'email_index')
+        Storage.MEMBERSHIP_FILE = os.path.join(data_dir, 'membership.json')
+        Storage.SEARCH_INDEX_FILE = os.path.join(data_dir, 'search_index.json')
+        Storage.SEARCH_LOG_FILE = os.path.join(data_dir, 'search_index.log')
+        Storage.SYMBOLS_FILE = os.path.join(data_dir, 'symbols.json')
+        Storage.SEGMENTS_DIR = os.path.join(data_dir, 'segments')
+        Storage._journal_state = {}
+        Storage._detail_counts = {}
+        Storage._cache = {}
+        Storage._symbols = None
+        if Storage._sqlite is not None:
+            Storage._sqlite.close()
+            Storage._sqlite = None
+
+    @staticmethod
+    def sqlite():
+        """returns the SQLite backend, opening the database on first use."""
+        if Storage._sqlite is None:
+            from sqlite_storage import SqliteStorage
+            os.makedirs(Storage.DATA_DIR, exist_ok=True)
+            Storage._sqlite = SqliteStorage(Storage.DB_FILE)
+        return Storage._sqlite
 
     @staticmethod
     def load_data(file_path: str) -> dict:
         """It reads the JSON file and returns it as a dictionary."""
-        if not os.path.exists(file_path):
-            return {}
-        with open(file_path, 'r') as file:
-            return json.load(file)
+        data = Storage._in_memory(file_path)
+        if data is not None:
+            return Storage._snapshot(data)
+        if Storage.JOURNAL:
+            return Storage._load_journaled(file_path)
+        return Storage._read_json(file_path)
+
+    @staticmethod
+    def _in_memory(file_path: str):
+        """returns the saved data of a file that is not on disk yet, or None; it is never changed in place."""
+        saves = getattr(Storage._local, 'saves', None)
+        if saves is not None and file_path in saves:
+            return saves[file_path].data
+        with Storage._lock:
+            entry = Storage._pending.get(file_path)
+            if entry is not None:
+                return entry.data
+            return Storage._writing.get(file_path)
+
+    @staticmethod
+    def _deferred() -> bool:
+        return Storage.GROUP_COMMIT_WINDOW > 0 or Storage.DURABILITY == 'async'
 
     @staticmethod
     def save_data(file_path: str, data: dict) -> None:
         """It writes the JSON file and returns it as a dictionary."""
-        with open(file_path, 'w') as file:
-            json.dump(data, file, default=str)
+        if Storage.JOURNAL:
+            Storage._save_journaled(file_path, data)
+            return
+        saves = getattr(Storage._local, 'saves', None)
+        if saves is not None:
+            saves[file_path] = PendingWrite(Storage._snapshot(data))
+        elif not Storage._deferred():
+            Storage.write_through(file_path, data)
+        else:
+            with Storage._lock:
+                queued = file_path in Storage._pending
+                Storage._pending[file_path] = PendingWrite(Storage._snapshot(data))
+            Storage._schedule([] if queued else [file_path])
+
+    @staticmethod
+    def update_merged(file_path: str, change, *args) -> dict:
+        """Saves change(data, *args) of a file that other sessions change too and returns the new data.
+
+        change gets the file as this process sees it and returns what to save,
+        raising ConflictError if it cannot combine the two. A save that is
+        written now reads, changes and writes the file under merge_lock. A
+        deferred one keeps change with a copy of args, and if another process
+        wrote the file in the meantime it is applied again to that file, under
+        the lock, when it is written; a conflict found then is raised by flush().
+        The returned data must not be changed.
+        """
+        if Storage.JOURNAL:
+            with Storage.merge_lock(file_path):
+                data = change(Storage._load_journaled(file_path), *args)
+                Storage._save_journaled(file_path, data)
+            return data
+        saves = getattr(Storage._local, 'saves', None)
+        if saves is not None:
+            return Storage._add_change(saves, file_path, change, args, Storage._freeze(args))
+        if not Storage._deferred() and Storage._in_memory(file_path) is None:
+            with Storage.merge_lock(file_path):
+                with Storage._write_lock:
+                    data = change(Storage._read_json(file_path), *args)
+                    Storage._write_file(file_path, data)
+            return data
+        with Storage._lock:
+            queued = file_path in Storage._pending
+            data = Storage._add_change(Storage._pending, file_path, change, args, Storage._freeze(args))
+        if Storage._deferred():
+            Storage._schedule([] if queued else [file_path])
+        else:
+            # an older save of the file is still being written by another thread
+            Storage._write_pending(file_path)
+        return data
+
+    @staticmethod
+    def _add_change(saves: dict, file_path: str, change, args, frozen) -> dict:
+        """applies a change to the unwritten data of a file in saves and records it there."""
+        entry = saves.get(file_path)
+        disk_key = None
+        if entry is not None:
+            data = Storage._snapshot(entry.data)
+            disk_key = entry.disk_key
+        else:
+            data = Storage._in_memory(file_path)
+            if data is None:
+                disk_key = Storage._stat_key(Storage.disk_path(file_path))
+                data = Storage._read_json(file_path)
+            else:
+                data = Storage._snapshot(data)
+        data = Storage._snapshot(change(data, *args))
+        if entry is not None and entry.changes is None:
+            # on top of a whole-file save the result is one as well
+            saves[file_path] = PendingWrite(data)
+        else:
+            changes = (entry.changes if entry is not None else []) + [(change, frozen)]
+            saves[file_path] = PendingWrite(data, changes, disk_key)
+        return data
+
+    @staticmethod
+    @contextmanager
+    def merge_lock(file_path: str):
+        """Locks a file across reading, changing and writing it, against other threads and processes.
+
+        It is re-entrant within a thread.
+        """
+        held = Storage._local.__dict__.setdefault('locks', set())
+        if file_path in held:
+            yield
+            return
+        with file_lock(file_path):
+            held.add(file_path)
+            try:
+                yield
+            finally:
+                held.discard(file_path)
+
+    @staticmethod
+    def write_through(file_path: str, data: dict) -> None:
+        """writes a data file before returning, dropping any deferred save of it as this one is newer."""
+        if Storage.JOURNAL:
+            Storage._save_journaled(file_path, data)
+            return
+        with Storage.merge_lock(file_path):
+            with Storage._write_lock:
+                with Storage._lock:
+                    Storage._pending.pop(file_path, None)
+                Storage._write_file(file_path, data)
+
+    @staticmethod
+    def _schedule(file_paths) -> None:
+        """hands newly pending saves to the writer thread, or starts the group commit timer."""
+        if Storage._write_error is not None:
+            # a deferred write failed; retry it here so the caller sees the error
+            Storage.flush()
+            return
+        if Storage.DURABILITY == 'async':
+            Storage._enqueue(file_paths)
+            return
+        with Storage._lock:
+            if Storage._timer is None:
+                Storage._timer = threading.Timer(Storage.GROUP_COMMIT_WINDOW, Storage._flush_in_background)
+                Storage._timer.daemon = True
+                Storage._timer.start()
+
+    @staticmethod
+    def _enqueue(file_paths) -> None:
+        """hands pending saves to the writer thread, starting it on first use."""
+        with Storage._lock:
+            if Storage._writer is None or not Storage._writer.is_alive():
+                Storage._queue = queue.Queue(maxsize=Storage.WRITE_QUEUE_SIZE)
+                Storage._writer = threading.Thread(target=Storage._write_behind, name='storage-writer', daemon=True)
+                Storage._writer.start()
+            write_queue = Storage._queue
+        for file_path in file_paths:
+            write_queue.put(file_path)
+
+    @staticmethod
+    def _write_behind() -> None:
+        """the loop of the writer thread: writes the latest save of each queued file."""
+        while True:
+            file_path = Storage._queue.get()
+            try:
+                Storage._write_pending(file_path)
+            except Exception as e:
+                with Storage._lock:
+                    Storage._write_error = e
+            finally:
+                Storage._queue.task_done()
+
+    @staticmethod
+    def _flush_in_background() -> None:
+        try:
+            Storage.flush()
+        except Exception as e:
+            with Storage._lock:
+                Storage._write_error = e
+
+    @staticmethod
+    def _write_pending(file_path: str) -> None:
+        """Writes the pending save of a file under its merge_lock.
+
+        Merged saves are applied again to the file if another process wrote it
+        since they were made. A failed write stays pending, except a conflict,
+        which drops the save as the other session's change is kept.
+        """
+        with Storage.merge_lock(file_path):
+            with Storage._write_lock:
+                with Storage._lock:
+                    entry = Storage._pending.pop(file_path, None)
+                    if entry is None:
+                        return
+                    Storage._writing[file_path] = entry.data
+                try:
+                    data = entry.data
+                    if entry.changes is not None and \
+                            Storage._stat_key(Storage.disk_path(file_path)) != entry.disk_key:
+                        data = Storage._read_json(file_path)
+                        for change, frozen in entry.changes:
+                            data = change(data, *Storage._thaw(frozen))
+                    Storage._write_file(file_path, data)
+                except ConflictError:
+                    raise
+                except BaseException:
+                    with Storage._lock:
+                        Storage._requeue(file_path, entry)
+                    raise
+                finally:
+                    with Storage._lock:
+                        Storage._writing.pop(file_path, None)
+
+    @staticmethod
+    def _requeue(file_path: str, entry) -> None:
+        """puts back a save that could not be written, combined with any newer save of the file."""
+        newer = Storage._pending.get(file_path)
+        if newer is None:
+            Storage._pending[file_path] = entry
+        elif newer.changes is not None:
+            # the newer save was made on top of this one
+            if entry.changes is None:
+                Storage._pending[file_path] = PendingWrite(newer.data)
+            else:
+                Storage._pending[file_path] = PendingWrite(newer.data, entry.changes + newer.changes, entry.disk_key)
+
+    @staticmethod
+    def delete_data(file_path: str) -> None:
+        """removes a data file with its journal, its lock file and any pending write for it."""
+        saves = getattr(Storage._local, 'saves', None)
+        if saves is not None:
+            saves.pop(file_path, None)
+        with Storage.merge_lock(file_path):
+            with Storage._write_lock:
+                with Storage._lock:
+                    Storage._pending.pop(file_path, None)
+                    Storage._cache.pop(file_path, None)
+                    Storage._journal_state.pop(file_path, None)
+                for path in (Storage.disk_path(file_path), Journal.log_path(file_path)):
+                    if os.path.exists(path):
+                        os.remove(path)
+        if file_path not in Storage._local.__dict__.get('locks', ()):
+            try:
+                os.remove(file_path + '.lock')
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def exists(file_path: str) -> bool:
+        """returns whether a data file exists, counting saves that are not written yet."""
+        if Storage._in_memory(file_path) is not None:
+            return True
+        return os.path.exists(Storage.disk_path(file_path))
+
+    @staticmethod
+    def disk_path(file_path: str, file_format=None) -> str:
+        """returns where a data file is kept in the given (or configured) format."""
+        if (file_format or Storage.FORMAT) == 'binary' and file_path.endswith('.json'):
+            return file_path[:-len('.json')] + '.bin'
+        return file_path
+
+    @staticmethod
+    def encode(data: dict, file_format=None) -> bytes:
+        """serializes the data in the given (or configured) format."""
+        if (file_format or Storage.FORMAT) == 'binary':
+            from binfmt import BinaryFormat
+            return BinaryFormat.dumps(data)
+        return json.dumps(data, default=str).encode()
+
+    @staticmethod
+    def decode(raw: bytes, file_format=None) -> dict:
+        """parses data that encode produced."""
+        if (file_format or Storage.FORMAT) == 'binary':
+            from binfmt import BinaryFormat
+            return BinaryFormat.loads(raw)
+        return json.loads(raw)
+
+    @staticmethod
+    def _write_file(file_path: str, data: dict) -> None:
+        """writes a temporary file next to the target and renames it over the target."""
+        raw = Storage.encode(Storage._encode_symbols(file_path, data))
+        disk_path = Storage.disk_path(file_path)
+        directory = os.path.dirname(disk_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(disk_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(raw)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, disk_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        Storage._remember(file_path, data)
+
+    @staticmethod
+    def _snapshot(data: dict) -> dict:
+        """returns a copy of the data that later changes by the caller do not affect."""
+        try:
+            return marshal.loads(marshal.dumps(data))
+        except ValueError:
+            return copy.deepcopy(data)
+
+    @staticmethod
+    def _freeze(data: dict):
+        """returns a compact copy of the data to compare with later."""
+        try:
+            return marshal.dumps(data)
+        except ValueError:
+            return copy.deepcopy(data)
+
+    @staticmethod
+    def _thaw(frozen) -> dict:
+        if isinstance(frozen, bytes):
+            return marshal.loads(frozen)
+        return copy.deepcopy(frozen)
+
+    @staticmethod
+    @contextmanager
+    def batch():
+        """Collects every save of this thread inside the block and writes each file once at the end.
+
+        Other threads see the saves once the block ends. Merged saves are made
+        again on top of what is in the file by then.
+        """
+        local = Storage._local
+        outermost = getattr(local, 'saves', None) is None
+        if outermost:
+            local.saves = {}
+        try:
+            yield
+        finally:
+            if outermost:
+                saves, local.saves = local.saves, None
+                Storage._commit(saves)
+
+    @staticmethod
+    def _commit(saves: dict) -> None:
+        """makes the saves of a batch pending and writes them, or hands them to the writer thread."""
+        file_paths = []
+        with Storage._lock:
+            for file_path, entry in saves.items():
+                if file_path not in Storage._pending:
+                    file_paths.append(file_path)
+                if entry.changes is None or (file_path not in Storage._pending and file_path not in Storage._writing):
+                    Storage._pending[file_path] = entry
+                    continue
+                for change, frozen in entry.changes:
+                    Storage._add_change(Storage._pending, file_path, change, Storage._thaw(frozen), frozen)
+        if Storage.DURABILITY == 'async':
+            Storage._schedule(file_paths)
+            return
+        for file_path in saves:
+            Storage._write_pending(file_path)
+
+    @staticmethod
+    def flush() -> None:
+        """Writes all pending saves, including the ones queued for the writer thread.
+
+        Reads see the pending data until it is on disk. A deferred write that
+        failed earlier is retried; a conflict it found is raised here.
+        """
+        with Storage._lock:
+            file_paths = list(Storage._pending)
+            error, Storage._write_error = Storage._write_error, None
+            if Storage._timer is not None:
+                Storage._timer.cancel()
+                Storage._timer = None
+        for file_path in file_paths:
+            Storage._write_pending(file_path)
+        # wait for a write the writer thread has started
+        with Storage._write_lock:
+            pass
+        if isinstance(error, ConflictError):
+            raise error
+
+    @staticmethod
+    def flush_on_signals() -> None:
+        """makes SIGTERM and SIGHUP write the pending saves before the process exits."""
+        def handler(signum, frame):
+            Storage.flush()
+            raise SystemExit(128 + signum)
+        for name in ('SIGTERM', 'SIGHUP'):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), handler)
+
+    @staticmethod
+    def _stat_key(file_path: str):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    @staticmethod
+    def _read_json(file_path: str) -> dict:
+        """parses the JSON file, or returns a fresh copy of the cached data if the file did not change."""
+        disk_path = Storage.disk_path(file_path)
+        key = Storage._stat_key(disk_path)
+        if key is None:
+            return {}
+        if Storage.CACHE:
+            entry = Storage._cache.get(file_path)
+            if entry is not None and entry[0] == key:
+                Storage._cache_hits += 1
+                # callers modify what they get, so every hit returns its own copy
+                return marshal.loads(entry[1])
+            Storage._cache_misses += 1
+        with open(disk_path, 'rb') as file:
+            data = Storage._decode_symbols(file_path, Storage.decode(file.read()))
+        if Storage.CACHE:
+            Storage._cache[file_path] = (key, marshal.dumps(data))
+        return data
+
+    @staticmethod
+    def _is_project_file(file_path: str) -> bool:
+        return file_path == Storage.PROJECTS_FILE or (os.path.dirname(file_path) == Storage.PROJECTS_DIR and
+                                                      os.path.basename(file_path) != 'manifest.json')
+
+    @staticmethod
+    def symbol_table(reload: bool = False) -> SymbolTable:
+        """returns the username ids, reading SYMBOLS_FILE on first use."""
+        if Storage._symbols is None or reload:
+            Storage._symbols = SymbolTable(Storage._read_json(Storage.SYMBOLS_FILE).get('users', []))
+        return Storage._symbols
+
+    @staticmethod
+    def _encode_symbols(file_path: str, data: dict) -> dict:
+        """encodes the projects of a project file when SYMBOLS is on, saving any new usernames first."""
+        if not Storage.SYMBOLS or not Storage._is_project_file(file_path):
+            return data
+        with file_lock(Storage.SYMBOLS_FILE):
+            # ids are only handed out under the lock and on top of the stored table
+            table = Storage.symbol_table(reload=True)
+            size = len(table.names)
+            if file_path == Storage.PROJECTS_FILE:
+                encoded = {project_id: encode_project(project, table) for project_id, project in data.items()}
+            else:
+                encoded = encode_project(data, table)
+            if len(table.names) > size:
+                Storage._write_file(Storage.SYMBOLS_FILE, {'users': table.names})
+        return encoded
+
+    @staticmethod
+    def _decode_symbols(file_path: str, data: dict) -> dict:
+        if not Storage._is_project_file(file_path):
+            return data
+        if file_path == Storage.PROJECTS_FILE:
+            for project in data.values():
+                Storage._decode_project(project)
+        else:
+            Storage._decode_project(data)
+        return data
+
+    @staticmethod
+    def _decode_project(project: dict) -> dict:
+        if not is_encoded(project):
+            return project
+        try:
+            return decode_project(project, Storage.symbol_table())
+        except IndexError:
+            # another session added usernames since the table was read
+            return decode_project(project, Storage.symbol_table(reload=True))
+
+    @staticmethod
+    def _remember(file_path: str, data: dict) -> None:
+        """puts data that was just written into the cache so the next read does not parse it."""
+        if not Storage.CACHE:
+            return
+        try:
+            Storage._cache[file_path] = (Storage._stat_key(Storage.disk_path(file_path)), marshal.dumps(data))
+        except ValueError:
+            # values that json wrote with default=str are not marshallable
+            Storage._cache.pop(file_path, None)
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """returns the number of cache hits and misses."""
+        return {'hits': Storage._cache_hits, 'misses': Storage._cache_misses, 'entries': len(Storage._cache)}
+
+    @staticmethod
+    def _load_journaled(file_path: str) -> dict:
+        """reads the snapshot and replays the log on top of it."""
+        data = Storage._read_json(file_path)
+        Storage._journal_state[file_path] = Journal.replay(file_path, data)
+        return data
+
+    @staticmethod
+    def _save_journaled(file_path: str, data: dict) -> None:
+        """appends the changes between what is on disk and data to the log."""
+        records = Journal.diff(Storage._load_journaled(file_path), data)
+        if records:
+            Storage._append_journaled(file_path, records)
+
+    @staticmethod
+    def _append_journaled(file_path: str, records: list) -> None:
+        """appends the records of a change, compacting the log every COMPACT_EVERY records."""
+        if file_path not in Storage._journal_state:
+            Storage._journal_state[file_path] = Journal.count(file_path)
+        Journal.append(file_path, records)
+        Storage._journal_state[file_path] += len(records)
+        if Storage._journal_state[file_path] >= Storage.COMPACT_EVERY:
+            Storage.compact(file_path)
+
+    @staticmethod
+    def _journal_project_change(project_id: str, change) -> bool:
+        """Appends the records change(stored project) returns and a version bump, under the projects lock.
+
+        Returns False if the change has to be saved with save_projects: outside
+        journaled mode, with another backend, with segments or for a project
+        that keeps its tasks in a list.
+        """
+        if not Storage.JOURNAL or Storage.BACKEND != 'json' or Storage.SEGMENTS:
+            return False
+        with Storage.merge_lock(Storage.PROJECTS_FILE):
+            project = Storage.load_data(Storage.PROJECTS_FILE).get(project_id)
+            if project is None or not isinstance(project.get('tasks'), dict):
+                return False
+            records = change(project)
+            records.append({'op': 'set', 'path': [project_id, 'version'], 'value': project.get('version', 0) + 1})
+            Storage._append_journaled(Storage.PROJECTS_FILE, records)
+        return True
+
+    @staticmethod
+    def compact(file_path: str) -> None:
+        """Writes the replayed data as a new snapshot and drops the log."""
+        data = Storage._load_journaled(file_path)
+        Storage._write_file(file_path, data)
+        Journal.truncate(file_path)
+        Storage._journal_state[file_path] = 0
 
     @staticmethod
     def load_users() -> dict:
         """It reads the JSON file and returns it as a dictionary."""
+        if Storage.BACKEND == 'sqlite':
+            return Storage.sqlite().load_users()
         return Storage.load_data(Storage.USERS_FILE)
 
     @staticmethod
     def save_users(users):
         """It writes the JSON file and returns it as a dictionary."""
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().save_users(users)
+            return
         Storage.save_data(Storage.USERS_FILE, users)
+        Storage._save_email_index(users)
+
+    @staticmethod
+    def get_user(username: str):
+        """returns one user or None."""
+        if Storage.BACKEND == 'sqlite':
+            return Storage.sqlite().get_user(username)
+        return Storage.load_users().get(username)
+
+    @staticmethod
+    def add_user(username: str, user: dict) -> None:
+        """Adds one user and its email to the email index.
+
+        Only the email index bucket of the email is rewritten; users.json is
+        one file, so the JSON backends still rewrite it whole.
+        """
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().add_user(username, user)
+            return
+        if Storage.JOURNAL:
+            Storage._append_journaled(Storage.USERS_FILE, [{'op': 'set', 'path': [username], 'value': user}])
+        else:
+            users = Storage.load_users()
+            users[username] = user
+            Storage.save_data(Storage.USERS_FILE, users)
+        if not Storage._email_index_built():
+            Storage._save_email_index(Storage.load_users())
+            return
+        bucket_path = Storage._email_bucket(user['email'])
+        Storage.update_merged(bucket_path, Storage._add_email, user['email'], username)
+
+    @staticmethod
+    def _add_email(bucket: dict, email: str, username: str) -> dict:
+        bucket[email] = username
+        return bucket
+
+    @staticmethod
+    def find_user_by_email(email: str):
+        """returns the username that registered the email, or None."""
+        if Storage.BACKEND == 'sqlite':
+            return Storage.sqlite().find_user_by_email(email)
+        if not Storage._email_index_built():
+            Storage._save_email_index(Storage.load_users())
+        return Storage.load_data(Storage._email_bucket(email)).get(email)
+
+    @staticmethod
+    def _email_bucket(email: str) -> str:
+        """returns the email index file that holds the email."""
+        return os.path.join(Storage.EMAIL_INDEX_DIR, f'{zlib.crc32(email.encode()) % Storage.EMAIL_BUCKETS:02x}.json')
+
+    @staticmethod
+    def _email_index_built() -> bool:
+        manifest_path = os.path.join(Storage.EMAIL_INDEX_DIR, 'manifest.json')
+        return Storage.load_data(manifest_path).get('buckets') == Storage.EMAIL_BUCKETS
+
+    @staticmethod
+    def _save_email_index(users: dict) -> None:
+        """rebuilds the email index after the users were replaced as a whole, writing the buckets that changed."""
+        buckets = {}
+        for username, user in users.items():
+            buckets.setdefault(Storage._email_bucket(user['email']), {})[user['email']] = username
+        for number in range(Storage.EMAIL_BUCKETS):
+            bucket_path = os.path.join(Storage.EMAIL_INDEX_DIR, f'{number:02x}.json')
+            bucket = buckets.get(bucket_path, {})
+            if bucket != Storage.load_data(bucket_path):
+                Storage.save_data(bucket_path, bucket)
+        if not Storage._email_index_built():
+            Storage.save_data(os.path.join(Storage.EMAIL_INDEX_DIR, 'manifest.json'), {'buckets': Storage.EMAIL_BUCKETS})
+
+    @staticmethod
+    def user_projects(username: str) -> dict:
+        """returns the ids of the projects the user owns and the ones the user is only a member of."""
+        if Storage.BACKEND == 'sqlite':
+            return Storage.sqlite().user_projects(username)
+        if not Storage.exists(Storage.MEMBERSHIP_FILE):
+            Storage.rebuild_membership()
+        entry = Storage.load_data(Storage.MEMBERSHIP_FILE).get(username, {})
+        return {'owned': entry.get('owned', []), 'member': entry.get('member', [])}
+
+    @staticmethod
+    def index_membership(project_id: str, username: str, role: str) -> None:
+        """records that the user owns (role 'owned') or is a member of (role 'member') the project."""
+        Storage._update_membership([(username, role, project_id, True)])
+
+    @staticmethod
+    def unindex_membership(project_id: str, username: str) -> None:
+        """records that the user left the project; an owner who leaves the members still owns it."""
+        Storage._update_membership([(username, 'member', project_id, False)])
+
+    @staticmethod
+    def unindex_project(project_id: str, project: dict) -> None:
+        """removes a deleted project from the entries of its owner and members."""
+        Storage._update_membership([(username, role, project_id, False)
+                                    for username in set(project['members'] + [project['owner']])
+                                    for role in ('owned', 'member')])
+
+    @staticmethod
+    def _update_membership(changes: list) -> None:
+        if Storage.BACKEND == 'sqlite':
+            return
+        if not Storage.exists(Storage.MEMBERSHIP_FILE):
+            Storage.rebuild_membership()
+            return
+        Storage.update_merged(Storage.MEMBERSHIP_FILE, Storage._apply_membership, changes)
+
+    @staticmethod
+    def _apply_membership(index: dict, changes: list) -> dict:
+        for username, role, project_id, add in changes:
+            ids = index.setdefault(username, {'owned': [], 'member': []})[role]
+            if add and project_id not in ids:
+                ids.append(project_id)
+            elif not add and project_id in ids:
+                ids.remove(project_id)
+        return index
+
+    @staticmethod
+    def rebuild_membership() -> None:
+        """builds the user to projects index from the projects."""
+        if Storage.BACKEND == 'sqlite':
+            return
+        index = {}
+        for project_id, project in Storage.iter_projects(fields=('owner', 'members')):
+            index.setdefault(project['owner'], {'owned': [], 'member': []})['owned'].append(project_id)
+            for username in project['members']:
+                if username != project['owner']:
+                    index.setdefault(username, {'owned': [], 'member': []})['member'].append(project_id)
+        Storage.update_merged(Storage.MEMBERSHIP_FILE, Storage._replace, index)
+
+    @staticmethod
+    def _replace(data: dict, new: dict) -> dict:
+        return new
 
     @staticmethod
     def load_projects():
         """It reads the JSON file and returns it as a dictionary."""
-        return Storage.load_data(Storage.PROJECTS_FILE)
+        if Storage.BACKEND == 'sqlite':
+            return Storage.sqlite().load_projects()
+        if Storage.BACKEND == 'sharded':
+            from shards import ShardedProjects
+            return ShardedProjects(Storage.PROJECTS_DIR, Storage)
+        data = Storage.load_data(Storage.PROJECTS_FILE)
+        for project in data.values():
+            Storage.normalize_project(project)
+        projects = ProjectsDict(data)
+        projects.base = Storage._freeze(data)
+        return projects
 
     @staticmethod
     def save_projects(projects):
         """It writes the JSON file and returns it as a dictionary."""
-        Storage.save_data(Storage.PROJECTS_FILE, projects)
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().save_projects(projects)
+            return
+        if Storage.BACKEND == 'sharded':
+            from shards import ShardedProjects
+            if not isinstance(projects, ShardedProjects):
+                sharded = ShardedProjects(Storage.PROJECTS_DIR, Storage)
+                sharded.overwrite = True
+                for project_id in list(sharded):
+                    if project_id not in projects:
+                        del sharded[project_id]
+                sharded.update(projects)
+                projects = sharded
+            projects.save()
+            return
+        for project in projects.values():
+            Storage.normalize_project(project)
+        data = projects
+        if Storage.SEGMENTS:
+            data = {project_id: Storage.split_details(project_id, project) for project_id, project in projects.items()}
+        if not isinstance(projects, ProjectsDict) or projects.base is None:
+            Storage.save_data(Storage.PROJECTS_FILE, data)
+            return
+        base = Storage._thaw(projects.base)
+        # only the projects this session changed are taken from it, the rest comes from disk
+        Storage.update_merged(Storage.PROJECTS_FILE, Storage._merge_projects, base, dict(data))
+        for project_id, project in data.items():
+            if 'version' in project:
+                projects[project_id]['version'] = project['version']
+        for project_id in base:
+            if project_id not in projects:
+                Storage.drop_details(project_id)
+        projects.base = Storage._freeze(dict(data))
+
+    @staticmethod
+    def _merge_projects(theirs: dict, base: dict, ours: dict) -> dict:
+        for project in theirs.values():
+            Storage.normalize_project(project)
+        return merge_projects(base, ours, theirs)
 
     @staticmethod
     def load_admin():
         """It reads the JSON file and returns it as a dictionary."""
+        if Storage.BACKEND == 'sqlite':
+            return Storage.sqlite().load_admin()
         return Storage.load_data(Storage.ADMIN_FILE)
+
+    @staticmethod
+    def iter_projects(fields=None):
+        """Yields (project_id, project) pairs one at a time, keeping only the given fields."""
+        if Storage.BACKEND == 'sqlite':
+            yield from Storage.sqlite().iter_projects(fields)
+            return
+        if Storage.BACKEND == 'sharded':
+            from shards import ShardedProjects
+            sharded = ShardedProjects(Storage.PROJECTS_DIR, Storage)
+            for project_id in sharded:
+                project = Storage.load_data(sharded.shard_path(project_id))
+                yield project_id, Storage._pick(project, fields)
+            return
+        for project_id, project in Storage._iter_file(Storage.PROJECTS_FILE):
+            yield project_id, Storage._pick(project, fields)
+
+    @staticmethod
+    def iter_users():
+        """Yields (username, user) pairs one at a time."""
+        if Storage.BACKEND == 'sqlite':
+            yield from Storage.sqlite().load_users().items()
+            return
+        yield from Storage._iter_file(Storage.USERS_FILE)
+
+    @staticmethod
+    def _iter_file(file_path: str):
+        """yields the top-level entries of a data file, streaming it from disk when nothing newer is in memory."""
+        in_memory = Storage._in_memory(file_path) is not None
+        if in_memory or (Storage.JOURNAL and os.path.exists(Journal.log_path(file_path))):
+            yield from Storage.load_data(file_path).items()
+            return
+        disk_path = Storage.disk_path(file_path)
+        if not os.path.exists(disk_path):
+            return
+        if Storage.FORMAT == 'binary':
+            from binfmt import BinaryFormat
+            with open(disk_path, 'rb') as file:
+                yield from BinaryFormat.iter_object(file)
+            return
+        from jsonstream import iter_object
+        with open(disk_path, 'r') as file:
+            yield from iter_object(file)
+
+    @staticmethod
+    def _pick(project: dict, fields) -> dict:
+        if fields is None:
+            return Storage.normalize_project(Storage._decode_project(project))
+        picked = {field: project[field] for field in tuple(fields) + (MARKER,) if field in project}
+        return Storage.normalize_project(Storage._decode_project(picked))
+
+    @staticmethod
+    def normalize_project(project: dict) -> dict:
+        """turns the task list of projects saved by older versions into a task_id to task mapping."""
+        if isinstance(project.get('tasks'), list):
+            project['tasks'] = {task['task_id']: task for task in project['tasks']}
+        return project
+
+    @staticmethod
+    def save_admin(admin: dict) -> None:
+        """It writes the admin information."""
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().save_admin(admin)
+            return
+        Storage.save_data(Storage.ADMIN_FILE, admin)
+
+    @staticmethod
+    def get_project(project_id: str):
+        """returns a single project or None if it does not exist."""
+        if Storage.BACKEND == 'sqlite':
+            return Storage.sqlite().get_project(project_id)
+        return Storage.load_projects().get(project_id)
+
+    @staticmethod
+    def add_project(project_id: str, project: dict) -> None:
+        """adds a new project; raises ConflictError if another session added one with the same id."""
+        if Storage.BACKEND == 'sqlite':
+            try:
+                Storage.sqlite().add_project(project_id, project)
+            except sqlite3.IntegrityError:
+                raise ConflictError(project_id, []) from None
+            return
+        projects = Storage.load_projects()
+        if project_id in projects:
+            raise ConflictError(project_id, [])
+        projects[project_id] = project
+        Storage.save_projects(projects)
+
+    @staticmethod
+    def rename_project(project_id: str, title: str) -> None:
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().rename_project(project_id, title)
+            return
+        projects = Storage.load_projects()
+        projects[project_id]['title'] = title
+        Storage.save_projects(projects)
+
+    @staticmethod
+    def delete_project(project_id: str) -> None:
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().delete_project(project_id)
+            return
+        projects = Storage.load_projects()
+        projects.pop(project_id, None)
+        Storage.save_projects(projects)
+
+    @staticmethod
+    def add_member(project_id: str, username: str) -> None:
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().add_member(project_id, username)
+            return
+        projects = Storage.load_projects()
+        if username not in projects[project_id]['members']:
+            projects[project_id]['members'].append(username)
+            Storage.save_projects(projects)
+
+    @staticmethod
+    def remove_member(project_id: str, username: str) -> None:
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().remove_member(project_id, username)
+            return
+        projects = Storage.load_projects()
+        if username in projects[project_id]['members']:
+            projects[project_id]['members'].remove(username)
+            Storage.save_projects(projects)
+
+    @staticmethod
+    def delete_task(project_id: str, task_id: str) -> None:
+        """removes a task from the project and its board."""
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().delete_task(project_id, task_id)
+            return
+        projects = Storage.load_projects()
+        board = Project.from_dict(project_id, Storage.normalize_project(projects[project_id]))
+        board.delete_task(task_id)
+        projects[project_id].update(board.to_dict())
+        Storage.save_projects(projects)
+
+    @staticmethod
+    def task_page(project_id: str, status: str, offset: int, limit: int, sort_by: str = 'board'):
+        """Returns one page of a board column and the size of the column.
+
+        The tasks of the page are returned without their history and comments;
+        the SQLite backend reads only those rows.
+        """
+        return Storage.task_pages(project_id, {status: offset}, limit, sort_by)[status]
+
+    @staticmethod
+    def task_pages(project_id: str, offsets: dict, limit: int, sort_by: str = 'board') -> dict:
+        """Returns a page of several board columns, reading the project once.
+
+        offsets maps a status to where its page starts; the result maps it to
+        the tasks of the page and the size of the column, as task_page does.
+        """
+        if Storage.BACKEND == 'sqlite':
+            return {status: Storage.sqlite().task_page(project_id, status, offset, limit, sort_by)
+                    for status, offset in offsets.items()}
+        project = Storage.get_project(project_id)
+        if project is None:
+            return {status: ([], 0) for status in offsets}
+        board = Project.from_dict(project_id, Storage.normalize_project(project))
+        pages = {}
+        for status, offset in offsets.items():
+            tasks = [{key: value for key, value in board.get_task(task_id).items() if key not in DETAIL_KEYS}
+                     for task_id in board.page(status, offset, limit, sort_by)]
+            pages[status] = (tasks, board.count(status=status))
+        return pages
+
+    @staticmethod
+    def upsert_task(project_id: str, task: dict) -> None:
+        """adds the task to the project or replaces the task with the same task_id."""
+        Storage.upsert_tasks(project_id, [task])
+
+    @staticmethod
+    def upsert_tasks(project_id: str, tasks: list) -> None:
+        """adds or replaces several tasks of a project with a single write."""
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().upsert_tasks(project_id, tasks)
+            return
+        if Storage._journal_project_change(project_id, lambda stored: Storage._task_records(project_id, stored, tasks)):
+            return
+        projects = Storage.load_projects()
+        project = Project.from_dict(project_id, projects[project_id])
+        for task in tasks:
+            project.update_task(task)
+        projects[project_id].update(project.to_dict())
+        Storage.save_projects(projects)
+
+    @staticmethod
+    def _task_records(project_id: str, stored: dict, tasks: list) -> list:
+        """returns the journal records that add or replace the tasks of a stored project and move them on its board."""
+        old = {'board': stored.get('board', {}), 'priorities': stored.get('priorities', {})}
+        old_tasks = {task['task_id']: stored['tasks'].get(task['task_id']) for task in tasks}
+        project = Project.from_dict(project_id, stored)
+        records = []
+        for task in tasks:
+            project.update_task(task)
+            path = [project_id, 'tasks', task['task_id']]
+            if old_tasks[task['task_id']] is None:
+                records.append({'op': 'set', 'path': path, 'value': task})
+            else:
+                records += Journal.diff(old_tasks[task['task_id']], task, path)
+        new = project.to_dict()
+        return records + Journal.diff(old, {'board': new['board'], 'priorities': new['priorities']}, [project_id])
+
+    @staticmethod
+    def append_comment(project_id: str, task_id: str, comment: dict, history: dict = None) -> None:
+        """adds a comment to the task, and the history entry recording it if one is given."""
+        entries = {'comments': [comment], 'history': [history] if history is not None else []}
+        if Storage.BACKEND == 'sqlite':
+            Storage.sqlite().append_comment(project_id, task_id, comment, history)
+            return
+        if Storage.SEGMENTS:
+            Segments.append(Segments.path(Storage.SEGMENTS_DIR, project_id),
+                            [{'task_id': task_id, 'kind': kind, 'entry': entry}
+                             for kind, values in entries.items() for entry in values])
+            counts = Storage._detail_counts.get(project_id, {}).get(task_id)
+            if counts is not None:
+                for kind, values in entries.items():
+                    counts[kind] += len(values)
+            return
+        if Storage._journal_project_change(project_id, lambda stored: [
+                Journal.append_record([project_id, 'tasks', task_id, kind], len(stored['tasks'][task_id][kind]), values)
+                for kind, values in entries.items() if values]):
+            return
+        projects = Storage.load_projects()
+        for kind, values in entries.items():
+            projects[project_id]['tasks'][task_id][kind].extend(values)
+        Storage.save_projects(projects)
+
+    @staticmethod
+    def load_task_details(project_id: str, task: dict) -> dict:
+        """Fills in the history and comments of a task when they are kept in a segment file."""
+        if not task or all(kind in task for kind in DETAIL_KEYS):
+            return task
+        details = Segments.read(Segments.path(Storage.SEGMENTS_DIR, project_id), task['task_id'])
+        for kind, entries in details.items():
+            task.setdefault(kind, entries)
+        Storage._detail_counts.setdefault(project_id, {})[task['task_id']] = \
+            {kind: len(entries) for kind, entries in details.items()}
+        return task
+
+    @staticmethod
+    def load_project_details(project_id: str, project: dict) -> dict:
+        """Fills in the history and comments of every task of a project, reading its segment once."""
+        tasks = [task for task in project.get('tasks', {}).values() if not all(kind in task for kind in DETAIL_KEYS)]
+        if not tasks:
+            return project
+        details = Segments.read_all(Segments.path(Storage.SEGMENTS_DIR, project_id))
+        counts = Storage._detail_counts.setdefault(project_id, {})
+        for task in tasks:
+            entries = details.get(task['task_id'], {kind: [] for kind in DETAIL_KEYS})
+            for kind in DETAIL_KEYS:
+                task.setdefault(kind, entries[kind])
+            counts[task['task_id']] = {kind: len(entries[kind]) for kind in DETAIL_KEYS}
+        return project
+
+    @staticmethod
+    def split_details(project_id: str, project: dict) -> dict:
+        """Appends new history and comments of a project to its segment and returns the project without them."""
+        if not Storage.SEGMENTS:
+            return project
+        project, records = Segments.split(project, Storage._detail_counts.setdefault(project_id, {}))
+        Segments.append(Segments.path(Storage.SEGMENTS_DIR, project_id), records)
+        return project
+
+    @staticmethod
+    def drop_details(project_id: str) -> None:
+        """removes the segment of a removed project."""
+        Storage._detail_counts.pop(project_id, None)
+        path = Segments.path(Storage.SEGMENTS_DIR, project_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def migrate_to_sqlite() -> None:
+        """Copies the JSON files of the data directory into the SQLite database.
+
+        The projects come from the shards when BACKEND is 'sharded' and from
+        projects.json otherwise, with the history and comments kept in segments.
+        """
+        if Storage.BACKEND == 'sqlite':
+            # the database is what is written, so the projects are read from projects.json
+            stored = ((project_id, Storage._pick(project, None))
+                      for project_id, project in Storage._iter_file(Storage.PROJECTS_FILE))
+        else:
+            stored = Storage.iter_projects()
+        projects = {project_id: Storage.load_project_details(project_id, project) for project_id, project in stored}
+        users = Storage.load_data(Storage.USERS_FILE)
+        admin = Storage.load_data(Storage.ADMIN_FILE)
+        db = Storage.sqlite()
+        db.save_users(users)
+        db.save_projects(projects)
+        db.save_admin(admin)
+
+    @staticmethod
+    def convert_format(file_format: str) -> list:
+        """rewrites every data file of the data directory in the given format and returns the new paths."""
+        old_format = 'binary' if file_format == 'json' else 'json'
+        # the username table goes first so the projects that refer to it can be read
+        file_paths = [Storage.SYMBOLS_FILE, Storage.USERS_FILE, Storage.PROJECTS_FILE, Storage.ADMIN_FILE,
+                      Storage.MEMBERSHIP_FILE, Storage.SEARCH_INDEX_FILE]
+        for directory in (Storage.PROJECTS_DIR, Storage.EMAIL_INDEX_DIR):
+            if os.path.isdir(directory):
+                file_paths += [os.path.join(directory, name[:-len('.bin')] + '.json' if name.endswith('.bin') else name)
+                               for name in os.listdir(directory) if name.endswith(('.json', '.bin'))]
+        Storage.FORMAT = file_format
+        converted = []
+        for file_path in file_paths:
+            old_path = Storage.disk_path(file_path, old_format)
+            if not os.path.exists(old_path):
+                continue
+            with open(old_path, 'rb') as file:
+                data = Storage._decode_symbols(file_path, Storage.decode(file.read(), old_format))
+            Storage._write_file(file_path, data)
+            os.remove(old_path)
+            converted.append(Storage.disk_path(file_path))
+        Storage._cache = {}
+        return converted
+
+    @staticmethod
+    def migrate_to_shards() -> None:
+        """splits projects.json into one file per project."""
+        from shards import ShardedProjects
+        sharded = ShardedProjects(Storage.PROJECTS_DIR, Storage)
+        sharded.update(Storage.load_data(Storage.PROJECTS_FILE))
+        sharded.save()
+
+
+atexit.register(Storage.flush)
@@ -0,0 +1,94 @@
+import sys
+from models import TaskPriority, TaskStatus
+
+MARKER = 'encoding'
+
+
+class SymbolTable:
+    """Dense integer ids for usernames, in the order they were first written."""
+
+    def __init__(self, names=()):
+        self.names = [sys.intern(name) for name in names]
+        self.ids = {name: number for number, name in enumerate(self.names)}
+
+    def id(self, name: str) -> int:
+        """returns the id of a username, giving it the next one if it has none."""
+        number = self.ids.get(name)
+        if number is None:
+            number = self.ids[name] = len(self.names)
+            self.names.append(sys.intern(name))
+        return number
+
+    def name(self, value):
+        """returns the username of an id; names that were stored as they are come back unchanged."""
+        if isinstance(value, int) and not isinstance(value, bool):
+            return self.names[value]
+        return value
+
+
+def _map_entries(entries: list, key: str, convert) -> list:
+    return [dict(entry, **{key: convert(entry[key])}) if key in entry else entry for entry in entries]
+
+
+def encode_project(project: dict, table: SymbolTable) -> dict:
+    """Returns a copy of the project with usernames as ids and status/priority as enum values."""
+    encoded = dict(project)
+    encoded[MARKER] = 'symbols'
+    if 'owner' in project:
+        encoded['owner'] = table.id(project['owner'])
+    if 'members' in project:
+        encoded['members'] = [table.id(name) for name in project['members']]
+    if 'tasks' in project:
+        tasks = project['tasks']
+        encoded['tasks'] = {task_id: _encode_task(task, table) for task_id, task in tasks.items()} \
+            if isinstance(tasks, dict) else [_encode_task(task, table) for task in tasks]
+    return encoded
+
+
+def _encode_task(task: dict, table: SymbolTable) -> dict:
+    encoded = dict(task)
+    if task.get('status') in TaskStatus.__members__:
+        encoded['status'] = TaskStatus[task['status']].value
+    if task.get('priority') in TaskPriority.__members__:
+        encoded['priority'] = TaskPriority[task['priority']].value
+    if 'assignees' in task:
+        encoded['assignees'] = [table.id(name) for name in task['assignees']]
+    if 'history' in task:
+        encoded['history'] = _map_entries(task['history'], 'user', table.id)
+    if 'comments' in task:
+        encoded['comments'] = _map_entries(task['comments'], 'username', table.id)
+    return encoded
+
+
+def is_encoded(project: dict) -> bool:
+    return isinstance(project, dict) and project.get(MARKER) == 'symbols'
+
+
+def decode_project(project: dict, table: SymbolTable) -> dict:
+    """Turns a project written by encode_project back into its usual form, in place.
+
+    Raises IndexError if the project refers to a username the table does not
+    have yet; fields already decoded are left as they are, so it can be retried
+    with a newer table.
+    """
+    if not is_encoded(project):
+        return project
+    if 'owner' in project:
+        project['owner'] = table.name(project['owner'])
+    if 'members' in project:
+        project['members'] = [table.name(value) for value in project['members']]
+    tasks = project.get('tasks', {})
+    for task in tasks.values() if isinstance(tasks, dict) else tasks:
+        if isinstance(task.get('status'), int):
+            task['status'] = TaskStatus(task['status']).name
+        if isinstance(task.get('priority'), int):
+            task['priority'] = TaskPriority(task['priority']).name
+        if 'assignees' in task:
+            task['assignees'] = [table.name(value) for value in task['assignees']]
+        if 'history' in task:
+            task['history'] = _map_entries(task['history'], 'user', table.name)
+        if 'comments' in task:
+            task['comments'] = _map_entries(task['comments'], 'username', table.name)
+    del project[MARKER]
+    return project
+
@@ -1,5 +1,31 @@
+import asyncio
+import copy
+import csv
+import io
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 from models import User, Project, Task, TaskPriority, TaskStatus
+from storage import Storage
+from journal import Journal
+from concurrency import ConflictError
+from search import SearchIndex, search_tasks
+from session import AuthenticationError, Sessions
+from utils import Utils
+from importer import import_records, iter_records
+import exporter
+from server import RpcServer
+import logger as logging_setup
+from logger import SAMPLING, BatchSink, log1, log_event, timed
+from loguru import logger
+from service import AlreadyExistsError, NotFoundError, PermissionDeniedError, TrelloService
+from datetime import datetime
 
 class TestProjectManagement(unittest.TestCase):
     def test_user_creation(self):
@@ -37,7 +63,821 @@ class TestProjectManagement(unittest.TestCase):
         task = Task('Test Task', 'Description of the task')
         project.add_task(task)
         self.assertEqual(len(project.tasks), 1)
-        self.assertEqual(project.tasks[0].title, 'Test Task')
+        self.assertEqual(project.tasks[task.task_id].title, 'Test Task')
+
+    def test_task_round_trip(self):
+        task = Task('Test Task', 'Test Description', ['testuser'])
+        data = task.to_dict()
+        self.assertEqual(data['start_time'], task.start_time.isoformat())
+        rebuilt = Task.from_dict(data)
+        self.assertEqual(rebuilt.task_id, task.task_id)
+        self.assertEqual(rebuilt.to_dict(), data)
+        details = {key: value for key, value in data.items() if key not in ('history', 'comments')}
+        self.assertEqual(Task.from_dict(details).to_dict(), details)
+        self.assertFalse(hasattr(rebuilt, '__dict__'))
+
+    def test_task_lookup_by_id(self):
+        project = Project('1', 'Test Project', 'testuser')
+        first = Task('First Task')
+        second = Task('Second Task')
+        project.add_task(first)
+        project.add_task(second)
+        self.assertIs(project.get_task(second.task_id), second)
+        first.update_title('Renamed')
+        project.update_task(first)
+        self.assertEqual(list(project.tasks), [first.task_id, second.task_id])
+        project.delete_task(first.task_id)
+        self.assertIsNone(project.get_task(first.task_id))
+
+    def test_status_buckets(self):
+        project = Project('1', 'Test Project', 'testuser')
+        tasks = [Task(f'Task {i}') for i in range(4)]
+        for task in tasks:
+            project.add_task(task)
+        project.update_status(tasks[1].task_id, TaskStatus.DOING.name)
+        project.update_priority(tasks[2].task_id, TaskPriority.HIGH.name)
+        self.assertEqual(project.task_ids(status=TaskStatus.BACKLOG.name),
+                         [tasks[0].task_id, tasks[2].task_id, tasks[3].task_id])
+        self.assertEqual(project.count(status=TaskStatus.DOING.name), 1)
+        self.assertEqual(project.task_ids(priority=TaskPriority.HIGH.name), [tasks[2].task_id])
+        stored = Project.from_dict('1', project.to_dict())
+        stored.delete_task(tasks[0].task_id)
+        self.assertEqual(stored.task_ids(status=TaskStatus.BACKLOG.name), [tasks[2].task_id, tasks[3].task_id])
+        # only the buckets the task leaves and enters stop being the stored lists
+        stored.update_status(tasks[3].task_id, TaskStatus.DONE.name)
+        self.assertIsInstance(stored.board[TaskStatus.DOING.name], list)
+        self.assertIsInstance(stored.priorities[TaskPriority.HIGH.name], list)
+        self.assertEqual(stored.task_ids(status=TaskStatus.DONE.name), [tasks[3].task_id])
+        task = stored.get_task(tasks[2].task_id)
+        task.status = TaskStatus.DOING.name
+        stored.update_task(task)
+        self.assertEqual(stored.task_ids(status=TaskStatus.DOING.name), [tasks[1].task_id, tasks[2].task_id])
+        self.assertEqual(stored.task_ids(status=TaskStatus.BACKLOG.name), [])
+
+    def test_bulk_update(self):
+        project = Project('1', 'Test Project', 'testuser')
+        tasks = [Task(f'Task {i}', assignees=['testuser'], status=TaskStatus.DOING.name) for i in range(3)]
+        tasks[2].status = TaskStatus.TODO.name
+        for task in tasks:
+            project.add_task(task.to_dict())
+        task_ids = project.find_tasks(status=TaskStatus.DOING.name, assignee='testuser')
+        self.assertEqual(task_ids, [tasks[0].task_id, tasks[1].task_id])
+        changed = project.bulk_update(task_ids, 'testuser', status=TaskStatus.DONE.name, unassign='testuser')
+        self.assertEqual(len(changed), 2)
+        self.assertEqual(project.count(status=TaskStatus.DONE.name), 2)
+        self.assertEqual(len(project.get_task(tasks[0].task_id)['history']), 2)
+        self.assertEqual(project.bulk_update(task_ids, 'testuser', status=TaskStatus.DONE.name), [])
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.old_dir = Storage.DATA_DIR
+        Storage.set_data_dir(self.tmp.name)
+        self.old_log_file = logging_setup.LOG_FILE
+        logging_setup.LOG_FILE = os.path.join(self.tmp.name, 'file.log')
+
+    def tearDown(self):
+        Storage.JOURNAL = False
+        Storage.BACKEND = 'json'
+        Storage.FORMAT = 'json'
+        Storage.SEGMENTS = False
+        Storage.flush()
+        Storage.DURABILITY = 'sync'
+        Storage.GROUP_COMMIT_WINDOW = 0
+        Storage.set_data_dir(self.old_dir)
+        logging_setup.shutdown()
+        logging_setup.LOG_FILE = self.old_log_file
+        self.tmp.cleanup()
+
+    def test_journal_replay(self):
+        Storage.JOURNAL = True
+        projects = {'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'], 'tasks': []}}
+        Storage.save_projects(projects)
+        projects['1']['members'].append('newuser')
+        projects['2'] = {'title': 'Other', 'owner': 'newuser', 'members': ['newuser'], 'tasks': []}
+        Storage.save_projects(projects)
+        self.assertTrue(os.path.exists(Journal.log_path(Storage.PROJECTS_FILE)))
+        Storage.set_data_dir(self.tmp.name)
+        self.assertEqual(Storage.load_projects(), projects)
+
+    def test_journal_records(self):
+        Storage.JOURNAL = True
+        task = {'task_id': 't1', 'title': 'Test Task', 'status': 'TODO', 'priority': 'LOW', 'history': [],
+                'comments': [{'username': 'testuser', 'content': 'first', 'timestamp': 'now'}]}
+        Storage.save_projects({'1': Project('1', 'Test Project', 'testuser').to_dict()})
+        Storage.upsert_task('1', task)
+        Storage.compact(Storage.PROJECTS_FILE)
+        Storage.append_comment('1', 't1', {'username': 'testuser', 'content': 'second', 'timestamp': 'now'})
+        Storage.upsert_task('1', dict(task, status='DONE'))
+        with open(Journal.log_path(Storage.PROJECTS_FILE)) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(records[0], {'op': 'append', 'path': ['1', 'tasks', 't1', 'comments'], 'at': 1,
+                                      'values': [{'username': 'testuser', 'content': 'second', 'timestamp': 'now'}]})
+        self.assertIn({'op': 'set', 'path': ['1', 'tasks', 't1', 'status'], 'value': 'DONE'}, records)
+        project = Storage.get_project('1')
+        self.assertEqual(project['board']['DONE'], ['t1'])
+        self.assertEqual(project['version'], 3)
+        # replaying the log again on a snapshot that already has it changes nothing
+        projects = Storage.load_data(Storage.PROJECTS_FILE)
+        Journal.replay(Storage.PROJECTS_FILE, projects)
+        self.assertEqual(projects, Storage.load_data(Storage.PROJECTS_FILE))
+
+    def test_journal_compact(self):
+        Storage.JOURNAL = True
+        Storage.save_users({'testuser': {'email': 'testuser@example.com', 'is_active': True}})
+        Storage.compact(Storage.USERS_FILE)
+        self.assertFalse(os.path.exists(Journal.log_path(Storage.USERS_FILE)))
+        Storage.JOURNAL = False
+        self.assertIn('testuser', Storage.load_users())
+        import manager
+        data_dir = os.path.join(self.tmp.name, 'compacted')
+        Storage.set_data_dir(data_dir)
+        Storage.JOURNAL = True
+        Storage.save_users({'newuser': {'email': 'newuser@example.com', 'is_active': True}})
+        Storage.set_data_dir(self.old_dir)
+        manager.compact_data(data_dir)
+        self.assertFalse(os.path.exists(Journal.log_path(os.path.join(data_dir, 'users.json'))))
+
+    def test_sqlite_backend(self):
+        task = {'task_id': 't1', 'title': 'Test Task', 'description': 'Description of the task',
+                'start_time': '2024-05-01T10:00:00', 'end_time': '2024-05-02T10:00:00', 'assignees': ['testuser'],
+                'priority': 'LOW', 'status': 'BACKLOG', 'history': [], 'comments': []}
+        projects = {'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'], 'tasks': {'t1': task}}}
+        Storage.save_projects(projects)
+        Storage.migrate_to_sqlite()
+        Storage.BACKEND = 'sqlite'
+        self.assertEqual(Storage.load_projects(), {'1': dict(projects['1'], version=0)})
+        Storage.append_comment('1', 't1', {'username': 'testuser', 'content': 'hi', 'timestamp': 'now'})
+        task['status'] = 'DONE'
+        Storage.upsert_task('1', task)
+        project = Storage.get_project('1')
+        self.assertEqual(project['tasks']['t1']['status'], 'DONE')
+        self.assertIsNone(Storage.get_project('2'))
+
+    def test_migrate_to_sqlite(self):
+        task = {'task_id': 't1', 'title': 'Test Task', 'description': '', 'start_time': '2024-05-01T10:00:00',
+                'end_time': '2024-05-02T10:00:00', 'assignees': ['testuser'], 'priority': 'LOW', 'status': 'TODO',
+                'history': [{'change': 'created', 'user': 'testuser', 'time': '2024-05-01T10:00:00'}],
+                'comments': [{'username': 'testuser', 'content': 'hi', 'timestamp': '2024-05-01T11:00:00'}]}
+        for backend, segments in (('json', False), ('json', True), ('sharded', False), ('sharded', True)):
+            with self.subTest(backend=backend, segments=segments):
+                Storage.set_data_dir(os.path.join(self.tmp.name, f'{backend}-{segments}'))
+                Storage.BACKEND, Storage.SEGMENTS = backend, segments
+                Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                             'tasks': {'t1': copy.deepcopy(task)}}})
+                Storage.migrate_to_sqlite()
+                Storage.BACKEND, Storage.SEGMENTS = 'sqlite', False
+                self.assertEqual(Storage.get_project('1')['tasks']['t1'], task)
+
+    def test_sharded_backend(self):
+        Storage.BACKEND = 'sharded'
+        Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                     'tasks': []},
+                               '2': {'title': 'Other', 'owner': 'newuser', 'members': ['newuser'], 'tasks': []}})
+        projects = Storage.load_projects()
+        self.assertEqual(sorted(projects), ['1', '2'])
+        projects['1']['members'].append('newuser')
+        del projects['2']
+        Storage.save_projects(projects)
+        self.assertEqual(os.listdir(Storage.PROJECTS_DIR).count('p_2.json'), 0)
+        self.assertEqual(Storage.get_project('1')['members'], ['testuser', 'newuser'])
+
+    def test_remove_and_recreate_shard(self):
+        Storage.BACKEND, Storage.JOURNAL = 'sharded', True
+        TrelloService.register('testuser', 'password123', 'testuser@example.com')
+        service = TrelloService('testuser')
+        service.create_project('1', 'Test Project')
+        service.rename_project('1', 'Renamed')
+        service.remove_project('1')
+        self.assertEqual([name for name in os.listdir(Storage.PROJECTS_DIR) if name.startswith('p_1.json')], [])
+        service.create_project('1', 'Test Project')
+        service.rename_project('1', 'Again')
+        self.assertEqual(Storage.get_project('1')['title'], 'Again')
+
+    def test_purge_data(self):
+        import manager
+        data_dir = os.path.join(self.tmp.name, 'purged')
+        for backend, file_format in (('json', 'binary'), ('sharded', 'json'), ('sqlite', 'json')):
+            Storage.set_data_dir(data_dir)
+            Storage.BACKEND, Storage.FORMAT, Storage.JOURNAL, Storage.SEGMENTS = backend, file_format, True, True
+            TrelloService.register(backend, 'password123', f'{backend}@example.com')
+            service = TrelloService(backend)
+            service.create_project(backend, 'Test Project')
+            task = service.add_task(backend, 'Test Task', '', [backend])
+            service.add_comment(backend, task['task_id'], 'hi')
+        Storage.set_data_dir(self.old_dir)
+        manager.purge_data(data_dir)
+        self.assertEqual([name for _, _, names in os.walk(data_dir) for name in names], [])
+
+    def test_shard_names(self):
+        Storage.BACKEND = 'sharded'
+        Storage.save_projects({'manifest': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                            'tasks': []},
+                               'a/b': {'title': 'Other', 'owner': 'newuser', 'members': ['newuser'], 'tasks': []}})
+        self.assertEqual(sorted(Storage.load_projects()), ['a/b', 'manifest'])
+        self.assertEqual(Storage.get_project('manifest')['title'], 'Test Project')
+        self.assertEqual(sorted(name for name, _ in Storage.iter_projects()), ['a/b', 'manifest'])
+        projects = Storage.load_projects()
+        del projects['manifest']
+        Storage.save_projects(projects)
+        self.assertEqual(sorted(Storage.load_projects()), ['a/b'])
+
+    def test_read_cache(self):
+        Storage.save_users({'testuser': {'email': 'testuser@example.com', 'is_active': True}})
+        hits = Storage.cache_stats()['hits']
+        users = Storage.load_users()
+        users['testuser']['is_active'] = False
+        self.assertTrue(Storage.load_users()['testuser']['is_active'])
+        self.assertEqual(Storage.cache_stats()['hits'], hits + 2)
+        with open(Storage.USERS_FILE, 'w') as file:
+            file.write('{"other": {}}')
+        self.assertEqual(Storage.load_users(), {'other': {}})
+        # written files are cached under the name the callers use, whatever the format
+        Storage.FORMAT = 'binary'
+        Storage.save_users({'testuser': {'email': 'testuser@example.com', 'is_active': True}})
+        hits = Storage.cache_stats()['hits']
+        self.assertTrue(Storage.load_users()['testuser']['is_active'])
+        self.assertEqual(Storage.cache_stats()['hits'], hits + 1)
+
+    def test_batch_writes_once(self):
+        with Storage.batch():
+            for i in range(5):
+                projects = Storage.load_projects()
+                projects[str(i)] = {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                    'tasks': []}
+                Storage.save_projects(projects)
+            self.assertFalse(os.path.exists(Storage.PROJECTS_FILE))
+        self.assertEqual(len(Storage.load_projects()), 5)
+        self.assertEqual([name for name in os.listdir(self.tmp.name) if name.endswith('.tmp')], [])
+
+    def test_write_behind(self):
+        Storage.DURABILITY = 'async'
+        # the writer thread cannot write while this thread holds the write lock
+        with Storage._write_lock:
+            for i in range(20):
+                projects = Storage.load_projects()
+                projects[str(i)] = {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                    'tasks': {}}
+                Storage.save_projects(projects)
+                self.assertEqual(len(Storage.load_projects()), i + 1)
+            self.assertFalse(os.path.exists(Storage.PROJECTS_FILE))
+        Storage.flush()
+        with open(Storage.PROJECTS_FILE) as file:
+            self.assertEqual(len(json.load(file)), 20)
+
+    def test_group_commit(self):
+        Storage.save_projects({'1': Project('1', 'Test Project', 'testuser').to_dict()})
+        Storage.GROUP_COMMIT_WINDOW = 60
+        written = []
+        write_file = Storage._write_file
+
+        def counting(file_path, data):
+            written.append(file_path)
+            write_file(file_path, data)
+        Storage._write_file = staticmethod(counting)
+        try:
+            for i in range(20):
+                Storage.upsert_task('1', Task('t%d' % i, '', ['testuser']).to_dict())
+            self.assertEqual(written, [])
+            self.assertEqual(len(Storage.get_project('1')['tasks']), 20)
+            Storage.flush()
+        finally:
+            Storage._write_file = staticmethod(write_file)
+        self.assertEqual(written, [Storage.PROJECTS_FILE])
+        with open(Storage.PROJECTS_FILE) as file:
+            self.assertEqual(len(json.load(file)['1']['tasks']), 20)
+
+    def test_merge_lock_between_threads(self):
+        inside, done = threading.Event(), threading.Event()
+
+        def batching():
+            with Storage.batch():
+                inside.set()
+                done.wait(5)
+        batcher = threading.Thread(target=batching)
+        batcher.start()
+        inside.wait(5)
+        acquired = threading.Event()
+
+        def merging():
+            with Storage.merge_lock(Storage.PROJECTS_FILE):
+                acquired.set()
+            Storage.save_data(Storage.ADMIN_FILE, {'username': 'admin'})
+        with Storage.merge_lock(Storage.PROJECTS_FILE):
+            merger = threading.Thread(target=merging)
+            merger.start()
+            self.assertFalse(acquired.wait(0.2))
+        merger.join(5)
+        self.assertTrue(acquired.is_set())
+        # the other thread's batch does not hold back this save
+        self.assertTrue(os.path.exists(Storage.ADMIN_FILE))
+        done.set()
+        batcher.join(5)
+
+    def test_threads_save_projects(self):
+        def create(n):
+            for i in range(5):
+                projects = Storage.load_projects()
+                projects['%d-%d' % (n, i)] = {'title': 'Test Project', 'owner': 'user%d' % n,
+                                              'members': ['user%d' % n], 'tasks': {}}
+                with Storage.batch():
+                    Storage.save_projects(projects)
+                    Storage.index_membership('%d-%d' % (n, i), 'user%d' % n, 'owned')
+        Storage.rebuild_membership()
+        threads = [threading.Thread(target=create, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(Storage.load_projects()), 20)
+        self.assertEqual(len(Storage.load_data(Storage.MEMBERSHIP_FILE)['user3']['owned']), 5)
+
+    def test_iter_projects_fields(self):
+        projects = {str(i): {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser', str(i)],
+                             'tasks': {'t': {'task_id': 't', 'title': '}'}}} for i in range(50)}
+        Storage.save_projects(projects)
+        from jsonstream import iter_object
+        with open(Storage.PROJECTS_FILE) as file:
+            self.assertEqual(dict(iter_object(file, chunk_size=7)), projects)
+        items = list(Storage.iter_projects(fields=('owner', 'members')))
+        self.assertEqual(len(items), 50)
+        self.assertEqual(items[3], ('3', {'owner': 'testuser', 'members': ['testuser', '3']}))
+
+    def test_binary_format(self):
+        task = {'task_id': 't1', 'title': 'Test Task', 'description': '', 'start_time': '2024-05-01T10:00:00.000123',
+                'end_time': '2024-05-02T10:00:00', 'assignees': ['testuser'], 'priority': 'LOW',
+                'status': 'BACKLOG', 'history': [{'change': 'title', 'user': 'testuser', 'time': 'not a time'}],
+                'comments': []}
+        projects = {'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'], 'tasks': {'t1': task}}}
+        Storage.save_projects(projects)
+        Storage.add_user('testuser', {'password': '', 'email': 'testuser@example.com', 'is_active': True})
+        Storage.user_projects('testuser')
+        SearchIndex.load()
+        Storage.convert_format('binary')
+        self.assertFalse(os.path.exists(Storage.PROJECTS_FILE))
+        data_files = [name for _, _, names in os.walk(self.tmp.name) for name in names]
+        self.assertEqual([name for name in data_files if name.endswith('.json')], [])
+        self.assertEqual(Storage.find_user_by_email('testuser@example.com'), 'testuser')
+        self.assertEqual(Storage.user_projects('testuser'), {'owned': ['1'], 'member': []})
+        self.assertEqual([r['task_id'] for r in SearchIndex.load().search('test')], ['t1'])
+        self.assertEqual(Storage.load_projects(), projects)
+        self.assertEqual(dict(Storage.iter_projects()), projects)
+        Storage.convert_format('json')
+        self.assertEqual(Storage.load_projects(), projects)
+
+    def test_sessions(self):
+        Storage.add_user('testuser', {'password': Utils.hash_password('password123'),
+                                      'email': 'testuser@example.com', 'is_active': True})
+        with self.assertRaises(AuthenticationError):
+            Sessions.login('testuser', 'wrong')
+        first = Sessions.login('testuser', 'password123')
+        second = Sessions.login('testuser', 'password123')
+        self.assertNotEqual(first.token, second.token)
+        self.assertEqual(Sessions.get(first.token).username, 'testuser')
+        Sessions.logout(first.token)
+        self.assertIsNone(Sessions.get(first.token))
+        Sessions.invalidate_user('testuser')
+        self.assertIsNone(Sessions.get(second.token))
+
+    def test_bulk_import(self):
+        path = os.path.join(self.tmp.name, 'team.jsonl')
+        with open(path, 'w') as file:
+            for record in [{'type': 'user', 'username': 'testuser', 'password': 'pw', 'email': 'testuser@example.com'},
+                           {'type': 'user', 'username': 'newuser', 'password': 'pw', 'email': 'newuser@example.com'},
+                           {'type': 'user', 'username': 'other', 'password': 'pw', 'email': 'newuser@example.com'},
+                           {'type': 'project', 'project_id': '1', 'title': 'Test Project', 'owner': 'testuser'},
+                           {'type': 'member', 'project_id': '1', 'username': 'newuser'},
+                           {'type': 'task', 'project_id': '1', 'title': 'Test Task', 'assignees': ['newuser'],
+                            'status': 'TODO'},
+                           {'type': 'task', 'project_id': '2', 'title': 'Lost Task'},
+                           {'type': 'task', 'project_id': '1', 'task_id': 't1', 'title': 'Open Task'},
+                           {'type': 'task', 'project_id': '1', 'task_id': 't1', 'title': 'Same Task'},
+                           {'type': 'project', 'project_id': '3', 'title': 'Other Project', 'owner': 'testuser'},
+                           {'type': 'task', 'project_id': '3', 'task_id': 't1', 'title': 'Other Task'}]:
+                file.write(json.dumps(record) + '\n')
+        totals = import_records(iter_records(path), chunk_size=2)
+        self.assertEqual(totals['imported'], 7)
+        self.assertEqual([number for number, _ in totals['errors']], [3, 7, 9, 11])
+        self.assertEqual(Storage.get_project('3')['tasks'], {})
+        self.assertEqual(Storage.find_user_by_email('newuser@example.com'), 'newuser')
+        project = Storage.get_project('1')
+        self.assertEqual(project['members'], ['testuser', 'newuser'])
+        self.assertEqual(len(project['board']['TODO']), 1)
+        self.assertEqual(project['tasks']['t1']['title'], 'Open Task')
+        self.assertEqual(project['tasks']['t1']['assignees'], [""])
+        self.assertEqual(Storage.user_projects('newuser'), {'owned': [], 'member': ['1']})
+
+    def test_streaming_export(self):
+        Storage.SEGMENTS = True
+        Storage.save_users({'testuser': {'password': '', 'email': 'testuser@example.com', 'is_active': True}})
+        tasks = {task_id: {'task_id': task_id, 'title': task_id, 'start_time': start, 'assignees': ['testuser'],
+                           'status': status, 'priority': 'LOW', 'history': [], 'comments': [{'content': task_id}]}
+                 for task_id, start, status in [('t1', '2024-05-01T10:00:00', 'DONE'),
+                                                 ('t2', '2024-06-01T10:00:00', 'DONE'),
+                                                 ('t3', '2024-05-02T10:00:00', 'TODO')]}
+        Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                     'tasks': tasks}})
+        Storage.set_data_dir(self.tmp.name)
+        records = exporter.iter_tasks(statuses={'DONE'}, until=datetime(2024, 5, 31), details=True)
+        self.assertEqual([(r['task_id'], r['comments']) for r in records], [('t1', [{'content': 't1'}])])
+        out = io.StringIO()
+        self.assertEqual(exporter.write_csv(itertools.chain(exporter.iter_users(), exporter.iter_tasks()), out), 4)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual((rows[0]['type'], rows[1]['assignees']), ('user', 'testuser'))
+
+    def test_service(self):
+        TrelloService.register('testuser', 'password123', 'testuser@example.com')
+        TrelloService.register('newuser', 'password123', 'newuser@example.com')
+        with self.assertRaises(AlreadyExistsError):
+            TrelloService.register('testuser', 'password123', 'other@example.com')
+        owner, token = TrelloService.login('testuser', 'password123')
+        member = TrelloService.from_token(Sessions.login('newuser', 'password123').token)
+        owner.create_project('1', 'Test Project')
+        with self.assertRaises(PermissionDeniedError):
+            member.open_project('1')
+        owner.add_member('1', 'newuser')
+        task = owner.add_task('1', 'Test Task', 'Description of the task', ['newuser'])
+        with self.assertRaises(PermissionDeniedError):
+            owner.update_status('1', task['task_id'], TaskStatus.DONE.name)
+        member.update_status('1', task['task_id'], TaskStatus.DONE.name)
+        member.add_comment('1', task['task_id'], 'done')
+        self.assertEqual(member.board('1').task_ids(status=TaskStatus.DONE.name), [task['task_id']])
+        stored = member.get_task('1', task['task_id'])
+        self.assertEqual([entry['change'] for entry in stored['history']], ['status update to DONE', 'comment'])
+        self.assertEqual([result['task_id'] for result in member.search('done')], [task['task_id']])
+        with self.assertRaises(NotFoundError):
+            member.delete_task('1', 'missing')
+
+    def test_add_comment_appends(self):
+        for backend, journal, segments in (('sqlite', False, False), ('json', True, False), ('json', False, True)):
+            with self.subTest(backend=backend, journal=journal, segments=segments):
+                Storage.set_data_dir(os.path.join(self.tmp.name, f'{backend}-{journal}-{segments}'))
+                Storage.BACKEND, Storage.JOURNAL, Storage.SEGMENTS = backend, journal, segments
+                TrelloService.register('testuser', 'password123', 'testuser@example.com')
+                service = TrelloService('testuser')
+                service.create_project('1', 'Test Project')
+                task = service.add_task('1', 'Test Task', '', ['testuser'])
+                service.add_comment('1', task['task_id'], 'first')
+                returned = service.add_comment('1', task['task_id'], 'second')
+                stored = service.get_task('1', task['task_id'])
+                self.assertEqual([comment['content'] for comment in stored['comments']], ['first', 'second'])
+                self.assertEqual([entry['change'] for entry in stored['history']], ['comment', 'comment'])
+                self.assertEqual(returned, stored)
+
+    def test_bulk_edit_segments(self):
+        Storage.SEGMENTS = True
+        TrelloService.register('testuser', 'password123', 'testuser@example.com')
+        service = TrelloService('testuser')
+        service.create_project('1', 'Test Project')
+        tasks = [service.add_task('1', f'Task {i}', '', ['testuser']) for i in range(3)]
+        service.update_status('1', tasks[0]['task_id'], TaskStatus.DOING.name)
+        self.assertEqual(service.bulk_edit('1', {'status': TaskStatus.BACKLOG.name}, {'status': 'DONE'}), 2)
+        for task, status in zip(tasks, ('DOING', 'DONE', 'DONE')):
+            stored = service.get_task('1', task['task_id'])
+            self.assertEqual([entry['change'] for entry in stored['history']], [f'status update to {status}'])
+
+    def test_board_page(self):
+        priorities = ['LOW', 'CRITICAL', 'MEDIUM', 'HIGH']
+        tasks = {}
+        for i in range(25):
+            end_time = None if i % 5 == 0 else f'2024-06-{30 - i:02d}T10:00:00'
+            task = Task(f'Task {i}', '', ['testuser'], priorities[i % 4], 'TODO' if i < 23 else 'DONE').to_dict()
+            task['end_time'] = end_time
+            tasks[task['task_id']] = task
+        ids = list(tasks)
+        project = Project('1', 'Test Project', 'testuser')
+        for task in tasks.values():
+            project.add_task(task)
+        service = TrelloService('testuser')
+        for backend in (Storage.BACKEND, 'sqlite'):
+            Storage.BACKEND = backend
+            TrelloService.register('testuser', 'password123', 'testuser@example.com')
+            TrelloService.register('newuser', 'password123', 'newuser@example.com')
+            Storage.save_projects({'1': copy.deepcopy(project.to_dict())})
+            Storage.rebuild_membership()
+            page = service.board_page('1', 'TODO', 2, 10)
+            self.assertEqual((page['total'], page['pages']), (23, 3))
+            self.assertEqual([task['task_id'] for task in page['tasks']], ids[20:23])
+            self.assertNotIn('history', page['tasks'][0])
+            page = service.board_page('1', 'TODO', 0, 7, 'priority')
+            self.assertEqual([task['task_id'] for task in page['tasks']], [ids[i] for i in (1, 5, 9, 13, 17, 21, 3)])
+            page = service.board_page('1', 'TODO', 0, 3, 'end_time')
+            self.assertEqual([task['task_id'] for task in page['tasks']], [ids[i] for i in (22, 21, 19)])
+            page = service.board_page('1', 'TODO', 2, 10, 'end_time')
+            self.assertEqual([task['task_id'] for task in page['tasks']], [ids[i] for i in (10, 15, 20)])
+            with self.assertRaises(PermissionDeniedError):
+                TrelloService('newuser').board_page('1', 'TODO')
+            columns = {column['status']: column for column in service.board_pages('1', {'TODO': 2}, 10)}
+            self.assertEqual(list(columns), [status.name for status in TaskStatus])
+            self.assertEqual(columns['TODO'], service.board_page('1', 'TODO', 2, 10))
+            self.assertEqual((columns['DONE']['page'], columns['DONE']['total']), (0, 2))
+
+    def test_structured_logging(self):
+        sink = BatchSink(os.path.join(self.tmp.name, 'file.log'))
+        handler = logger.add(sink, format="{message}")
+        default_sink, logging_setup._sink = logging_setup._sink, sink
+        SAMPLING['noisy_event'] = 0.0
+        try:
+            log1.info("plain message")
+            for i in range(300):
+                log_event('noisy_event', 'testuser')
+                log_event('task_updated', 'testuser', '1', str(i), change='title')
+            with timed('bulk_edit', 'testuser', '1') as fields:
+                fields['tasks'] = 300
+            sink.flush()
+        finally:
+            logger.remove(handler)
+            logging_setup._sink = default_sink
+            del SAMPLING['noisy_event']
+        with open(sink.path) as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(len(records), 302)
+        self.assertEqual(records[0]['message'], "plain message")
+        self.assertEqual(records[6], dict(records[6], actor='testuser', action='task_updated', project_id='1',
+                                          task_id='5', change='title'))
+        self.assertEqual(records[-1]['tasks'], 300)
+        self.assertGreaterEqual(records[-1]['duration'], 0)
+
+    def test_logging_setup(self):
+        self.assertEqual(logging_setup.parse_sampling('search=0.1,bad, task_updated = 0.5,=0.2,x=abc,'),
+                         {'search': 0.1, 'task_updated': 0.5})
+        messages = []
+        handler = logger.add(messages.append, format="{message}")
+        try:
+            logging_setup.shutdown()
+            log1.info("plain message")
+        finally:
+            logger.remove(handler)
+        self.assertEqual(messages, ["plain message\n"])
+
+    def test_rpc_server(self):
+        socket_path = os.path.join(self.tmp.name, 'server.sock')
+
+        async def session():
+            server = RpcServer()
+            task = asyncio.create_task(server.serve(socket_path))
+            while not os.path.exists(socket_path):
+                await asyncio.sleep(0.01)
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+
+            def send(request_id, method, **params):
+                writer.write(json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method,
+                                         'params': params}).encode() + b'\n')
+
+            async def rpc(request_id, method, **params):
+                send(request_id, method, **params)
+                await writer.drain()
+                return json.loads(await reader.readline())
+
+            await rpc(1, 'register', username='testuser', password='password123', email='testuser@example.com')
+            token = (await rpc(2, 'login', username='testuser', password='password123'))['result']['token']
+            await rpc(3, 'create_project', token=token, project_id='1', title='Test Project')
+            for i in range(5):
+                send(4 + i, 'add_task', token=token, project_id='1', title=f'Task {i}', description='',
+                     assignees=['testuser'])
+            await writer.drain()
+            added = [json.loads(await reader.readline()) for _ in range(5)]
+            board = await rpc(10, 'board', token=token, project_id='1')
+            missing = await rpc(11, 'remove_member', token=token, project_id='2', username='testuser')
+            unknown = await rpc(12, 'drop_tables', token=token)
+            ended = await rpc(13, 'list_projects', token='not a token')
+            writer.close()
+            task.cancel()
+            return added, board, missing, unknown, ended
+
+        added, board, missing, unknown, ended = asyncio.run(session())
+        self.assertTrue(all('result' in response for response in added))
+        self.assertEqual(len(board['result']['tasks']), 5)
+        self.assertEqual(missing['error']['data']['type'], 'NotFoundError')
+        self.assertEqual(unknown['error']['code'], -32601)
+        self.assertEqual((ended['error']['code'], ended['error']['data']['type']), (-32001, 'SessionEndedError'))
+        self.assertEqual(len(Storage.get_project('1')['tasks']), 5)
+
+    def test_rpc_server_sqlite(self):
+        Storage.BACKEND = 'sqlite'
+        TrelloService.register('testuser', 'password123', 'testuser@example.com')
+        server = RpcServer()
+
+        async def session():
+            def call(method, **params):
+                return server.handle({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params})
+
+            logins = await asyncio.gather(*[call('login', username='testuser', password='password123')
+                                            for _ in range(8)])
+            token = logins[0]['result']['token']
+            await call('create_project', token=token, project_id='1', title='Test Project')
+            added = await asyncio.gather(*[call('add_task', token=token, project_id='1', title=f'Task {i}',
+                                                description='', assignees=['testuser']) for i in range(8)])
+            return logins, added
+
+        logins, added = asyncio.run(session())
+        server.executor.shutdown(wait=True)
+        self.assertTrue(all('result' in response for response in logins + added))
+        self.assertEqual(len(Storage.get_project('1')['tasks']), 8)
+        self.assertEqual(len(server.locks), 0)
+
+    def test_sqlite_versions(self):
+        Storage.BACKEND = 'sqlite'
+        Storage.save_projects({str(i): {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                        'tasks': {}} for i in range(2)})
+        first = Storage.load_projects()
+        second = Storage.load_projects()
+        first['0']['title'] = 'First'
+        Storage.save_projects(first)
+        self.assertEqual(first['0']['version'], 1)
+        # a project the other session did not change is saved as usual
+        second['1']['title'] = 'Second'
+        Storage.save_projects(second)
+        second['0']['title'] = 'Second'
+        self.assertRaises(ConflictError, Storage.save_projects, second)
+        self.assertEqual(Storage.get_project('0')['title'], 'First')
+        Storage.rename_project('1', 'Renamed')
+        del first['1']
+        self.assertRaises(ConflictError, Storage.save_projects, first)
+
+    def test_sqlite_row_writes(self):
+        Storage.BACKEND = 'sqlite'
+        for username in ('testuser', 'newuser'):
+            TrelloService.register(username, 'password123', f'{username}@example.com')
+        service = TrelloService('testuser')
+        statements = []
+        Storage.sqlite().conn.set_trace_callback(statements.append)
+        service.create_project('1', 'Test Project')
+        service.create_project('2', 'Other Project')
+        task = service.add_task('1', 'Test Task', '', ['testuser'])
+        service.add_member('1', 'newuser')
+        service.rename_project('1', 'Renamed')
+        service.remove_member('1', 'newuser')
+        service.delete_task('1', task['task_id'])
+        self.assertNotIn('DELETE FROM projects', statements)
+        self.assertEqual(Storage.get_project('1'), {'title': 'Renamed', 'owner': 'testuser', 'members': ['testuser'],
+                                                    'tasks': {}, 'version': 5})
+        service.remove_project('2')
+        self.assertEqual(list(Storage.load_projects()), ['1'])
+
+    def test_symbol_encoding(self):
+        Storage.SYMBOLS = True
+        task = {'task_id': 't1', 'title': 'Test Task', 'assignees': ['newuser'], 'priority': 'HIGH',
+                'status': 'DOING', 'history': [{'change': 'title', 'user': 'testuser', 'time': 'now'}],
+                'comments': [{'username': 'newuser', 'content': 'hi', 'timestamp': 'now'}]}
+        projects = {'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser', 'newuser'],
+                          'tasks': {'t1': task}}}
+        Storage.save_projects(projects)
+        with open(Storage.PROJECTS_FILE) as file:
+            stored = json.load(file)['1']
+        self.assertEqual(stored['members'], [0, 1])
+        self.assertEqual(stored['tasks']['t1']['status'], TaskStatus.DOING.value)
+        self.assertEqual(stored['tasks']['t1']['comments'][0]['username'], 1)
+        Storage.set_data_dir(self.tmp.name)
+        self.assertEqual(Storage.load_projects(), projects)
+        self.assertEqual(dict(Storage.iter_projects()), projects)
+        Storage.SYMBOLS = False
+        self.assertEqual(Storage.user_projects('newuser'), {'owned': [], 'member': ['1']})
+
+    def test_concurrent_sessions_merge(self):
+        for backend in ('json', 'sharded'):
+            Storage.BACKEND = backend
+            Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                         'tasks': []}})
+            first = Storage.load_projects()
+            second = Storage.load_projects()
+            version = first['1'].get('version', 0)
+            first['1']['members'].append('newuser')
+            Storage.save_projects(first)
+            second['1']['title'] = 'Renamed'
+            Storage.save_projects(second)
+            project = Storage.get_project('1')
+            self.assertEqual(project['members'], ['testuser', 'newuser'])
+            self.assertEqual(project['title'], 'Renamed')
+            self.assertEqual(project['version'], version + 2)
+
+    def test_deferred_saves_across_processes(self):
+        script = (
+            "import sys\n"
+            "from storage import Storage\n"
+            "from models import Task\n"
+            "Storage.set_data_dir(sys.argv[1])\n"
+            "for i in range(10):\n"
+            "    Storage.upsert_task('1', Task(sys.argv[2] + str(i), '', ['testuser']).to_dict())\n"
+        )
+        for settings in ({'TRELLOMIZE_DURABILITY': 'async'}, {'TRELLOMIZE_GROUP_COMMIT': '0.05'}):
+            Storage.save_projects({'1': Project('1', 'Test Project', 'testuser').to_dict()})
+            env = dict(os.environ, **settings)
+            workers = [subprocess.Popen([sys.executable, '-c', script, self.tmp.name, name], env=env,
+                                        cwd=os.path.dirname(os.path.abspath(__file__))) for name in ('a', 'b')]
+            self.assertEqual([worker.wait() for worker in workers], [0, 0])
+            self.assertEqual(len(Storage.get_project('1')['tasks']), 20)
+
+    def test_concurrent_sessions_conflict(self):
+        Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                     'tasks': []}})
+        first = Storage.load_projects()
+        second = Storage.load_projects()
+        first['1']['title'] = 'First'
+        Storage.save_projects(first)
+        second['1']['title'] = 'Second'
+        self.assertRaises(ConflictError, Storage.save_projects, second)
+
+    def test_details_in_segments(self):
+        Storage.SEGMENTS = True
+        task = {'task_id': 't1', 'title': 'Test Task', 'assignees': ['testuser'], 'status': 'BACKLOG',
+                'history': [{'change': 'title', 'user': 'testuser', 'time': 'now'}], 'comments': []}
+        Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'],
+                                     'tasks': {'t1': task}}})
+        projects = Storage.load_projects()
+        loaded = projects['1']['tasks']['t1']
+        self.assertNotIn('history', loaded)
+        Storage.load_task_details('1', loaded)
+        self.assertEqual(loaded['history'], task['history'])
+        loaded['comments'].append({'username': 'testuser', 'content': 'hi', 'timestamp': 'now'})
+        Storage.save_projects(projects)
+        Storage.save_projects(projects)
+        details = Storage.load_task_details('1', {'task_id': 't1'})
+        self.assertEqual(len(details['history']), 1)
+        self.assertEqual(len(details['comments']), 1)
+
+    def test_email_index(self):
+        Storage.save_users({'testuser': {'password': '', 'email': 'testuser@example.com', 'is_active': True}})
+        shutil.rmtree(Storage.EMAIL_INDEX_DIR)
+        self.assertEqual(Storage.find_user_by_email('testuser@example.com'), 'testuser')
+        bucket_path = Storage._email_bucket('newuser@example.com')
+        Storage.add_user('newuser', {'password': '', 'email': 'newuser@example.com', 'is_active': True})
+        self.assertEqual(Storage.load_data(bucket_path), {'newuser@example.com': 'newuser'})
+        self.assertEqual(Storage.find_user_by_email('newuser@example.com'), 'newuser')
+        self.assertIsNone(Storage.find_user_by_email('other@example.com'))
+        Storage.BACKEND = 'sqlite'
+        Storage.add_user('newuser', {'password': '', 'email': 'newuser@example.com', 'is_active': True})
+        self.assertEqual(Storage.find_user_by_email('newuser@example.com'), 'newuser')
+
+    def test_membership_index(self):
+        Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser', 'newuser'],
+                                     'tasks': []}})
+        self.assertEqual(Storage.user_projects('newuser'), {'owned': [], 'member': ['1']})
+        Storage.index_membership('2', 'newuser', 'owned')
+        Storage.unindex_membership('1', 'newuser')
+        self.assertEqual(Storage.user_projects('newuser'), {'owned': ['2'], 'member': []})
+        # the owner leaving the members still owns the project
+        Storage.unindex_membership('1', 'testuser')
+        self.assertEqual(Storage.user_projects('testuser'), {'owned': ['1'], 'member': []})
+        Storage.unindex_project('1', {'owner': 'testuser', 'members': ['testuser']})
+        self.assertEqual(Storage.user_projects('testuser'), {'owned': [], 'member': []})
+        Storage.BACKEND = 'sqlite'
+        Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['newuser'],
+                                     'tasks': []}})
+        self.assertEqual(Storage.user_projects('testuser'), {'owned': ['1'], 'member': []})
+        self.assertEqual(Storage.user_projects('newuser'), {'owned': [], 'member': ['1']})
+
+    def test_legacy_task_list(self):
+        with open(Storage.PROJECTS_FILE, 'w') as file:
+            file.write('{"1": {"title": "Test Project", "owner": "testuser", "members": ["testuser"], '
+                       '"tasks": [{"task_id": "t1", "title": "Test Task", "status": "TODO", "priority": "LOW"}]}}')
+        self.assertEqual(Storage.get_project('1')['tasks']['t1']['title'], 'Test Task')
+        Storage.upsert_task('1', {'task_id': 't2', 'title': 'Second Task', 'status': 'TODO', 'priority': 'LOW'})
+        self.assertEqual(list(Storage.get_project('1')['tasks']), ['t1', 't2'])
+        self.assertEqual(Storage.get_project('1')['board']['TODO'], ['t1', 't2'])
+
+    def test_search_index(self):
+        Storage.save_projects({
+            '1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'], 'tasks': {
+                't1': {'task_id': 't1', 'title': 'Fix login page', 'description': 'the form', 'status': 'TODO',
+                       'priority': 'LOW', 'comments': [{'content': 'password reset too'}]}}},
+            '2': {'title': 'Other Project', 'owner': 'newuser', 'members': ['newuser'], 'tasks': {
+                't2': {'task_id': 't2', 'title': 'Login audit', 'description': 'fix logs', 'status': 'TODO',
+                       'priority': 'LOW', 'comments': []}}}})
+        self.assertEqual([r['task_id'] for r in search_tasks('testuser', 'log')], ['t1'])
+        self.assertEqual([r['task_id'] for r in SearchIndex.load().search('fix log')], ['t1', 't2'])
+        self.assertEqual([r['task_id'] for r in SearchIndex.load().search('passw')], ['t1'])
+        SearchIndex.task_changed('2', {'task_id': 't2', 'title': 'Audit', 'description': '', 'comments': []})
+        self.assertEqual([r['task_id'] for r in SearchIndex.load().search('login')], ['t1'])
+        SearchIndex.project_removed('1')
+        self.assertEqual(SearchIndex.load().search('login'), [])
+
+    def test_search_index_log(self):
+        Storage.save_projects({'1': {'title': 'Test Project', 'owner': 'testuser', 'members': ['testuser'], 'tasks': {
+            't1': {'task_id': 't1', 'title': 'Fix login page', 'status': 'TODO', 'priority': 'LOW', 'comments': []}}}})
+        SearchIndex.load()
+        snapshot = os.stat(Storage.disk_path(Storage.SEARCH_INDEX_FILE)).st_mtime_ns
+        SearchIndex.task_changed('1', {'task_id': 't2', 'title': 'Login audit', 'description': '', 'comments': []})
+        SearchIndex.task_removed('t1')
+        self.assertEqual(os.stat(Storage.disk_path(Storage.SEARCH_INDEX_FILE)).st_mtime_ns, snapshot)
+        with open(Storage.SEARCH_LOG_FILE) as file:
+            self.assertEqual(len(file.readlines()), 2)
+        # another process reads the snapshot and replays the log
+        SearchIndex._cached = None
+        self.assertEqual([r['task_id'] for r in SearchIndex.load().search('log')], ['t2'])
+        old_compact = SearchIndex.COMPACT_EVERY
+        SearchIndex.COMPACT_EVERY = 3
+        try:
+            SearchIndex.task_changed('1', {'task_id': 't3', 'title': 'Logout', 'description': '', 'comments': []})
+        finally:
+            SearchIndex.COMPACT_EVERY = old_compact
+        self.assertFalse(os.path.exists(Storage.SEARCH_LOG_FILE))
+        SearchIndex._cached = None
+        index = SearchIndex.load()
+        self.assertEqual(index._words, sorted(index.postings))
+        self.assertEqual([r['task_id'] for r in index.search('log')], ['t2', 't3'])
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file